@@ -0,0 +1,360 @@
+#! python3
+
+# Archive.py - A script that handles recording what the RDAP and GeoIP sites answered and playing it back later
+
+####### VERSION HISTORY #######
+# Version 1: Added 'ResponseArchive' class to save every answer (URL, status, and body) to one gzipped file,
+#               keeping each distinct body only once
+#            Added 'ArchivedResponse' class so played back answers look like the ones 'requests' hands back
+#            Added 'startRecording', 'startReplay', 'stop', and 'getArchive' functions to share one archive
+#               between modules (or set GRIP_RECORD / GRIP_REPLAY to the archive's path)
+#            Edited 'ResponseArchive' to write out a clean copy before recording onto a file that got cut off
+###############################
+
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import os.path
+import threading
+import zlib
+
+# What the archive is doing
+RECORD = 'record'
+REPLAY = 'replay'
+
+# The archive shared by Transport.py, AsyncLookup.py, RDAP.py, and GEOIP.py (see 'getArchive')
+_archive = None
+_archive_lock = threading.Lock()
+_archive_set = False
+
+
+
+# Raised when an archive can't be opened for recording or playing back
+class ArchiveError(Exception):
+    '''Raised when an archive can't be opened for recording or playing back
+    '''
+
+
+# An answer played back from an archive. Has the parts of a 'requests.Response' the lookups use
+class ArchivedResponse():
+    '''An answer played back from an archive. Has the parts of a 'requests.Response' the lookups use
+            ('status_code', 'content', 'text', 'headers', and 'url').
+
+        Arguments:
+            url: URL that was visited
+            status: HTTP status the site answered with
+            body: Body of the answer (bytes)
+    '''
+
+    __slots__ = ('url', 'status_code', 'content', 'headers')
+
+    def __init__(self, url, status, body):
+        self.url = url
+        self.status_code = status
+        self.content = body
+        self.headers = {}
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def __repr__(self):
+        return '<ArchivedResponse [' + str(self.status_code) + '] ' + self.url + '>'
+
+
+# Every answer the sites gave during a run, saved to one gzipped file so the run can be played back later
+class ResponseArchive():
+    '''Every answer the sites gave during a run, saved to one gzipped file so the run can be played back
+            later without the internet (and without waiting on it). Safe to share between threads.
+
+            The file is JSON lines. A body line ('{"id": ..., "body": ...}') comes the first time a body is
+            seen, and every answer after that just points at it ('{"url": ..., "status": ..., "id": ...}'),
+            so the thousands of IPs in the same network block only cost one copy of its RDAP answer.
+
+        Arguments:
+            path: The archive file (e.g. 'monday.grip.gz')
+            mode: RECORD to add answers to it (kept if it's already there), REPLAY to play them back
+    '''
+
+    def __init__(self, path, mode):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError("Archive mode has to be '" + RECORD + "' or '" + REPLAY + "'")
+
+        self.path = path
+        self.mode = mode
+
+        # URL -> (status, body id), and body id -> body bytes
+        self._answers = {}
+        self._bodies = {}
+
+        self._file = None
+        self._lock = threading.Lock()
+
+        # Set when the file ends in an answer that got cut off
+        self._cut_off = False
+
+        if mode == REPLAY and not os.path.isfile(path):
+            raise ArchiveError("No archive at " + path)
+
+        if os.path.isfile(path):
+            self._load()
+
+        # New answers go on the end as another gzip member, which gzip readers treat as one long file.
+        #       Nothing after a cut-off member can be read back though, so that has to go first
+        if mode == RECORD:
+            try:
+                if self._cut_off:
+                    self._rewrite()
+                self._file = gzip.open(path, 'at', encoding='utf-8')
+            except OSError as error:
+                raise ArchiveError("Couldn't open " + path + " for recording: " + str(error))
+
+    # Reads every answer in the file into memory
+    def _load(self):
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as myfile:
+                for line in myfile:
+                    entry = json.loads(line)
+                    if 'body' in entry:
+                        self._bodies[entry['id']] = entry['body'].encode('utf-8', errors='surrogateescape')
+                    else:
+                        self._answers[entry['url']] = (entry['status'], entry['id'])
+
+        # A run that got killed mid-write leaves a cut-off file. Keep everything before the cut
+        except (EOFError, zlib.error, ValueError, KeyError):
+            self._cut_off = True
+
+        except OSError as error:
+            raise ArchiveError("Couldn't read " + self.path + ": " + str(error))
+
+        return
+
+    # Writes the file back out with just the answers that could be read
+    def _rewrite(self):
+        temp_path = self.path + '.tmp'
+
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as myfile:
+            for body_id, body in self._bodies.items():
+                myfile.write(json.dumps({'id': body_id, 'body': body.decode('utf-8', errors='surrogateescape')}) + '\n')
+            for url, (status, body_id) in self._answers.items():
+                myfile.write(json.dumps({'url': url, 'status': status, 'id': body_id}) + '\n')
+
+        os.replace(temp_path, self.path)
+        self._cut_off = False
+
+        return
+
+    @property
+    def recording(self):
+        return self.mode == RECORD
+
+    @property
+    def replaying(self):
+        return self.mode == REPLAY
+
+    def __len__(self):
+        return len(self._answers)
+
+    def __contains__(self, url):
+        return url in self._answers
+
+    # Saves what a site answered
+    # Returns: Nothing
+    # External Modifications: Writes to the archive file
+    def record(self, url, status, body):
+        '''Saves what a site answered (replacing any earlier answer for the same URL on playback)
+
+            Arguments:
+                url: URL that was visited
+                status: HTTP status the site answered with
+                body: Body of the answer (bytes)
+            Returns: Nothing
+            External Modifications: Writes to the archive file
+        '''
+
+        if not self.recording:
+            return
+
+        body = bytes(body)
+        body_id = hashlib.sha1(body).hexdigest()[:20]
+
+        with self._lock:
+            if self._file is None:
+                return
+
+            if body_id not in self._bodies:
+                self._bodies[body_id] = body
+                # surrogateescape keeps any bytes that aren't proper UTF-8 exactly as they were
+                self._file.write(json.dumps({'id': body_id, 'body': body.decode('utf-8', errors='surrogateescape')}) + '\n')
+
+            if self._answers.get(url) != (status, body_id):
+                self._answers[url] = (status, body_id)
+                self._file.write(json.dumps({'url': url, 'status': status, 'id': body_id}) + '\n')
+
+        return
+
+    # Plays back what a site answered
+    # Returns: ArchivedResponse, or None if the URL isn't in the archive
+    # External Modifications: None
+    def replay(self, url):
+        '''Plays back what a site answered
+
+            Arguments:
+                url: URL to look up
+            Returns: ArchivedResponse, or None if the URL isn't in the archive
+            External Modifications: None
+        '''
+
+        answer = self._answers.get(url)
+        if answer is None:
+            return None
+
+        return ArchivedResponse(url, answer[0], self._bodies[answer[1]])
+
+    # Goes through every answer in the archive
+    # Returns: Generator of (URL, status, body bytes)
+    # External Modifications: None
+    def answers(self, prefix=''):
+        '''Goes through every answer in the archive
+
+            Arguments:
+                prefix: Only the URLs that start with this (e.g. 'https://rdap.apnic.net/ip/')
+            Returns: Generator of (URL, status, body bytes)
+            External Modifications: None
+        '''
+
+        for url, (status, body_id) in list(self._answers.items()):
+            if url.startswith(prefix):
+                yield (url, status, self._bodies[body_id])
+
+        return
+
+    # Finishes writing the archive
+    # Returns: Nothing
+    # External Modifications: Closes the archive file
+    def close(self):
+        '''Finishes writing the archive (nothing to do when playing back)
+
+            Arguments:
+                None
+            Returns: Nothing
+            External Modifications: Closes the archive file
+        '''
+
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+        return
+
+
+
+# Swaps in a new shared archive, closing the old one
+def _setArchive(archive):
+    global _archive, _archive_set
+
+    with _archive_lock:
+        old = _archive
+        _archive = archive
+        _archive_set = True
+
+    if old is not None and old is not archive:
+        old.close()
+
+    return archive
+
+# Starts recording every answer the sites give into an archive
+# Returns: ResponseArchive
+# External Modifications: Opens (or creates) the archive file. Every lookup from now on gets saved to it
+def startRecording(path):
+    '''Starts recording every answer the sites give into an archive. The on-disk cache isn't read while
+            recording, so everything in the run really gets asked (and saved).
+
+        Arguments:
+            path: The archive file (answers are added on if it's already there)
+        Returns: ResponseArchive
+        Raises: ArchiveError if the file can't be opened
+        External Modifications: Opens (or creates) the archive file. Every lookup from now on gets saved to it
+    '''
+
+    return _setArchive(ResponseArchive(path, RECORD))
+
+# Starts answering every lookup out of an archive instead of visiting the sites
+# Returns: ResponseArchive
+# External Modifications: Reads the whole archive into memory. No lookup visits a site from now on
+def startReplay(path):
+    '''Starts answering every lookup out of an archive instead of visiting the sites. The on-disk cache
+            is left alone while playing back, so the results are exactly what was recorded.
+
+        Arguments:
+            path: The archive file
+        Returns: ResponseArchive
+        Raises: ArchiveError if the file isn't there or can't be read
+        External Modifications: Reads the whole archive into memory. No lookup visits a site from now on
+    '''
+
+    return _setArchive(ResponseArchive(path, REPLAY))
+
+# Stops recording or playing back (lookups go back to visiting the sites)
+# Returns: Nothing
+# External Modifications: Closes the archive file
+def stop():
+    '''Stops recording or playing back (lookups go back to visiting the sites)
+
+        Arguments:
+            None
+        Returns: Nothing
+        External Modifications: Closes the archive file
+    '''
+
+    _setArchive(None)
+
+    return
+
+# Hands back the archive being recorded or played back, setting it up from GRIP_RECORD / GRIP_REPLAY the first time
+# Returns: ResponseArchive, or None if nothing is being recorded or played back
+# External Modifications: Opens the archive file the first time it's called (if one of the variables is set)
+def getArchive():
+    '''Hands back the archive being recorded or played back. The first time it's asked for, setting the
+            GRIP_RECORD or GRIP_REPLAY environment variable to an archive's path starts recording or
+            playing back (so the menus in 'CLI_Driver.py' can use it too).
+
+        Arguments:
+            None
+        Returns: ResponseArchive, or None if nothing is being recorded or played back
+        Raises: ArchiveError if the archive in GRIP_RECORD / GRIP_REPLAY can't be opened
+        External Modifications: Opens the archive file the first time it's called (if one of the variables is set)
+    '''
+
+    global _archive, _archive_set
+
+    if _archive_set:
+        return _archive
+
+    with _archive_lock:
+        if not _archive_set:
+            if os.environ.get('GRIP_REPLAY'):
+                _archive = ResponseArchive(os.environ['GRIP_REPLAY'], REPLAY)
+            elif os.environ.get('GRIP_RECORD'):
+                _archive = ResponseArchive(os.environ['GRIP_RECORD'], RECORD)
+            _archive_set = True
+
+    return _archive
+
+# Makes sure a recording gets finished properly even if nobody calls 'stop'
+def _closeAtExit():
+    if _archive is not None:
+        _archive.close()
+
+atexit.register(_closeAtExit)
+
+
+
+
+
+##### MAIN #####
+if __name__ == '__main__':
+    print("Hello, World!")
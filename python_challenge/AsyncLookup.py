@@ -0,0 +1,447 @@
+#! python3
+
+# AsyncLookup.py - A script that handles RDAP and GeoIP lookups with asyncio instead of threads
+
+####### VERSION HISTORY #######
+# Version 1: Added 'fetch' coroutine, a tiny HTTP/1.1 client that keeps connections open per site
+#            Added 'getRDAPTextAsync' and 'getIPDataAsync' coroutines (asyncio versions of 'RDAP.getRDAPText'
+#                   and 'GEOIP.getIPData')
+#            Added 'enrichMany' coroutine to look up thousands of IPs at once on a single event loop
+#            Added 'closeConnections' coroutine to hang up on every site when you're done
+# Version 2: Edited 'enrichMany' to print RDAP errors to stderr so they don't end up in piped output
+#            Edited 'enrichMany' to optionally hand back small 'RDAP.RDAPResult's instead of the full RDAP text
+#            Edited 'fetch' and 'enrichMany' to report timings and counts (see 'Stats.py')
+# Version 3: Edited 'fetch' to record answers to (or play them back from) the archive, same as 'Transport.get'
+#            Edited 'getRDAPTextAsync' and 'getIPDataAsync' so lookups of the same IP at the same time share one
+#               visit, same as 'RDAP.getRDAPText' and 'GEOIP.getIPData' (see 'SingleFlight.py')
+# Version 4: Edited 'fetch' to follow redirects (e.g. APNIC sending IPs from other regions to their own RIR),
+#               same as 'requests' does
+#            Edited 'getRDAPTextAsync' and 'getIPDataAsync' to read and write the on-disk cache on a worker thread
+#               so SQLite never holds up the event loop
+#            Edited 'enrichMany' so a GeoIP site that won't answer only skips that IP (printed to stderr, like RDAP)
+#            Edited 'fetch' to give up on a visit when Retry-After asks for longer than 'Transport.RETRY_AFTER_MAX'
+#            Edited 'getRDAPTextAsync' and 'getIPDataAsync' to check special-purpose IPs, known network blocks, and
+#               the local range table right on the event loop. Only SQLite goes to a worker thread, and only if
+#               the on-disk cache is on
+###############################
+
+import GEOIP as geo
+import RDAP as rdap
+import Transport as transport
+import Stats as stats
+import Archive as archive
+import Cache
+import SingleFlight
+import sys
+import time
+import asyncio
+import ssl
+import urllib.parse
+import weakref
+
+# How many lookups 'enrichMany' lets run at the same time if nobody says otherwise
+DEFAULT_LIMIT = 500
+
+# Most redirects 'fetch' will follow for one visit before giving up
+MAX_REDIRECTS = 5
+
+# Statuses that mean "it's over there instead"
+REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+
+# Idle connections we can reuse, per event loop: loop -> {(scheme, host, port): [(reader, writer), ...]}
+_idle = weakref.WeakKeyDictionary()
+
+# Shared so the certificates only get loaded once
+_ssl_context = None
+
+# The event loop running this coroutine ('get_running_loop' is Python 3.7+, 'get_event_loop' does the same from a
+#       coroutine on 3.6)
+_runningLoop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+# Visits that are underway, by IP
+_rdap_flights = SingleFlight.AsyncSingleFlight('rdap')
+_geo_flights = SingleFlight.AsyncSingleFlight('geoip')
+
+
+
+# Hands back the SSL settings for HTTPS sites
+def _sslContext():
+    global _ssl_context
+
+    if _ssl_context is None:
+        _ssl_context = ssl.create_default_context()
+
+    return _ssl_context
+
+# Splits up the TIMEOUT setting from Transport.py
+# Returns: Tuple of (connect seconds, read seconds)
+def _timeouts():
+    if isinstance(transport.TIMEOUT, tuple):
+        return transport.TIMEOUT
+    return (transport.TIMEOUT, transport.TIMEOUT)
+
+# Reads one HTTP answer off a connection
+# Returns: Tuple of (status, headers, body, whether the connection can be reused)
+async def _readResponse(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Site hung up before answering")
+
+    parts = status_line.decode('latin-1').split(None, 2)
+    if len(parts) < 2 or not parts[1].isdigit():
+        raise ConnectionError("Site gave a garbled answer: " + repr(status_line))
+
+    version = parts[0]
+    status = int(parts[1])
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, sep, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+    # Body comes in pieces, each one starting with its size in hex
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        body = bytearray()
+        while True:
+            size = int((await reader.readline()).split(b';')[0].strip(), 16)
+            if size == 0:
+                # Skip any trailers
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            body += await reader.readexactly(size)
+            await reader.readexactly(2)
+        body = bytes(body)
+
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+
+    # No length given, so the body runs until the site hangs up
+    else:
+        body = await reader.read()
+        keep_alive = False
+
+    return (status, headers, body, keep_alive)
+
+# Visits a URL once, reusing an open connection to the site if there is one
+# Returns: Tuple of (status, headers, body)
+async def _request(url):
+    parts = urllib.parse.urlsplit(url)
+    secure = parts.scheme == 'https'
+    host = parts.hostname
+    port = parts.port or (443 if secure else 80)
+
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+
+    request = ('GET ' + path + ' HTTP/1.1\r\n'
+               'Host: ' + parts.netloc + '\r\n'
+               'User-Agent: GRIP\r\n'
+               'Accept-Encoding: identity\r\n'
+               'Connection: keep-alive\r\n\r\n').encode('latin-1')
+
+    connect_timeout, read_timeout = _timeouts()
+    pools = _idle.setdefault(_runningLoop(), {})
+    idle = pools.setdefault((parts.scheme, host, port), [])
+
+    # Two goes: if a reused connection turns out to have been closed by the site, try once more on a fresh one
+    for attempt in range(2):
+        reused = len(idle) > 0
+
+        if reused:
+            reader, writer = idle.pop()
+        else:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port, ssl=_sslContext() if secure else None),
+                                                    connect_timeout)
+
+        try:
+            writer.write(request)
+            await writer.drain()
+            status, headers, body, keep_alive = await asyncio.wait_for(_readResponse(reader), read_timeout)
+
+        except (OSError, asyncio.IncompleteReadError):
+            writer.close()
+            if reused:
+                continue
+            raise
+
+        except asyncio.TimeoutError:
+            writer.close()
+            raise
+
+        # Keep it around for the next visit (unless we've already got plenty)
+        if keep_alive and len(idle) < transport.POOL_SIZE:
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+        return (status, headers, body)
+
+    raise ConnectionError("Couldn't get an answer from " + url)
+
+# Visits a URL, following any redirects (each new site gets its own rate limit, like in 'fetch')
+# Returns: Tuple of (status, headers, body) of wherever it ended up
+async def _requestFollowing(url):
+    for hop in range(MAX_REDIRECTS + 1):
+        status, headers, body = await _request(url)
+
+        location = headers.get('location')
+        if status not in REDIRECT_STATUSES or not location:
+            return (status, headers, body)
+
+        url = urllib.parse.urljoin(url, location)
+        stats.count('redirects ' + (urllib.parse.urlsplit(url).hostname or ''))
+
+        wait = transport.getBucket(url).reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    raise transport.UpstreamError("Too many redirects, last one was to " + url, status)
+
+# Runs an on-disk cache lookup or save on a worker thread so the event loop doesn't sit waiting on SQLite.
+#       With the on-disk cache turned off there's no SQLite to wait on, so it just runs right here
+# Returns: Whatever 'function' returns
+async def _offLoop(function, *args):
+    if Cache.getDefaultCache() is None:
+        return function(*args)
+
+    return await _runningLoop().run_in_executor(None, function, *args)
+
+# Visits a URL, staying under the site's rate limit and retrying when it struggles (same rules as 'Transport.get')
+# Returns: Tuple of (status, body)
+# External Modifications: Visits the URL (maybe several times)
+async def fetch(url):
+    '''Visits a URL, staying under the site's rate limit and retrying throttled (429), broken (5xx), and
+            timed out visits with exponential backoff and jitter. Shares the rate limits in Transport.py,
+            so threads and coroutines hitting the same site stay under one limit. Redirects get followed
+            (up to MAX_REDIRECTS of them), and the answer is wherever they end up.
+
+        Arguments:
+            url: URL to visit
+        Returns: Tuple of (HTTP status, body bytes)
+        Raises: Transport.UpstreamError if the site still won't answer properly after all the retries, redirects
+                too many times, or the URL isn't in the archive being played back
+        External Modifications: Visits the URL (maybe several times). Saves the answer to the archive being recorded
+    '''
+
+    recorder = archive.getArchive()
+    if recorder is not None and recorder.replaying:
+        response = transport.replay(recorder, url)
+        return (response.status_code, response.content)
+
+    bucket = transport.getBucket(url)
+    host = urllib.parse.urlsplit(url).hostname or ''
+
+    for attempt in range(transport.MAX_RETRIES + 1):
+        if attempt > 0:
+            stats.count('retries ' + host)
+
+        wait = bucket.reserve()
+        if wait > 0:
+            started = time.perf_counter()
+            await asyncio.sleep(wait)
+            stats.addTime('rate limit ' + host, time.perf_counter() - started)
+
+        started = time.perf_counter()
+        try:
+            status, headers, body = await _requestFollowing(url)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as error:
+            stats.addTime('http ' + host, time.perf_counter() - started)
+            stats.count('connection errors ' + host)
+            if attempt == transport.MAX_RETRIES:
+                stats.count('gave up ' + host)
+                raise transport.UpstreamError("Couldn't reach " + url + ": " + repr(error))
+            await asyncio.sleep(transport.backoff(attempt))
+            continue
+
+        stats.addTime('http ' + host, time.perf_counter() - started)
+        stats.count('requests ' + host)
+        stats.count('bytes ' + host, len(body))
+
+        if status not in transport.RETRY_STATUSES:
+            bucket.speedUp()
+            if recorder is not None:
+                recorder.record(url, status, body)
+            return (status, body)
+
+        stats.count('status ' + str(status) + ' ' + host)
+
+        if attempt == transport.MAX_RETRIES:
+            stats.count('gave up ' + host)
+            raise transport.UpstreamError(url + " kept answering " + str(status), status)
+
+        # Throttled. Everybody visiting this site waits (and slows down afterwards), not just us
+        if status == 429:
+            bucket.slowDown()
+
+        wait = transport.backoff(attempt, transport.checkRetryAfter(url, status, headers.get('retry-after')))
+        bucket.pause(wait)
+        await asyncio.sleep(wait)
+
+    return (status, body)
+
+# Visits the RDAP site for an IP (no caches) and saves the answer (asyncio version of 'RDAP.fetchRDAPResponse')
+# Returns: Text of RDAP info in JSON layout OR None if not valid
+async def _fetchRDAPResponse(IP):
+    status, body = await fetch(rdap.RDAP_addr.format(IP))
+    return await _offLoop(rdap.saveRDAPResponse, IP, body.decode('utf-8', errors='replace'))
+
+# asyncio version of 'RDAP.getRDAPText'
+# Returns: Text of RDAP info in JSON layout OR None if not valid
+# External Modifications: Visits the RDAP site. Reads and writes the on-disk cache
+async def getRDAPTextAsync(IP):
+    '''asyncio version of 'RDAP.getRDAPText'
+
+        Arguments:
+            IP: String version of IP address
+        Returns: Text of RDAP info in JSON layout OR None if not valid
+        Raises: Transport.UpstreamError if the site still won't answer after retrying
+        External Modifications: Visits the RDAP site. Reads and writes the on-disk cache
+    '''
+
+    # Special-purpose IP or known network block. It's all in memory, so there's no need to leave the event loop
+    found, rdap_text = rdap.lookupRDAPInMemory(IP)
+    if found:
+        return rdap_text
+
+    found, rdap_text = await _offLoop(rdap.lookupRDAPOnDisk, IP)
+    if found:
+        return rdap_text
+
+    return await _rdap_flights.do(str(IP), _fetchRDAPResponse, IP)
+
+# Visits the GeoIP site for an IP (no caches) and saves the answer
+# Returns: respData for parsing
+async def _fetchGeoResponse(ip):
+    status, body = await fetch(geo.GEOIP_addr.format(ip))
+    return await _offLoop(geo.saveGeoResponse, ip, status, body)
+
+# asyncio version of 'GEOIP.getIPData'
+# Returns: respData for parsing
+# External Modifications: Visits the GeoIP site. Reads and writes the on-disk cache
+async def getIPDataAsync(ip):
+    '''asyncio version of 'GEOIP.getIPData'
+
+        Arguments:
+            ip: String version of the IP address
+        Returns: respData for parsing
+        Raises: Transport.UpstreamError if the site still won't answer after retrying
+        External Modifications: Visits the GeoIP site. Reads and writes the on-disk cache
+    '''
+
+    # Special-purpose IP or local range table. It's all in memory, so there's no need to leave the event loop
+    found, respData = geo.lookupGeoInMemory(ip)
+    if found:
+        return respData
+
+    found, respData = await _offLoop(geo.lookupGeoOnDisk, ip)
+    if found:
+        return respData
+
+    return await _geo_flights.do(str(ip), _fetchGeoResponse, ip)
+
+# Grabs the GeoIP and/or RDAP data for a single IP (both at the same time)
+# Returns: Tuple of (IP, GeoIP respData or None, RDAP text or None)
+async def _enrichOne(IP, geo_data, rdap_data, compact=False):
+    started = time.perf_counter()
+
+    geo_result = None
+    rdap_result = None
+
+    async def grab_geo():
+        # Same as RDAP below. It's not the IP's fault, so it doesn't get called invalid either
+        try:
+            return await getIPDataAsync(IP)
+        except transport.UpstreamError as error:
+            print("\nCouldn't grab the GeoIP data for " + str(IP) + ": " + str(error), file=sys.stderr)
+            stats.count('geoip errors')
+            return None
+
+    async def grab_rdap():
+        # The site wouldn't answer properly even after retrying. Don't let one IP sink the whole batch
+        try:
+            return await getRDAPTextAsync(IP)
+        except (transport.UpstreamError, ValueError) as error:
+            print("\nCouldn't grab the RDAP data for " + str(IP) + ": " + str(error), file=sys.stderr)
+            stats.count('rdap errors')
+            return None
+
+    if geo_data and rdap_data:
+        geo_result, rdap_result = await asyncio.gather(grab_geo(), grab_rdap())
+    elif geo_data:
+        geo_result = await grab_geo()
+    elif rdap_data:
+        rdap_result = await grab_rdap()
+
+    if compact and rdap_result is not None:
+        rdap_result = rdap.RDAPResult(IP, rdap_result).compact()
+
+    stats.addTime('lookup', time.perf_counter() - started)
+    stats.count('ips')
+
+    return (IP, geo_result, rdap_result)
+
+# Looks up a whole bunch of IPs at once on one event loop
+# Returns: List of (IP, GeoIP respData or None, RDAP text or None) in the same order as 'IPs'
+# External Modifications: Visits the GeoIP and RDAP sites
+async def enrichMany(IPs, geo_data=True, rdap_data=True, limit=DEFAULT_LIMIT, compact=False):
+    '''Looks up a whole bunch of IPs at once on one event loop (no thread per lookup). Results come back
+            in the same order the IPs went in, just like 'Batch.enrichIPs'.
+
+        Arguments:
+            IPs: Any iterable of string IP addresses (list, generator, etc)
+            geo_data: True to grab the GeoIP data
+            rdap_data: True to grab the RDAP data
+            limit: How many IPs can be in flight at the same time
+            compact: True to hand back an 'RDAP.RDAPResult' (just the menu fields) instead of the full RDAP text
+        Returns: List of (IP, GeoIP respData or None, RDAP text or None)
+        External Modifications: Visits the GeoIP and RDAP sites
+    '''
+
+    results = {}
+
+    # Every worker pulls from the same iterator. That's safe here since everything runs on one thread
+    #       and nobody can get interrupted in the middle of grabbing the next IP
+    numbered_IPs = enumerate(IPs)
+
+    async def worker():
+        for index, IP in numbered_IPs:
+            results[index] = await _enrichOne(IP, geo_data, rdap_data, compact)
+
+    await asyncio.gather(*[worker() for count in range(max(1, int(limit)))])
+
+    return [results[index] for index in range(len(results))]
+
+# Hangs up every idle connection this event loop has open
+# Returns: Nothing
+# External Modifications: Closes connections
+async def closeConnections():
+    '''Hangs up every idle connection this event loop has open
+
+        Arguments:
+            None
+        Returns: Nothing
+        External Modifications: Closes connections
+    '''
+
+    pools = _idle.pop(_runningLoop(), {})
+
+    for idle in pools.values():
+        for reader, writer in idle:
+            writer.close()
+
+    return
+
+
+
+
+
+##### MAIN #####
+if __name__ == '__main__':
+    print("Hello, World!")
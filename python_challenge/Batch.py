@@ -0,0 +1,231 @@
+#! python3
+
+# Batch.py - A script that handles enriching lots of IPs at once
+
+####### VERSION HISTORY #######
+# Version 1: Added 'enrichIP' function to grab the GeoIP and RDAP data for a single IP
+#            Added 'enrichIPs' function to grab the data for a whole bunch of IPs at the same time
+# Version 2: Edited 'enrichIP' so an RDAP site that won't answer only skips that IP instead of the whole batch
+# Version 3: Edited 'enrichIP' to print RDAP errors to stderr so they don't end up in piped output
+#            Added 'buildRecord' function to flatten a lookup into the fields that were asked for (moved from 'Stream_Driver.py')
+#            Edited 'buildRecord' to use 'GEOIP.parseGEO' (lat and long are numbers now)
+#            Edited 'enrichIP' and 'enrichIPs' to optionally hand back small 'RDAP.RDAPResult's instead of the full RDAP text
+#            Edited 'enrichIP' to report how long each IP takes and count errors (see 'Stats.py')
+#            Edited 'enrichIP' so a GeoIP site that won't answer only skips that IP too (printed to stderr)
+#            Edited 'enrichIPs' to make sure there's a pooled connection for every worker (see 'Transport.ensurePoolSize')
+#            Added 'Lookup' class so a lookup that a site wouldn't answer can be told apart from an invalid/reserved IP
+###############################
+
+import GEOIP as geo
+import RDAP as rdap
+import Transport as transport
+import Stats as stats
+import sys
+import concurrent.futures
+import threading
+import queue
+import time
+
+# How many lookups we let run at the same time if nobody says otherwise
+DEFAULT_WORKERS = 16
+
+# Used to tell the consumer that the feeder has run out of IPs
+_DONE = object()
+
+
+
+# What 'enrichIP' hands back. Unpacks just like a plain (IP, GeoIP, RDAP) tuple
+class Lookup(tuple):
+    '''What 'enrichIP' hands back. Unpacks just like a plain (IP, GeoIP respData, RDAP text) tuple, but also
+            says whether a site wouldn't answer. Either way the missing data is None, this is how you tell
+            "the IP is invalid/reserved" apart from "ask again later" (see 'Checkpoint.BatchCheckpoint').
+
+        Arguments:
+            values: (IP, GeoIP respData or None, RDAP text or None)
+            failed: True if the GeoIP or RDAP site wouldn't answer
+    '''
+
+    def __new__(cls, values, failed=False):
+        lookup = tuple.__new__(cls, values)
+        lookup.failed = failed
+        return lookup
+
+
+# Grabs the GeoIP and/or RDAP data for a single IP
+# Returns: Lookup of (IP, GeoIP respData or None, RDAP text or None)
+# External Modifications: Visits the GeoIP and RDAP sites
+def enrichIP(IP, geo_data=True, rdap_data=True, compact=False):
+    '''Grabs the GeoIP and/or RDAP data for a single IP
+
+        Arguments:
+            IP: String version of IP address
+            geo_data: True to grab the GeoIP data
+            rdap_data: True to grab the RDAP data
+            compact: True to hand back an 'RDAP.RDAPResult' (just the menu fields) instead of the full RDAP text.
+                     Uses a lot less memory if you're holding onto lots of results
+        Returns: Lookup of (IP, GeoIP respData or None, RDAP text or None). 'failed' is set if a site wouldn't answer
+        External Modifications: Visits the GeoIP and RDAP sites
+    '''
+
+    started = time.perf_counter()
+
+    geo_result = None
+    rdap_result = None
+    failed = False
+
+    if geo_data:
+        # Same as RDAP below. It's not the IP's fault, so it doesn't get called invalid either
+        try:
+            geo_result = geo.getIPData(IP)
+        except transport.UpstreamError as error:
+            print("\nCouldn't grab the GeoIP data for " + str(IP) + ": " + str(error), file=sys.stderr)
+            stats.count('geoip errors')
+            failed = True
+
+    if rdap_data:
+        # The site wouldn't answer properly even after retrying. Don't let one IP sink the whole batch
+        try:
+            rdap_result = rdap.getRDAPText(IP)
+        except (transport.UpstreamError, ValueError) as error:
+            print("\nCouldn't grab the RDAP data for " + str(IP) + ": " + str(error), file=sys.stderr)
+            stats.count('rdap errors')
+            failed = True
+
+        # Pull the fields out now, while we're still on a worker thread, and let go of the rest
+        if compact and rdap_result is not None:
+            rdap_result = rdap.RDAPResult(IP, rdap_result).compact()
+
+    stats.addTime('lookup', time.perf_counter() - started)
+    stats.count('ips')
+
+    return Lookup((IP, geo_result, rdap_result), failed)
+
+# Grabs the GeoIP and/or RDAP data for a bunch of IPs, several at a time
+# Returns: Generator of Lookups (IP, GeoIP respData or None, RDAP text or None) in the same order as 'IPs'
+# External Modifications: Visits the GeoIP and RDAP sites from a pool of worker threads
+def enrichIPs(IPs, geo_data=True, rdap_data=True, workers=DEFAULT_WORKERS, compact=False):
+    '''Grabs the GeoIP and/or RDAP data for a bunch of IPs, several at a time. Results come
+            back in the same order the IPs went in, no matter which lookup finishes first.
+
+        Arguments:
+            IPs: Any iterable of string IP addresses (list, generator, etc)
+            geo_data: True to grab the GeoIP data
+            rdap_data: True to grab the RDAP data
+            compact: True to hand back an 'RDAP.RDAPResult' (just the menu fields) instead of the full RDAP text.
+                     Uses a lot less memory if you're holding onto lots of results
+            workers: How many lookups can be in flight at the same time
+        Returns: Generator of Lookups (IP, GeoIP respData or None, RDAP text or None), see 'Lookup'
+        External Modifications: Visits the GeoIP and RDAP sites from a pool of worker threads
+    '''
+
+    workers = max(1, int(workers))
+
+    # One pooled connection per worker, per site. Any fewer and workers sit waiting on each other
+    transport.ensurePoolSize(workers)
+
+    # Lookups waiting to be handed back, in input order. The size limit keeps us from reading
+    #       a giant file all the way in before anything comes back out
+    pending = queue.Queue(maxsize=workers * 2)
+
+    # Set when whoever is looping over us stops early
+    stop = threading.Event()
+
+    # Hand a lookup to the consumer unless they've already walked away
+    def hand_off(item):
+        while not stop.is_set():
+            try:
+                pending.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    # Reads IPs in its own thread so a slow input (e.g. a pipe) never holds up finished results
+    def feed(executor):
+        try:
+            for IP in IPs:
+                if not hand_off(executor.submit(enrichIP, IP, geo_data, rdap_data, compact)):
+                    return
+        except Exception as error:
+            hand_off(error)
+        hand_off(_DONE)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        feeder = threading.Thread(target=feed, args=(executor,), daemon=True)
+        feeder.start()
+
+        try:
+            while True:
+                item = pending.get()
+
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+
+                yield item.result()
+
+        finally:
+            # Let the feeder know we're done and throw away anything that hasn't started yet
+            stop.set()
+            while True:
+                try:
+                    item = pending.get_nowait()
+                except queue.Empty:
+                    break
+                if isinstance(item, concurrent.futures.Future):
+                    item.cancel()
+            feeder.join()
+
+    return
+
+
+# Builds a flat record for one IP out of whatever fields were asked for
+# Returns: Dictionary of field name -> value (for the 'Output' writers)
+# External Modifications: None
+def buildRecord(ip, geo_data, rdap_text, geo_fields, rdap_fields):
+    '''Builds a flat record for one IP out of whatever fields were asked for. Fields use the same names as
+            the menus in CLI_Driver.py. Fields that couldn't be found (e.g. the IP is reserved) are None.
+
+        Arguments:
+            ip: String version of IP address
+            geo_data: respData from 'GEOIP.getIPData' (or None)
+            rdap_text: RDAP text from 'RDAP.getRDAPText' or an 'RDAP.RDAPResult' (or None)
+            geo_fields: List of GeoIP field names to include (see 'GEOIP.GEO_FIELDS'), or None for no GeoIP.
+                        lat and long come out as floats
+            rdap_fields: List of RDAP field names to include (see 'RDAP.RDAP_FIELDS'), or None for no RDAP
+        Returns: Dictionary of field name -> value (for the 'Output' writers)
+        External Modifications: None
+    '''
+
+    record = {'ip': ip}
+
+    if geo_fields is not None:
+        found = geo.parseGEO(geo_data)
+        for field in geo_fields:
+            if field != 'ip':
+                record[field] = getattr(found, field) if found else None
+
+    if rdap_fields is not None:
+        found = None
+        if rdap_text is not None:
+            # Some networks leave out bits of the RDAP layout. Treat them like nothing was found
+            try:
+                if isinstance(rdap_text, rdap.RDAPResult):
+                    found = rdap_text.asDict()
+                else:
+                    found = rdap.getRdapIPFields(rdap_text)
+            except (KeyError, IndexError, TypeError, ValueError):
+                found = None
+        for field in rdap_fields:
+            record[field] = found.get(field) if found else None
+
+    return record
+
+
+
+
+
+##### MAIN #####
+if __name__ == '__main__':
+    print("Hello, World!")
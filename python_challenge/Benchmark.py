@@ -0,0 +1,504 @@
+#! python3
+
+# Benchmark.py - A script that handles timing the whole file mode pipeline against pretend RDAP and GeoIP sites
+
+####### VERSION HISTORY #######
+# Version 1: Added 'StubServer' class, a local stand-in for rdap.apnic.net and api.geoiplookup.net (with
+#               adjustable latency, errors, and throttling)
+#            Added 'makeLog' function to write made-up access logs full of public IPs
+#            Added 'runBenchmark' function to push a log through the file mode pipeline and time it
+#               (IPs/second, p50/p95/p99 latency, peak memory)
+# Version 2: Edited 'runBenchmark' to include where the time went in each result (see 'Stats.py')
+#            Edited 'StubServer' to send each answer in one go, so kept-open connections don't stall on Nagle
+#            Edited 'runBenchmark' to read the log as the lookups go, like file mode does now
+#            Edited 'StubServer' to hand out assigned blocks, so the range cache still answers their neighbours
+#            Added 'StubProcess' class so the pretend site runs in its own process, instead of fighting the pipeline
+#               for the GIL and showing up in its peak memory
+###############################
+
+import Parse as par
+import GEOIP as geo
+import RDAP as rdap
+import Filter as filt
+import Batch as batch
+import Cache
+import Transport as transport
+import Output as output
+import Stats as stats
+import argparse
+import http.server
+import json
+import math
+import multiprocessing
+import os
+import random
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+
+# Sizes (number of log lines) run if nobody says otherwise
+DEFAULT_SIZES = [1000, 10000]
+
+# Made-up access log line. Only the IP matters
+LOG_LINE = '{} - - [10/Aug/2018:13:55:36 -0500] "GET /index.html HTTP/1.1" 200 2326\n'
+
+
+
+# Answers like rdap.apnic.net (JSON at /ip/<IP>) and api.geoiplookup.net (XML at /?query=<IP>)
+class _StubHandler(http.server.BaseHTTPRequestHandler):
+
+    # Keep connections open between visits, like the real sites
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and body go out together in one write (and right away). Sending them as two small writes on a
+    #       kept-open connection makes Nagle and delayed ACKs hold every answer up by ~40 ms
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        return
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+    def do_GET(self):
+        server = self.server
+        server.count('requests')
+
+        if server.latency > 0:
+            time.sleep(server.latency)
+
+        if server.throttled():
+            server.count('throttled')
+            self._send(429, b'Slow down', 'text/plain', {'Retry-After': '1'})
+            return
+
+        if server.error_rate > 0 and random.random() < server.error_rate:
+            server.count('errors')
+            self._send(503, b'Try again later', 'text/plain')
+            return
+
+        parts = urllib.parse.urlsplit(self.path)
+
+        if parts.path.startswith('/ip/'):
+            ip = urllib.parse.unquote(parts.path[len('/ip/'):])
+            self._send(200, server.rdapBody(ip), 'application/rdap+json')
+            return
+
+        query = urllib.parse.parse_qs(parts.query).get('query')
+        if query:
+            self._send(200, server.geoBody(query[0]), 'text/xml')
+            return
+
+        self._send(404, b'Not found', 'text/plain')
+
+
+# A local stand-in for rdap.apnic.net and api.geoiplookup.net, one thread per connection
+class StubServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    '''A local stand-in for rdap.apnic.net (JSON at /ip/<IP>) and api.geoiplookup.net (XML at /?query=<IP>),
+            one thread per connection. Runs in the background once 'start' is called.
+
+        Arguments:
+            latency: Seconds every answer takes
+            error_rate: Fraction of visits (0 to 1) that get a 503
+            max_rate: Most visits per second before it starts answering 429 (0 for no limit)
+            block_size: How many IPs each made-up RDAP network block covers (1 means every IP is its own block)
+    '''
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    # The default (5) drops connections when lots of workers connect at once, and each one costs a 1 second retry
+    request_queue_size = 1024
+
+    def __init__(self, latency=0.0, error_rate=0.0, max_rate=0, block_size=1):
+        http.server.HTTPServer.__init__(self, ('127.0.0.1', 0), _StubHandler)
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_rate = max_rate
+        self.block_size = max(1, int(block_size))
+
+        # How many visits, errors, and 429s there have been
+        self.counts = {'requests': 0, 'errors': 0, 'throttled': 0}
+
+        # Visits so far in the current second (for 'max_rate')
+        self._window = 0
+        self._window_count = 0
+
+        self._lock = threading.Lock()
+        self._thread = None
+
+    # Address to visit, e.g. 'http://127.0.0.1:54321'
+    @property
+    def url(self):
+        return 'http://127.0.0.1:' + str(self.server_address[1])
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    # True if this visit goes over 'max_rate'
+    def throttled(self):
+        if self.max_rate <= 0:
+            return False
+
+        with self._lock:
+            window = int(time.monotonic())
+            if window != self._window:
+                self._window = window
+                self._window_count = 0
+            self._window_count += 1
+
+            return self._window_count > self.max_rate
+
+    # Made-up RDAP answer, shaped like the real thing (enough for every menu)
+    def rdapBody(self, ip):
+        number = par.ipToInt(ip) or 0
+        start = number - (number % self.block_size)
+        end = min(start + self.block_size - 1, 0xFFFFFFFF)
+
+        contact = {'objectClassName': 'entity',
+                   'handle': 'BENCH-' + str(start),
+                   'roles': ['administrative', 'technical'],
+                   'status': ['active'],
+                   'port43': 'whois.apnic.net',
+                   'vcardArray': ['vcard', [['version', {}, 'text', '4.0'],
+                                            ['fn', {}, 'text', 'Benchmark Contact'],
+                                            ['email', {}, 'text', 'noc@example.net'],
+                                            ['tel', {}, 'text', '+1-555-0100']]],
+                   'events': [{'eventAction': 'last changed', 'eventDate': '2018-07-05T14:03:22Z'},
+                              {'eventAction': 'registration', 'eventDate': '2011-08-10T23:12:35Z'}]
+                   }
+
+        answer = {'objectClassName': 'ip network',
+                  'handle': par.intToIP(start) + ' - ' + par.intToIP(end),
+                  'startAddress': par.intToIP(start),
+                  'endAddress': par.intToIP(end),
+                  'ipVersion': 'v4',
+                  'name': 'BENCH-NET',
+                  'type': 'ASSIGNED PORTABLE',
+                  'country': 'US',
+                  'parentHandle': '0.0.0.0 - 255.255.255.255',
+                  'port43': 'whois.apnic.net',
+                  'rdapConformance': ['rdap_level_0'],
+                  'events': [{'eventAction': 'registration', 'eventDate': '2011-08-10T23:12:35Z'},
+                             {'eventAction': 'last changed', 'eventDate': '2018-07-05T14:03:22Z'}],
+                  'entities': [{'objectClassName': 'entity',
+                                'handle': 'ORG-BENCH',
+                                'roles': ['registrant'],
+                                'entities': [contact],
+                                'events': contact['events']}]
+                  }
+
+        return json.dumps(answer).encode('utf-8')
+
+    # Made-up GeoIP answer
+    def geoBody(self, ip):
+        return ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<ip><results><result>'
+                '<ip>' + ip + '</ip><host>' + ip + '</host>'
+                '<isp>Benchmark ISP</isp><city>Cookeville</city>'
+                '<countrycode>US</countrycode><countryname>United States</countryname>'
+                '<latitude>36.1628</latitude><longitude>-85.5016</longitude>'
+                '</result></results></ip>').encode('utf-8')
+
+    # Starts answering in a background thread
+    # Returns: Itself
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    # Stops answering and lets go of the port
+    # Returns: Nothing
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        return
+
+
+
+# Runs a 'StubServer' in the process 'StubProcess' starts, until it's told to stop
+def _serveStub(settings, connection):
+    server = StubServer(**settings).start()
+    connection.send(server.url)
+
+    try:
+        while True:
+            try:
+                command = connection.recv()
+            except EOFError:
+                break
+
+            if command != 'counts':
+                break
+            connection.send(dict(server.counts))
+    finally:
+        server.stop()
+
+    return
+
+
+# A 'StubServer' running in a process of its own
+class StubProcess():
+    '''A 'StubServer' running in a process of its own. Answering visits takes CPU, and in the same process
+            it would be fighting the pipeline being timed for the GIL (and its memory would count towards
+            the pipeline's peak memory). Out here, the timings are only the pipeline's.
+
+        Arguments:
+            latency: Seconds every answer takes
+            error_rate: Fraction of visits (0 to 1) that get a 503
+            max_rate: Most visits per second before it starts answering 429 (0 for no limit)
+            block_size: How many IPs each made-up RDAP network block covers (1 means every IP is its own block)
+    '''
+
+    def __init__(self, latency=0.0, error_rate=0.0, max_rate=0, block_size=1):
+        self._settings = {'latency': latency, 'error_rate': error_rate, 'max_rate': max_rate, 'block_size': block_size}
+        self._connection = None
+        self._process = None
+
+        # Address to visit, e.g. 'http://127.0.0.1:54321' (set by 'start')
+        self.url = None
+
+    # How many visits, errors, and 429s there have been
+    @property
+    def counts(self):
+        self._connection.send('counts')
+        return self._connection.recv()
+
+    # Starts the process and waits for the server to be up
+    # Returns: Itself
+    def start(self):
+        self._connection, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serveStub, args=(self._settings, child), daemon=True)
+        self._process.start()
+        child.close()
+
+        self.url = self._connection.recv()
+        return self
+
+    # Stops the server and waits for the process to finish
+    # Returns: Nothing
+    def stop(self):
+        try:
+            self._connection.send('stop')
+        except OSError:
+            pass
+
+        self._connection.close()
+        self._process.join(5)
+        if self._process.is_alive():
+            self._process.terminate()
+
+        return
+
+
+
+# Writes a made-up access log full of public IPs
+# Returns: Number of different IPs in the log
+# External Modifications: Writes 'path'
+def makeLog(path, lines, repeat_ratio=0.5, seed=0):
+    '''Writes a made-up access log full of public IPs (no private/reserved ones, so every IP costs a lookup)
+
+        Arguments:
+            path: Where to write the log
+            lines: How many lines (one IP each)
+            repeat_ratio: Fraction of lines (0 to 1) that repeat an IP from elsewhere in the log
+            seed: Random seed, so the same settings always make the same log
+        Returns: Number of different IPs in the log
+        External Modifications: Writes 'path'
+    '''
+
+    chooser = random.Random(seed)
+
+    unique = max(1, int(round(lines * (1 - repeat_ratio))))
+    pool = set()
+    while len(pool) < unique:
+        ip = par.intToIP(chooser.randrange(0x01000000, 0xE0000000))
+        if filt.classifyIP(ip) is None:
+            pool.add(ip)
+    pool = sorted(pool)
+
+    with open(path, 'w') as myfile:
+        myfile.write(''.join(LOG_LINE.format(chooser.choice(pool)) for count in range(lines)))
+
+    return len(pool)
+
+# Works out a percentile of some sorted numbers (nearest rank)
+# Returns: The number, or 0 if there aren't any
+def _percentile(numbers, percent):
+    if not numbers:
+        return 0.0
+
+    rank = int(math.ceil(percent / 100.0 * len(numbers))) - 1
+    return numbers[min(max(rank, 0), len(numbers) - 1)]
+
+# Pushes a log through the file mode pipeline and times it
+# Returns: Dictionary of results
+# External Modifications: Visits whatever RDAP_addr/GEOIP_addr point at. Turns off the on-disk cache
+def runBenchmark(log_path, geo_data=True, rdap_data=True, workers=batch.DEFAULT_WORKERS, unique=False, trace_memory=True):
+    '''Pushes a log through the same steps as file mode in CLI_Driver.py (read, pack, optionally count,
+            look up, write NDJSON) and times it. The results are thrown away, only the timing matters.
+
+        Arguments:
+            log_path: Log file to read IPs out of
+            geo_data: True to grab the GeoIP data
+            rdap_data: True to grab the RDAP data
+            workers: How many IPs to look up at the same time
+            unique: True to only look up each IP once (like answering "Yes" in file mode)
+            trace_memory: True to track peak memory (slows things down a little)
+        Returns: Dictionary with 'ips', 'seconds', 'ips_per_sec', 'p50_ms', 'p95_ms', 'p99_ms', 'peak_mem_mb'
+                 (None if 'trace_memory' is False), and 'stats' (see 'Stats.snapshot'). Latency is from when the
+                 pipeline picks an IP up to when its result comes out the other end
+        External Modifications: Visits whatever RDAP_addr/GEOIP_addr point at. Turns off the on-disk cache
+    '''
+
+    # Every run starts cold: no on-disk cache, no known network blocks, no numbers from the last run
+    Cache.setDefaultCache(None)
+    stats.reset()
+
+    if trace_memory:
+        tracemalloc.start()
+
+    started = time.perf_counter()
+
+    # Same as file mode: read and checked as the lookups go, unless it's counting
+    stream = par.IPStream(par.iterIPs(log_path))
+    if unique:
+        IPs = par.countIPs(stream.packed()).ips()
+    else:
+        IPs = iter(stream)
+
+    # When each IP was picked up (in order, since the results come back in order)
+    picked_up = []
+
+    def timed(IPs):
+        for ip in IPs:
+            picked_up.append(time.perf_counter())
+            yield ip
+
+    latencies = []
+    sink = output.NDJSONWriter(stream=open(os.devnull, 'w'))
+    sink.owns_stream = True
+
+    for count, (ip, geo_result, rdap_result) in enumerate(batch.enrichIPs(timed(IPs), geo_data=geo_data, rdap_data=rdap_data, workers=workers, compact=True)):
+        latencies.append(time.perf_counter() - picked_up[count])
+        sink.write(batch.buildRecord(ip, geo_result, rdap_result, geo.GEO_FIELDS if geo_data else None, rdap.RDAP_FIELDS if rdap_data else None))
+
+    sink.close()
+
+    seconds = time.perf_counter() - started
+
+    peak = None
+    if trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    latencies.sort()
+
+    return {'ips': len(latencies),
+            'seconds': round(seconds, 3),
+            'ips_per_sec': round(len(latencies) / seconds, 1) if seconds > 0 else 0.0,
+            'p50_ms': round(_percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(_percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(_percentile(latencies, 99) * 1000, 2),
+            'peak_mem_mb': round(peak / (1024.0 * 1024.0), 2) if peak is not None else None,
+            'stats': stats.snapshot()
+            }
+
+# Runs the whole benchmark from the command line
+# Returns: Exit code
+# External Modifications: Starts a local server (in its own process), writes temporary logs, prints results (and saves them if asked)
+def main(argv=None):
+    '''Runs the whole benchmark from the command line (see --help)
+
+        Arguments:
+            argv: Command line arguments (defaults to sys.argv)
+        Returns: Exit code
+        External Modifications: Starts a local server (in its own process), writes temporary logs, prints results (and
+                                saves them if asked)
+    '''
+
+    parser = argparse.ArgumentParser(description="Times the file mode pipeline against a local pretend RDAP/GeoIP site")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Log sizes (lines) to run")
+    parser.add_argument('--data', choices=['geo', 'rdap', 'both'], default='both', help="What to look up")
+    parser.add_argument('--workers', type=int, default=batch.DEFAULT_WORKERS, help="How many IPs to look up at the same time")
+    parser.add_argument('--unique', action='store_true', help="Only look up each IP once")
+    parser.add_argument('--repeat-ratio', type=float, default=0.5, help="Fraction of log lines that repeat an IP")
+    parser.add_argument('--latency', type=float, default=0.005, help="Seconds the pretend site takes to answer")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of visits that get a 503")
+    parser.add_argument('--max-rate', type=int, default=0, help="Visits per second before the pretend site answers 429 (0 for no limit)")
+    parser.add_argument('--block-size', type=int, default=1, help="IPs per pretend RDAP network block (bigger means more range cache hits)")
+    parser.add_argument('--client-rate', type=float, default=100000, help="Client-side rate limit for the pretend site (visits per second)")
+    parser.add_argument('--no-memory', action='store_true', help="Don't track peak memory (it slows things down a little)")
+    parser.add_argument('--save', metavar='PATH', help="Also save the results as a JSON document (for comparing releases)")
+    parser.add_argument('--stats', action='store_true', help="Also print where the time went for each size")
+    args = parser.parse_args(argv)
+
+    # Its own process, so only the pipeline's time and memory get measured
+    server = StubProcess(latency=args.latency, error_rate=args.error_rate, max_rate=args.max_rate, block_size=args.block_size).start()
+
+    # Point everything at the pretend site, and don't let the real sites' rate limits slow it down
+    old_addresses = (rdap.RDAP_addr, geo.GEOIP_addr)
+    rdap.RDAP_addr = server.url + '/ip/{}'
+    geo.GEOIP_addr = server.url + '/?query={}'
+    geo.setLocalDatabase(None)
+    transport.setRateLimit('127.0.0.1', args.client_rate)
+
+    results = []
+    screen = output.PrettyWriter()
+
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            for size in args.sizes:
+                log_path = os.path.join(folder, 'bench_' + str(size) + '.log')
+                different = makeLog(log_path, size, args.repeat_ratio)
+
+                before = server.counts
+                result = runBenchmark(log_path, geo_data=args.data in ('geo', 'both'), rdap_data=args.data in ('rdap', 'both'),
+                                      workers=args.workers, unique=args.unique, trace_memory=not args.no_memory)
+
+                result = dict({'lines': size, 'different_ips': different}, **result)
+                after = server.counts
+                for name in ('requests', 'errors', 'throttled'):
+                    result['server_' + name] = after[name] - before[name]
+                results.append(result)
+
+                screen.writeText('\n\n')
+                screen.write({key: val for key, val in result.items() if key != 'stats'})
+                if args.stats:
+                    screen.writeText('\n' + stats.summaryText())
+                screen.flush()
+
+    finally:
+        rdap.RDAP_addr, geo.GEOIP_addr = old_addresses
+        server.stop()
+
+    if args.save:
+        with output.openWriter('json', args.save) as saved:
+            for result in results:
+                saved.write(dict(result, data=args.data, workers=args.workers, latency=args.latency,
+                                 error_rate=args.error_rate, max_rate=args.max_rate, python=sys.version.split()[0]))
+        print('\n\nSaved the results to ' + args.save)
+
+    return 0
+
+
+
+
+
+##### MAIN #####
+if __name__ == '__main__':
+    sys.exit(main())
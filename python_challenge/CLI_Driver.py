@@ -5,14 +5,39 @@
 ####### VERSION HISTORY #######
 # Version 1: I did everything at once. It can display all GeoIP and RDAP data for a single IP
 #               or file of IPs
+# Version 2: File mode grabs the data for lots of IPs at the same time (see 'Batch.py')
+#            Single IP mode only grabs the RDAP and GeoIP data once per IP (see 'Session.py')
+#            File mode can look up each unique IP only once and show how many times it showed up
+#            File mode skips anything that can't be a real IP before looking it up
+#            File mode can save the results as NDJSON, CSV, or JSON, and writes them in big chunks (see 'Output.py')
+#            File mode only keeps the RDAP fields it prints, not the whole RDAP text (see 'RDAP.RDAPResult')
+#            File mode shows progress and where the time went when the results are saved to a file (see 'Stats.py')
+#            Single IP mode starts grabbing the GeoIP and RDAP data as soon as the IP is typed in, while the menus
+#               are up, and only checks if the IP is valid when the main RDAP info needs to know
+#            File mode saves its progress every few seconds and can pick up where it left off if it got cut short
+#               (see 'Checkpoint.py')
+#            Single IP mode says when the GeoIP site isn't answering instead of calling the filters wrong
+#            File mode starts looking IPs up while the file is still being read (unless it's counting them)
+#            Single IP mode says when the RDAP site isn't answering too, instead of crashing
+#            File mode looks IPs up again if a site wouldn't answer them before the run got cut short
+#            File mode asks for another save path if it can't write to the one it was given, instead of crashing
 ###############################
 
 import Parse as par
 import GEOIP as geo
 import RDAP as rdap
 import Filter as filt
+import Batch as batch
+import Session as session
+import Output as output
+import Stats as stats
+import Checkpoint as ckpt
+import Transport as transport
+import functools
+import itertools
 import pprint
 import os.path
+import sys
 
 # Global variables corresponding to all of the many 'while' loops that exist
 MAIN_LOOP = True
@@ -21,6 +46,9 @@ FILE_LOOP = True
 GEO_LOOP = True
 RDAP_LOOP = True
 
+# How many IPs the file mode will look up at the same time
+WORKERS = batch.DEFAULT_WORKERS
+
 
 
 
@@ -60,7 +88,10 @@ while (MAIN_LOOP != False):
         while (SINGLE_LOOP != False):
             print("\n\nWhat is your IP address?")
             IP = input()
-            valid_IP = filt.validateIP(IP)
+
+            # Holds onto the RDAP and GeoIP data so every menu below uses the same copy. Both start
+            #       downloading now, while they're still reading the menu
+            lookup = session.IPLookup(IP).prefetch()
 
             print('''\n\nWhat type of data would you like to see?:
     [1] GeoIP
@@ -105,7 +136,10 @@ while (MAIN_LOOP != False):
 
                     # Catch just in case filter-arguments are garbage
                     try:
-                        geo.printGEO(geo.getIPData(IP), **arg_dictionary)
+                        geo.printGEO(lookup.getIPData(), **arg_dictionary)
+                    except transport.UpstreamError as error:
+                        print("\nCouldn't reach the GeoIP site (" + str(error) + "). Please try again later\n\n")
+                        break
                     except:
                         print("\nIncorrect format or filters. Please try again\n\n")
                         break
@@ -134,42 +168,47 @@ while (MAIN_LOOP != False):
                     rdap_option = input()
                     print('\n\n')
 
-                    # MR by registration
-                    if rdap_option == '1':
-                        rdap.printEntryInfo(rdap.returnMostRecentUpdateEntry(IP, 1))
+                    # Every one of these needs the RDAP text, which needs the RDAP site to answer
+                    try:
+                        # MR by registration
+                        if rdap_option == '1':
+                            rdap.printEntryInfo(rdap.returnMostRecentUpdateEntry(lookup, 1))
 
-                    # MR by last changed
-                    elif rdap_option == '2':
-                        rdap.printEntryInfo(rdap.returnMostRecentUpdateEntry(IP, 0))
+                        # MR by last changed
+                        elif rdap_option == '2':
+                            rdap.printEntryInfo(rdap.returnMostRecentUpdateEntry(lookup, 0))
 
-                    # Oldest by registration
-                    elif rdap_option == '3':
-                        rdap.printEntryInfo(rdap.returnOldestUpdateEntry(IP, 1))
+                        # Oldest by registration
+                        elif rdap_option == '3':
+                            rdap.printEntryInfo(rdap.returnOldestUpdateEntry(lookup, 1))
 
-                    # Oldest by last changed
-                    elif rdap_option == '4':
-                        rdap.printEntryInfo(rdap.returnOldestUpdateEntry(IP, 0))
+                        # Oldest by last changed
+                        elif rdap_option == '4':
+                            rdap.printEntryInfo(rdap.returnOldestUpdateEntry(lookup, 0))
 
-                    # All
-                    elif rdap_option == '5':
-                        print('''How would you like them to be printed?:
+                        # All
+                        elif rdap_option == '5':
+                            print('''How would you like them to be printed?:
     [1] registration      descending
     [2] last_changed      descending
     [3] registration      ascending
     [4] last_changed      ascending''')
-                        print_option = input()
-
-                        if print_option == '1':
-                            rdap.printAllUpdateEntries(IP, 1)
-                        elif print_option == '2':
-                            rdap.printAllUpdateEntries(IP, 0)
-                        elif print_option == '3':
-                            rdap.printAllUpdateEntries(IP, 1, reverse=True)
-                        elif print_option == '4':
-                            rdap.printAllUpdateEntries(IP, 0, reverse=True)
+                            print_option = input()
+
+                            if print_option == '1':
+                                rdap.printAllUpdateEntries(lookup, 1)
+                            elif print_option == '2':
+                                rdap.printAllUpdateEntries(lookup, 0)
+                            elif print_option == '3':
+                                rdap.printAllUpdateEntries(lookup, 1, reverse=True)
+                            elif print_option == '4':
+                                rdap.printAllUpdateEntries(lookup, 0, reverse=True)
+                    except (transport.UpstreamError, ValueError) as error:
+                        print("\nCouldn't reach the RDAP site (" + str(error) + "). Please try again later\n\n")
+                        break
 
                     # Main
-                    elif rdap_option == '6':
+                    if rdap_option == '6':
                         print('''\n\nWhat would you like to see?:
     ~ registration                        When the entry was created
     ~ handle                              DNR/RIR registry-unique identifier
@@ -204,10 +243,13 @@ while (MAIN_LOOP != False):
 
                         # Catch just in case filter-arguments are garbage or IP fails
                         try:
-                            rdap.printRdapIPInfo(IP, **arg_dictionary)
-                            if not valid_IP:
+                            rdap.printRdapIPInfo(lookup, **arg_dictionary)
+                            if not filt.validateIP(lookup):
                                 print("\nInvalid or reserved IP. Please try again")
                                 break
+                        except (transport.UpstreamError, ValueError) as error:
+                            print("\nCouldn't reach the RDAP site (" + str(error) + "). Please try again later\n\n")
+                            break
                         except:
                             print("\nIncorrect format or filters. Please try again.\n\n")
                             break
@@ -256,23 +298,143 @@ while (MAIN_LOOP != False):
 
                 data_choice = input()
         
-                IPs = par.getIPs(file_path)
-
-                # GeoIP
-                if data_choice == '1':
-                    for ip in IPs:
-                        #print(ip)
-                        geo.printGEO(geo.getIPData(ip))
+                # Only bother reading the file if we're actually going to look something up
+                counter = None
+                stream = None
+                out_format = 'pretty'
+                out_path = None
+                checkpoint = None
+                writer = None
+                stopped = False
+                if data_choice in ('1', '2'):
+                    # Read lazily and checked a batch at a time as the lookups go. Anything that can't be a
+                    #       real IP (e.g. 999.1.1.1) gets thrown out here instead of costing a lookup
+                    stream = par.IPStream(par.iterIPs(file_path))
+                    IPs = iter(stream)
+
+                    print('''\n\nLook up each IP only once (and show how many times it showed up)?:
+        [1] Yes
+        [2] No''')
+                    if input() == '1':
+                        # Counting has to go through the whole file first, but only the unique IPs get kept
+                        counter = par.countIPs(stream.packed())
+                        IPs = counter.ips()
+                        if stream.rejected:
+                            print('\n\nSkipping ' + str(stream.rejected) + " thing(s) that looked like IPs but weren't")
+
+                    print('''\n\nHow would you like the results?:
+        [1] Pretty    Same as always
+        [2] NDJSON    One JSON object per line
+        [3] CSV
+        [4] JSON      One big JSON document''')
+                    out_format = {'2': 'ndjson', '3': 'csv', '4': 'json'}.get(input(), 'pretty')
+
+                    if out_format != 'pretty':
+                        print('\n\nWhere should I save them? (Leave it blank to print them here)')
+                        out_path = input().strip() or None
+
+                    # Opened now, so a bad save path gets asked about again before anything else gets started
+                    while writer is None:
+                        try:
+                            writer = output.openWriter(out_format, out_path)
+                        except OSError as error:
+                            print("\n\nCouldn't save to " + out_path + ' (' + str(error.strerror or error) + '). Where should I save them instead? (Leave it blank to print them here)')
+                            out_path = input().strip() or None
+
+                    # Saved every few seconds, so if the run gets cut short (crash, Ctrl-C, etc) it can pick up
+                    #       right where it left off next time instead of looking everything up again
+                    #       (the results get written out again from the top, so the output format can change)
+                    checkpoint = ckpt.BatchCheckpoint(ckpt.checkpointPath(file_path),
+                                                      ckpt.describeRun(file_path, data=data_choice, unique=counter is not None))
+                    try:
+                        already_done = checkpoint.load()
+                    except ckpt.CheckpointError:
+                        print('\n\nThrowing out the progress saved from a different run on this file')
+                        checkpoint.clear()
+                        already_done = 0
+
+                    if already_done:
+                        print('\n\nThis run got cut short last time (' + str(already_done) + ''' IPs were done). Pick up where it left off?:
+        [1] Yes
+        [2] No (start over)''')
+                        if input() == '2':
+                            checkpoint.clear()
+                            already_done = 0
+
+                    # The ones that are already done come out of the checkpoint instead
+                    IPs = itertools.islice(IPs, already_done, None)
+
+                    # Nothing is getting printed to the screen, so say how it's going instead (how many there
+                    #       are in all is only known up front when counting)
+                    if out_path:
+                        stats.reset()
+                        total = len(counter) - already_done if counter is not None else None
+                        progress = stats.Progress(total=total, stream=sys.stdout).start()
+
+                try:
+                    # GeoIP
+                    if data_choice == '1':
+                        # Also used again on anything the site wouldn't answer last time
+                        lookup = functools.partial(batch.enrichIPs, rdap_data=False, workers=WORKERS)
+
+                        with writer:
+                            for ip, geo_data, rdap_text in checkpoint.run(lookup(IPs), retry=lookup):
+                                if out_format == 'pretty':
+                                    if counter is not None:
+                                        writer.writeText('\n\n' + ip + ' showed up ' + str(counter.count(ip)) + ' time(s)\n')
+                                    geo.printGEO(geo_data, writer=writer)
+                                else:
+                                    record = batch.buildRecord(ip, geo_data, None, geo.GEO_FIELDS, None)
+                                    if counter is not None:
+                                        record['count'] = counter.count(ip)
+                                    writer.write(record)
                    
-                # RDAP
-                elif data_choice == '2':
-                    for ip in IPs:
-                        #print(ip)
-                        result = rdap.printRdapIPInfo(ip)
-
-                # <--
-                elif data_choice == '3':
-                    break
+                    # RDAP
+                    elif data_choice == '2':
+                        # Also used again on anything the site wouldn't answer last time
+                        lookup = functools.partial(batch.enrichIPs, geo_data=False, workers=WORKERS, compact=True)
+
+                        with writer:
+                            for ip, geo_data, rdap_text in checkpoint.run(lookup(IPs), retry=lookup):
+                                # Invalid/reserved IPs come back as None and don't get printed
+                                if rdap_text is None:
+                                    continue
+
+                                if out_format == 'pretty':
+                                    if counter is not None:
+                                        writer.writeText('\n\n' + ip + ' showed up ' + str(counter.count(ip)) + ' time(s)\n')
+                                    rdap.printRdapIPInfo(ip, rdap_text=rdap_text, writer=writer)
+                                else:
+                                    record = batch.buildRecord(ip, None, rdap_text, None, rdap.RDAP_FIELDS)
+                                    if counter is not None:
+                                        record['count'] = counter.count(ip)
+                                    writer.write(record)
+
+                    # <--
+                    elif data_choice == '3':
+                        break
+
+                # Everything finished so far is already in the checkpoint
+                except KeyboardInterrupt:
+                    stopped = True
+                    print('\n\nStopped. Pick the same file and options again to pick up where it left off')
+
+                # Save whatever finished since the last save (does nothing if the run made it to the end)
+                finally:
+                    if checkpoint is not None:
+                        checkpoint.close()
+                    if writer is not None:
+                        writer.close()
+
+                # Only known now, since the file got read as the lookups went
+                if counter is None and stream is not None and stream.rejected:
+                    print('\n\nSkipped ' + str(stream.rejected) + " thing(s) that looked like IPs but weren't")
+
+                if out_path:
+                    progress.stop()
+                    if not stopped:
+                        print('\n\nSaved the results to ' + out_path)
+                    stats.printSummary(sys.stdout)
 
     # Quit  ######################################################
     elif ip_choice == '3':
@@ -0,0 +1,578 @@
+#! python3
+
+# Cache.py - A script that handles saving RDAP and GeoIP responses to disk so we don't have to ask twice
+
+####### VERSION HISTORY #######
+# Version 1: Added 'ResponseCache' class to store responses in SQLite by IP and source (with TTLs,
+#               negative caching, and size-based eviction)
+#            Added 'getDefaultCache' and 'setDefaultCache' functions to share one cache between modules
+# Version 2: Added 'RangeCache' class to answer RDAP lookups for any IP inside a network block we've already seen
+#            Added a 'ranges' table to 'ResponseCache' so known network blocks survive between runs
+#            Added 'getDefaultRangeCache' function to share one range cache between modules
+#            Edited 'RangeCache' to find blocks with one bisect and a climb through the nesting instead of a scan
+#            Added 'coversNeighbours' function so allocations and IANA placeholders only answer for their own IP
+###############################
+
+import os
+import os.path
+import sqlite3
+import threading
+import time
+import json
+import bisect
+import Parse as par
+
+# Where the cache lives if nobody says otherwise. Can be changed with the GRIP_CACHE_DIR environment variable
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.grip_cache')
+
+# Name of the SQLite file inside the cache directory
+CACHE_FILE = 'responses.sqlite3'
+
+# How long (in seconds) a good answer is kept for each source
+#       RDAP registrations barely ever change, GeoIP moves around a little more
+DEFAULT_TTLS = {'rdap': 7 * 24 * 60 * 60,
+                'geoip': 24 * 60 * 60
+                }
+
+# How long (in seconds) we remember that an IP was invalid/reserved
+NEGATIVE_TTL = 24 * 60 * 60
+
+# Once the stored responses get bigger than this (in bytes), the oldest ones get thrown out
+MAX_BYTES = 256 * 1024 * 1024
+
+# RDAP network types that can have smaller blocks handed out inside them (ALLOCATED PORTABLE, REALLOCATED,
+#       DIRECT ALLOCATION, etc), so their answers don't get used for the IPs around them
+BROAD_TYPES = ('ALLOCAT', 'RESERVED')
+
+# How many saves happen between checks on the size of the cache
+EVICT_EVERY = 500
+
+# The cache shared by RDAP.py and GEOIP.py (see 'getDefaultCache')
+_default_cache = None
+_default_lock = threading.Lock()
+_default_set = False
+
+# The range cache shared by RDAP.py (see 'getDefaultRangeCache')
+_default_ranges = None
+
+
+
+# Stores RDAP and GeoIP responses in an SQLite file, keyed by source ('rdap' or 'geoip') and IP
+class ResponseCache():
+    '''Stores RDAP and GeoIP responses in an SQLite file, keyed by source ('rdap' or 'geoip') and IP.
+            Safe to share between threads (every thread gets its own connection).
+
+        Arguments:
+            directory: Folder to keep the SQLite file in (created if it doesn't exist)
+            ttls: Dictionary of source -> seconds a good answer is kept
+            negative_ttl: Seconds an invalid/reserved answer is kept
+            max_bytes: Size the stored responses are trimmed back down to
+    '''
+
+    def __init__(self, directory=None, ttls=None, negative_ttl=NEGATIVE_TTL, max_bytes=MAX_BYTES):
+        if directory is None:
+            directory = os.environ.get('GRIP_CACHE_DIR', DEFAULT_CACHE_DIR)
+
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = os.path.join(directory, CACHE_FILE)
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.negative_ttl = negative_ttl
+        self.max_bytes = max_bytes
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._saves = 0
+
+        with self._connect() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+                                source TEXT NOT NULL,
+                                ip TEXT NOT NULL,
+                                stored_at REAL NOT NULL,
+                                expires_at REAL NOT NULL,
+                                payload BLOB,
+                                PRIMARY KEY (source, ip))''')
+            conn.execute('CREATE INDEX IF NOT EXISTS responses_stored_at ON responses (stored_at)')
+            conn.execute('''CREATE TABLE IF NOT EXISTS ranges (
+                                start INTEGER NOT NULL,
+                                end INTEGER NOT NULL,
+                                ip TEXT NOT NULL,
+                                expires_at REAL NOT NULL,
+                                PRIMARY KEY (start, end))''')
+
+    # Hands back this thread's connection to the SQLite file (making one if needed)
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+
+        return conn
+
+    # Looks up a saved response
+    # Returns: Tuple of (found, payload). A payload of None means the IP was saved as invalid/reserved
+    # External Modifications: None
+    def get(self, source, ip):
+        '''Looks up a saved response
+
+            Arguments:
+                source: 'rdap' or 'geoip'
+                ip: String version of IP address
+            Returns: Tuple of (found, payload). A payload of None means the IP was saved as invalid/reserved
+            External Modifications: None
+        '''
+
+        row = self._connect().execute('SELECT expires_at, payload FROM responses WHERE source = ? AND ip = ?',
+                                      (source, str(ip))).fetchone()
+
+        # Never saved, or saved too long ago
+        if row is None or row[0] < time.time():
+            return (False, None)
+
+        return (True, row[1])
+
+    # Saves a response
+    # Returns: Nothing
+    # External Modifications: Writes to the SQLite file
+    def put(self, source, ip, payload):
+        '''Saves a response
+
+            Arguments:
+                source: 'rdap' or 'geoip'
+                ip: String version of IP address
+                payload: Raw response (str or bytes), or None to remember that the IP was invalid/reserved
+            Returns: Nothing
+            External Modifications: Writes to the SQLite file
+        '''
+
+        now = time.time()
+
+        if payload is None:
+            expires_at = now + self.negative_ttl
+        else:
+            expires_at = now + self.ttls.get(source, NEGATIVE_TTL)
+
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                         (source, str(ip), now, expires_at, payload))
+
+        # Every so often, make sure we haven't gotten too big
+        with self._lock:
+            self._saves += 1
+            check = self._saves % EVICT_EVERY == 0
+
+        if check:
+            self.evict()
+
+        return
+
+    # Remembers that the RDAP response saved under 'ip' covers every address from 'start' to 'end'
+    # Returns: Nothing
+    # External Modifications: Writes to the SQLite file
+    def putRange(self, start, end, ip):
+        '''Remembers that the RDAP response saved under 'ip' covers every address from 'start' to 'end'
+
+            Arguments:
+                start: Integer version of the first IP in the network block
+                end: Integer version of the last IP in the network block
+                ip: String version of the IP the response is saved under
+            Returns: Nothing
+            External Modifications: Writes to the SQLite file
+        '''
+
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO ranges VALUES (?, ?, ?, ?)',
+                         (start, end, str(ip), time.time() + self.ttls.get('rdap', NEGATIVE_TTL)))
+
+        return
+
+    # Grabs every network block that hasn't expired yet
+    # Returns: List of (start, end, ip) tuples
+    # External Modifications: None
+    def getRanges(self):
+        '''Grabs every network block that hasn't expired yet
+
+            Arguments:
+                None
+            Returns: List of (start, end, ip) tuples
+            External Modifications: None
+        '''
+
+        return self._connect().execute('SELECT start, end, ip FROM ranges WHERE expires_at >= ?', (time.time(),)).fetchall()
+
+    # Throws out expired responses, then the oldest ones until the cache is under 'max_bytes'
+    # Returns: Number of responses thrown out
+    # External Modifications: Deletes from the SQLite file
+    def evict(self):
+        '''Throws out expired responses, then the oldest ones until the cache is under 'max_bytes'
+
+            Arguments:
+                None
+            Returns: Number of responses thrown out
+            External Modifications: Deletes from the SQLite file
+        '''
+
+        with self._connect() as conn:
+            removed = conn.execute('DELETE FROM responses WHERE expires_at < ?', (time.time(),)).rowcount
+            conn.execute('DELETE FROM ranges WHERE expires_at < ?', (time.time(),))
+
+            total = conn.execute('SELECT COALESCE(SUM(LENGTH(payload)), 0) FROM responses').fetchone()[0]
+
+            # Oldest first until we're back under the limit
+            if total > self.max_bytes:
+                extra = total - self.max_bytes
+                cutoff = None
+
+                for stored_at, size in conn.execute('SELECT stored_at, COALESCE(LENGTH(payload), 0) FROM responses ORDER BY stored_at'):
+                    extra -= size
+                    cutoff = stored_at
+                    if extra <= 0:
+                        break
+
+                if cutoff is not None:
+                    removed += conn.execute('DELETE FROM responses WHERE stored_at <= ?', (cutoff,)).rowcount
+
+        return removed
+
+    # Throws out everything
+    # Returns: Nothing
+    # External Modifications: Deletes from the SQLite file
+    def clear(self):
+        '''Throws out everything
+
+            Arguments:
+                None
+            Returns: Nothing
+            External Modifications: Deletes from the SQLite file
+        '''
+
+        with self._connect() as conn:
+            conn.execute('DELETE FROM responses')
+            conn.execute('DELETE FROM ranges')
+
+        return
+
+
+# Keeps RDAP responses by the network block they describe, so any IP inside one can be answered without asking again
+class RangeCache():
+    '''Keeps RDAP responses by the network block they describe ('startAddress' to 'endAddress'), so any IP
+            inside a block we've already seen can be answered without going back to the RDAP site. When
+            blocks are nested (e.g. a /24 inside a /16), the smallest block holding the IP wins.
+
+            Blocks are sorted by start address, and each one knows the smallest block it sits inside, so a
+            lookup is one bisect and then a short climb out through the nesting (never a scan).
+
+            Bear in mind the RDAP site answers with the smallest block it knows about, so a big block may
+            have smaller blocks inside it that we haven't seen yet. Only answers for blocks that have been
+            assigned to somebody get used for their neighbours (see 'coversNeighbours'). Allocations
+            (which get carved up further) and IANA placeholder blocks only ever answer for their own IP.
+
+        Arguments:
+            persistent: ResponseCache to save blocks to and load them from between runs (or None)
+    '''
+
+    def __init__(self, persistent=None):
+        self.persistent = persistent
+
+        # Sorted by (start, -end), so a block comes before any block inside it that starts at the same address.
+        #       Each entry is [start, end, key, rdap_text, parent]. 'rdap_text' is None until a block loaded
+        #       from disk is actually used (see '_loadText'), 'parent' is the smallest entry it sits inside
+        self._keys = []
+        self._entries = []
+
+        self._lock = threading.Lock()
+        self._loaded = persistent is None
+
+    # Pulls in the blocks saved by earlier runs (only the addresses, the responses get loaded when used)
+    def _loadRanges(self):
+        if self._loaded:
+            return
+
+        self._loaded = True
+
+        try:
+            ranges = self.persistent.getRanges()
+        except sqlite3.Error:
+            return
+
+        for start, end, ip in ranges:
+            self._insert(start, end, ip, None)
+
+    # Finds the smallest known block holding everything from 'start' to 'end'
+    # Returns: Tuple of (index of the last entry sorted before that range, the block or None)
+    def _enclosing(self, start, end):
+        i = bisect.bisect_right(self._keys, (start, -end)) - 1
+        entry = self._entries[i] if i >= 0 else None
+
+        # The last block starting at or before 'start' either holds it, or it's a neighbour and whatever
+        #       holds it is somewhere further out in the nesting
+        while entry is not None and entry[1] < end:
+            entry = entry[4]
+
+        return (i, entry)
+
+    # Puts a block into the sorted lists (replacing the old one if it's the exact same block)
+    # Returns: True if it went in, False if it half-overlaps a block we already have
+    def _insert(self, start, end, key, rdap_text):
+        i, parent = self._enclosing(start, end)
+
+        # Same block already in here, just update it
+        if parent is not None and parent[0] == start and parent[1] == end:
+            parent[2] = key
+            parent[3] = rdap_text
+            return True
+
+        # Anything between the last block before us and the one we sit in has to end before we start.
+        #       Otherwise the two only half overlap, which real network blocks never do
+        entry = self._entries[i] if i >= 0 else None
+        while entry is not None and entry is not parent:
+            if entry[1] >= start:
+                return False
+            entry = entry[4]
+
+        # Same goes for the blocks after us that start inside us: they have to end inside us too
+        j = i + 1
+        while j < len(self._entries) and self._entries[j][0] <= end:
+            if self._entries[j][1] > end:
+                return False
+            j += 1
+
+        new_entry = [start, end, key, rdap_text, parent]
+
+        # Everything that starts inside us and used to sit directly in our parent sits in us now
+        for child in self._entries[i + 1:j]:
+            if child[4] is parent:
+                child[4] = new_entry
+
+        self._keys.insert(i + 1, (start, -end))
+        self._entries.insert(i + 1, new_entry)
+
+        return True
+
+    # Takes a block out, handing its children to its parent
+    def _remove(self, entry):
+        i = bisect.bisect_left(self._keys, (entry[0], -entry[1]))
+
+        j = i + 1
+        while j < len(self._entries) and self._entries[j][0] <= entry[1]:
+            if self._entries[j][4] is entry:
+                self._entries[j][4] = entry[4]
+            j += 1
+
+        del self._keys[i]
+        del self._entries[i]
+
+    # Loads the saved RDAP response for a block that came from disk
+    # Returns: RDAP text, or None if it isn't saved anymore (or can't be used for neighbours)
+    def _loadText(self, entry):
+        try:
+            found, payload = self.persistent.get('rdap', entry[2])
+        except sqlite3.Error:
+            return None
+
+        if not found or payload is None:
+            return None
+
+        rdap_text = json.loads(payload)
+
+        # Saved before we knew better
+        if not coversNeighbours(entry[2], rdap_text):
+            return None
+
+        entry[3] = rdap_text
+        return entry[3]
+
+    # Finds the RDAP response for the smallest known block holding the IP
+    # Returns: RDAP text in JSON layout, or None if no known block holds the IP
+    # External Modifications: None
+    def lookup(self, IP):
+        '''Finds the RDAP response for the smallest known block holding the IP
+
+            Arguments:
+                IP: String version of IP address
+            Returns: RDAP text in JSON layout, or None if no known block holds the IP
+            External Modifications: None
+        '''
+
+        number = par.ipToInt(IP)
+        if number is None:
+            return None
+
+        with self._lock:
+            self._loadRanges()
+
+            best = self._enclosing(number, number)[1]
+
+            if best is None:
+                return None
+
+            if best[3] is not None:
+                return best[3]
+
+            rdap_text = self._loadText(best)
+
+            # The response got thrown out of the cache, so forget the block too
+            if rdap_text is None:
+                self._remove(best)
+
+            return rdap_text
+
+    # Saves an RDAP response under the network block it describes
+    # Returns: True if it was saved, False if it can't be used for other IPs
+    # External Modifications: Writes to the persistent cache (if there is one)
+    def add(self, IP, rdap_text):
+        '''Saves an RDAP response under the network block it describes
+
+            Arguments:
+                IP: String version of the IP that was looked up (the response is saved on disk under it)
+                rdap_text: RDAP text in JSON layout
+            Returns: True if it was saved, False if it can't be used for other IPs (not an IPv4 block, an
+                     allocation or placeholder block, or it half-overlaps a block we already have)
+            External Modifications: Writes to the persistent cache (if there is one)
+        '''
+
+        if not coversNeighbours(IP, rdap_text):
+            return False
+
+        start = par.ipToInt(rdap_text['startAddress'])
+        end = par.ipToInt(rdap_text['endAddress'])
+
+        with self._lock:
+            self._loadRanges()
+            if not self._insert(start, end, str(IP), rdap_text):
+                return False
+
+        if self.persistent is not None:
+            try:
+                self.persistent.putRange(start, end, IP)
+            except sqlite3.Error:
+                pass
+
+        return True
+
+
+# Works out if an RDAP answer can be used for every other IP in its block, not just the one asked about
+# Returns: True if it can, False if it only answers for its own IP
+# External Modifications: None
+def coversNeighbours(IP, rdap_text):
+    '''Works out if an RDAP answer can be used for every other IP in its block, not just the one asked about.
+            The RDAP site answers with the smallest block it has, so a block that's been assigned to somebody
+            is the final word for everything in it. An allocation (or an IANA placeholder for space another
+            registry looks after) can have smaller blocks inside it that belong to somebody else.
+
+        Arguments:
+            IP: String version of the IP that was looked up
+            rdap_text: RDAP text in JSON layout
+        Returns: True if it can, False if it only answers for its own IP
+        External Modifications: None
+    '''
+
+    try:
+        start = par.ipToInt(rdap_text['startAddress'])
+        end = par.ipToInt(rdap_text['endAddress'])
+    except (KeyError, TypeError):
+        return False
+
+    number = par.ipToInt(IP)
+
+    # Not an IPv4 block, or not even the block the IP is in
+    if start is None or end is None or number is None or not start <= number <= end:
+        return False
+
+    kind = str(rdap_text.get('type', '')).upper()
+    label = (str(rdap_text.get('name', '')) + ' ' + str(rdap_text.get('handle', ''))).upper()
+
+    for word in BROAD_TYPES:
+        if word in kind:
+            return False
+
+    return 'IANA' not in label
+
+
+# Hands back the cache shared by RDAP.py and GEOIP.py, making it the first time it's asked for
+# Returns: ResponseCache, or None if caching has been turned off
+# External Modifications: Creates the cache directory the first time it's called
+def getDefaultCache():
+    '''Hands back the cache shared by RDAP.py and GEOIP.py, making it the first time it's asked for.
+            Setting the GRIP_CACHE environment variable to 'off' turns caching off.
+
+        Arguments:
+            None
+        Returns: ResponseCache, or None if caching has been turned off
+        External Modifications: Creates the cache directory the first time it's called
+    '''
+
+    global _default_cache, _default_set
+
+    with _default_lock:
+        if not _default_set:
+            if os.environ.get('GRIP_CACHE', '').lower() in ('0', 'off', 'no', 'false'):
+                _default_cache = None
+            else:
+                try:
+                    _default_cache = ResponseCache()
+                except (OSError, sqlite3.Error):
+                    # Read-only home directory or similar. Just run without a cache
+                    _default_cache = None
+            _default_set = True
+
+    return _default_cache
+
+# Hands back the range cache shared by RDAP.py, making it the first time it's asked for
+# Returns: RangeCache
+# External Modifications: None
+def getDefaultRangeCache():
+    '''Hands back the range cache shared by RDAP.py, making it the first time it's asked for.
+            It saves its blocks to the default cache (if caching is turned on).
+
+        Arguments:
+            None
+        Returns: RangeCache
+        External Modifications: None
+    '''
+
+    global _default_ranges
+
+    persistent = getDefaultCache()
+
+    with _default_lock:
+        if _default_ranges is None:
+            _default_ranges = RangeCache(persistent)
+
+    return _default_ranges
+
+# Swaps out the cache shared by RDAP.py and GEOIP.py
+# Returns: Nothing
+# External Modifications: Changes which cache every lookup uses
+def setDefaultCache(cache):
+    '''Swaps out the cache shared by RDAP.py and GEOIP.py
+
+        Arguments:
+            cache: ResponseCache to use from now on, or None to turn caching off
+        Returns: Nothing
+        External Modifications: Changes which cache every lookup uses
+    '''
+
+    global _default_cache, _default_set, _default_ranges
+
+    with _default_lock:
+        _default_cache = cache
+        _default_set = True
+
+        # Blocks saved to the old cache don't belong to the new one
+        _default_ranges = None
+
+    return
+
+
+
+
+
+##### MAIN #####
+if __name__ == '__main__':
+    print("Hello, World!")
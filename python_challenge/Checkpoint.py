@@ -0,0 +1,427 @@
+#! python3
+
+# Checkpoint.py - A script that handles saving how far a file run got so it can pick up where it left off
+
+####### VERSION HISTORY #######
+# Version 1: Added 'BatchCheckpoint' class to save finished lookups every few seconds during a file run and
+#               hand them back (then carry on with the rest) if the run has to be started again
+#            Added 'describeRun' function so a checkpoint only gets used for the exact same run
+# Version 2: Edited 'BatchCheckpoint' to mark lookups a site wouldn't answer, and look them up again when the
+#               run gets picked back up (see 'BatchCheckpoint.run')
+###############################
+
+import gzip
+import json
+import os
+import os.path
+import sys
+import time
+import zlib
+import GEOIP as geo
+import GeoDB as geodb
+import RDAP as rdap
+
+# Seconds between saves. This is the most work a crash can cost
+CHECKPOINT_SECONDS = 5.0
+
+# What gets tacked onto the input file's name to make the checkpoint's
+CHECKPOINT_SUFFIX = '.grip-checkpoint'
+
+
+
+# Raised when a checkpoint belongs to a different run (different file, different options)
+class CheckpointError(Exception):
+    '''Raised when a checkpoint belongs to a different run (different file, different options)
+    '''
+
+
+# Everything a file run has finished so far, saved every few seconds so a crash only costs the last few seconds
+class BatchCheckpoint():
+    '''Everything a file run has finished so far, saved every few seconds so a crash (network drop,
+            Ctrl-C, laptop going to sleep) only costs the last few seconds instead of the whole run.
+
+            The file is gzipped JSON lines. The first line says which run it's for, then every save adds
+            the lookups finished since the last one and a '{"done": N}' line. Each save is its own gzip
+            member, so a save that got cut off halfway just gets ignored next time.
+
+            Lookups are kept small: the GeoIP fields (not the whole response) and the RDAP menu fields.
+            Lookups a site wouldn't answer (see 'Batch.Lookup') get saved with a mark on them. When the run
+            is picked back up they're looked up again, and the new answer gets saved as a '{"redo": N, ...}'
+            line that replaces lookup number N.
+
+        Arguments:
+            path: The checkpoint file
+            signature: Which run this is (see 'describeRun')
+            every: Seconds between saves
+    '''
+
+    def __init__(self, path, signature, every=CHECKPOINT_SECONDS):
+        self.path = path
+        self.signature = signature
+        self.every = every
+
+        # How many lookups (in input order) are already saved
+        self.done = 0
+
+        self._pending = []
+
+        # Lookups done again since the last save: (position, saved lookup)
+        self._redone = []
+
+        self._last_save = time.monotonic()
+        self._started = False
+        self._finished = False
+
+        # Set when the file ends in a save that got cut off
+        self._cut_off = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    # Goes through the lines in the file, stopping quietly at a save that got cut off
+    def _lines(self):
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as myfile:
+                for line in myfile:
+                    yield json.loads(line)
+        except (EOFError, zlib.error, ValueError):
+            self._cut_off = True
+
+        return
+
+    # Checks for a checkpoint from an earlier go at this run
+    # Returns: How many lookups it has (0 if there isn't one)
+    # External Modifications: Reads the checkpoint file
+    def load(self):
+        '''Checks for a checkpoint from an earlier go at this run
+
+            Arguments:
+                None
+            Returns: How many lookups it has (0 if there isn't one)
+            Raises: CheckpointError if the checkpoint is for a different run
+            External Modifications: Reads the checkpoint file
+        '''
+
+        self.done = 0
+
+        if not os.path.isfile(self.path):
+            return 0
+
+        lines = self._lines()
+        first = next(lines, None)
+
+        if first is None:
+            return 0
+        if first.get('run') != self.signature:
+            raise CheckpointError(self.path + " is from a different run (different file or options)")
+
+        for entry in lines:
+            if isinstance(entry, dict) and 'done' in entry:
+                self.done = entry['done']
+
+        # Nothing after a cut-off save can be read back, so write out a clean copy before adding to it
+        if self._cut_off:
+            self._rewrite()
+
+        self._started = True
+
+        return self.done
+
+    # Writes the file back out with just the lookups from the finished saves
+    def _rewrite(self):
+        temp_path = self.path + '.tmp'
+
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as myfile:
+            myfile.write(json.dumps({'run': self.signature}) + '\n')
+            for entry in self._saved():
+                myfile.write(json.dumps(entry, separators=(',', ':')) + '\n')
+            myfile.write(json.dumps({'done': self.done}) + '\n')
+
+        os.replace(temp_path, self.path)
+        self._cut_off = False
+
+        return
+
+    # Finds the lookups that got done again on an earlier pick up (only from saves that finished)
+    # Returns: Dictionary of position -> saved lookup
+    def _redos(self):
+        redos = {}
+        unsaved = {}
+
+        lines = self._lines()
+        next(lines, None)
+
+        for entry in lines:
+            if isinstance(entry, dict) and 'redo' in entry:
+                unsaved[entry['redo']] = entry['entry']
+            elif isinstance(entry, dict) and 'done' in entry:
+                redos.update(unsaved)
+                unsaved = {}
+
+        return redos
+
+    # Goes through the saved lookups (only the first 'done' of them, anything after that never finished saving)
+    def _saved(self):
+        if self.done == 0:
+            return
+
+        redos = self._redos()
+
+        count = 0
+        lines = self._lines()
+        next(lines, None)
+
+        for entry in lines:
+            if isinstance(entry, list):
+                yield redos.get(count, entry)
+                count += 1
+                if count >= self.done:
+                    break
+
+        return
+
+    # Hands back every lookup the checkpoint has, then every new one (saving them as they go by)
+    # Returns: Generator of (IP, GeoIP respData or None, RDAP text or RDAP.RDAPResult or None)
+    # External Modifications: Writes the checkpoint file every few seconds. Deletes it once 'results' runs out
+    def run(self, results, retry=None):
+        '''Hands back every lookup the checkpoint has, then every new one (saving them as they go by).
+                Call 'load' first, and leave the first 'done' IPs out of 'results'.
+
+            Arguments:
+                results: The new lookups (e.g. from 'Batch.enrichIPs'), in input order
+                retry: Function that takes IPs and hands back their lookups in the same order (e.g. a
+                       'Batch.enrichIPs' call), for saved lookups a site wouldn't answer last time. If it's
+                       None, those come back out with their missing data as None
+            Returns: Generator of (IP, GeoIP respData or None, RDAP text or RDAP.RDAPResult or None)
+            External Modifications: Writes the checkpoint file every few seconds. Deletes it once 'results' runs out
+        '''
+
+        # Worked out up front (it's only the failed ones), so nothing reads the file while it's being saved to
+        retried = None
+        if retry is not None:
+            failed = [entry[0] for entry in self._saved() if _failed(entry)]
+            if failed:
+                retried = iter(retry(failed))
+
+        try:
+            for position, entry in enumerate(self._saved()):
+                if retried is None or not _failed(entry):
+                    yield _decode(entry)
+                    continue
+
+                result = next(retried)
+                self._redone.append((position, _encode(*result, failed=getattr(result, 'failed', False))))
+                self._saveNow()
+                yield result
+
+        finally:
+            if retried is not None and hasattr(retried, 'close'):
+                retried.close()
+
+        for result in results:
+            self._pending.append(_encode(*result, failed=getattr(result, 'failed', False)))
+            self._saveNow()
+            yield result
+
+        self.finish()
+
+        return
+
+    # Saves if it's been long enough since the last save
+    def _saveNow(self):
+        if time.monotonic() - self._last_save >= self.every:
+            self.save()
+
+    # Saves the lookups finished since the last save
+    # Returns: Nothing
+    # External Modifications: Adds to the checkpoint file
+    def save(self):
+        '''Saves the lookups finished since the last save
+
+            Arguments:
+                None
+            Returns: Nothing
+            External Modifications: Adds to the checkpoint file
+        '''
+
+        self._last_save = time.monotonic()
+
+        if self._finished or (not self._pending and not self._redone and self._started):
+            return
+
+        lines = []
+        if not self._started:
+            lines.append(json.dumps({'run': self.signature}))
+
+        lines.extend(json.dumps(entry, separators=(',', ':')) for entry in self._pending)
+        lines.extend(json.dumps({'redo': position, 'entry': entry}, separators=(',', ':')) for position, entry in self._redone)
+        lines.append(json.dumps({'done': self.done + len(self._pending)}))
+
+        # Open, write, and close every time so everything saved so far is a finished gzip member
+        try:
+            with gzip.open(self.path, 'at' if self._started else 'wt', encoding='utf-8') as myfile:
+                myfile.write('\n'.join(lines) + '\n')
+
+        # Read-only folder, full disk, etc. Not worth stopping the run over, it just can't be picked back up
+        except OSError as error:
+            print("\nCouldn't save progress to " + self.path + ": " + str(error), file=sys.stderr)
+            self._finished = True
+            self._pending = []
+            self._redone = []
+            return
+
+        self.done += len(self._pending)
+        self._pending = []
+        self._redone = []
+        self._started = True
+
+        return
+
+    # Throws the checkpoint away so the run starts over from the top
+    # Returns: Nothing
+    # External Modifications: Deletes the checkpoint file
+    def clear(self):
+        '''Throws the checkpoint away so the run starts over from the top
+
+            Arguments:
+                None
+            Returns: Nothing
+            External Modifications: Deletes the checkpoint file
+        '''
+
+        self.done = 0
+        self._pending = []
+        self._redone = []
+        self._started = False
+
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+        return
+
+    # Throws the checkpoint away once the run has made it to the end
+    # Returns: Nothing
+    # External Modifications: Deletes the checkpoint file
+    def finish(self):
+        '''Throws the checkpoint away once the run has made it to the end (nothing gets saved after this)
+
+            Arguments:
+                None
+            Returns: Nothing
+            External Modifications: Deletes the checkpoint file
+        '''
+
+        self.clear()
+        self._finished = True
+
+        return
+
+    # Saves whatever is left if the run didn't make it to the end
+    # Returns: Nothing
+    # External Modifications: Adds to the checkpoint file
+    def close(self):
+        '''Saves whatever is left if the run didn't make it to the end (call it on the way out, or use 'with')
+
+            Arguments:
+                None
+            Returns: Nothing
+            External Modifications: Adds to the checkpoint file
+        '''
+
+        if not self._finished:
+            self.save()
+
+        return
+
+
+
+# Shrinks a lookup down to what's worth saving
+# Returns: List of [IP, GeoIP, RDAP] (plus a true on the end if a site wouldn't answer) ready for JSON
+def _encode(ip, geo_data, rdap_text, failed=False):
+    # GeoIP: the fields, or the 'not valid' message as is
+    if geo_data is None or isinstance(geo_data, str):
+        geo_saved = geo_data
+    else:
+        record = geo.parseGEO(geo_data)
+        geo_saved = list(record) if record is not None else None
+
+    # RDAP: the menu fields (so it comes back as an 'RDAP.RDAPResult'), or the full text if that's what we were handed
+    if isinstance(rdap_text, rdap.RDAPResult):
+        rdap_saved = list(rdap_text.asDict().values())
+    else:
+        rdap_saved = rdap_text
+
+    if failed:
+        return [ip, geo_saved, rdap_saved, True]
+
+    return [ip, geo_saved, rdap_saved]
+
+# Checks if a saved lookup is one a site wouldn't answer
+def _failed(entry):
+    return len(entry) > 3 and entry[3] is True
+
+# Puts a saved lookup back together
+# Returns: Tuple of (IP, GeoIP respData or None, RDAP text or RDAP.RDAPResult or None)
+def _decode(entry):
+    ip, geo_saved, rdap_saved = entry[:3]
+
+    # Dressed back up like the site's answer, so 'GEOIP.printGEO' and 'GEOIP.parseGEO' take it as usual
+    geo_data = geo_saved
+    if isinstance(geo_saved, list):
+        geo_data = geodb.toXML({geo.GEO_TAGS[field]: ('' if value is None else value) for field, value in zip(geo.GEO_FIELDS, geo_saved)})
+
+    rdap_text = rdap_saved
+    if isinstance(rdap_saved, list):
+        rdap_text = rdap.RDAPResult.fromValues(ip, rdap_saved)
+
+    return (ip, geo_data, rdap_text)
+
+# Works out which checkpoint file goes with an input file
+# Returns: Path of the checkpoint file
+# External Modifications: None
+def checkpointPath(file_path):
+    '''Works out which checkpoint file goes with an input file (it sits right next to it)
+
+        Arguments:
+            file_path: The file the IPs come from
+        Returns: Path of the checkpoint file
+        External Modifications: None
+    '''
+
+    return str(file_path) + CHECKPOINT_SUFFIX
+
+# Describes a run, so a checkpoint only gets picked back up by the exact same run
+# Returns: Dictionary for 'BatchCheckpoint'
+# External Modifications: None
+def describeRun(file_path, **options):
+    '''Describes a run, so a checkpoint only gets picked back up by the exact same run (same file, not
+            changed since, and the same options)
+
+        Arguments:
+            file_path: The file the IPs come from
+            options: Anything else that changes what the run looks up or prints (e.g. data='geoip', unique=True)
+        Returns: Dictionary for 'BatchCheckpoint'
+        External Modifications: None
+    '''
+
+    info = os.stat(file_path)
+
+    return {'file': os.path.abspath(file_path),
+            'size': info.st_size,
+            'modified': int(info.st_mtime),
+            'options': {key: options[key] for key in sorted(options)}
+            }
+
+
+
+
+
+##### MAIN #####
+if __name__ == '__main__':
+    print("Hello, World!")
@@ -5,10 +5,43 @@
 ####### VERSION HISTORY #######
 # Version 1: Added 'getBoolList' function to return a list of items in string
 #            Added 'validateIP' function to validate IPs for the driver
+# Version 2: Edited 'validateIP' to accept a 'Session.IPLookup' so the RDAP site isn't visited twice
+# Version 3: Added 'classifyIP' function to spot private/loopback/multicast/etc IPs without visiting any site
+#            Edited 'validateIP' to skip the RDAP site for those
+# Version 4: Edited 'validateIP' to reuse open connections (see 'Transport.py')
+#            Took out the 'requests' import (nothing here visits a site directly anymore)
+# Version 5: Edited 'validateIP' to go through 'RDAP.getRDAPText' so it gets the caches and shared visits too
 ###############################
 
-import requests
-import json
+import bisect
+import Parse as par
+import RDAP as rdap
+
+# IANA special-purpose IPv4 blocks (RFC 6890 and friends). Nothing in here is worth asking RDAP or GeoIP about.
+#       Must stay sorted and must not overlap
+#       (first IP, last IP, what kind of address it is)
+SPECIAL_PURPOSE = [('0.0.0.0',         '0.255.255.255',   'reserved'),        # "This network"
+                   ('10.0.0.0',        '10.255.255.255',  'private'),
+                   ('100.64.0.0',      '100.127.255.255', 'shared'),          # Carrier-grade NAT
+                   ('127.0.0.0',       '127.255.255.255', 'loopback'),
+                   ('169.254.0.0',     '169.254.255.255', 'link-local'),
+                   ('172.16.0.0',      '172.31.255.255',  'private'),
+                   ('192.0.0.0',       '192.0.0.255',     'reserved'),        # IETF protocol assignments
+                   ('192.0.2.0',       '192.0.2.255',     'documentation'),   # TEST-NET-1
+                   ('192.88.99.0',     '192.88.99.255',   'reserved'),        # Old 6to4 relay anycast
+                   ('192.168.0.0',     '192.168.255.255', 'private'),
+                   ('198.18.0.0',      '198.19.255.255',  'benchmarking'),
+                   ('198.51.100.0',    '198.51.100.255',  'documentation'),   # TEST-NET-2
+                   ('203.0.113.0',     '203.0.113.255',   'documentation'),   # TEST-NET-3
+                   ('224.0.0.0',       '239.255.255.255', 'multicast'),
+                   ('240.0.0.0',       '255.255.255.254', 'reserved'),        # Future use
+                   ('255.255.255.255', '255.255.255.255', 'broadcast')
+                   ]
+
+# The same table as numbers, split up so 'classifyIP' can binary search it
+_SPECIAL_STARTS = [par.ipToInt(start) for start, end, kind in SPECIAL_PURPOSE]
+_SPECIAL_ENDS = [par.ipToInt(end) for start, end, kind in SPECIAL_PURPOSE]
+_SPECIAL_KINDS = [kind for start, end, kind in SPECIAL_PURPOSE]
 
 
 
@@ -26,6 +59,31 @@ def getBoolList(string):
     
     return string.split()
 
+# Figures out if an IP is one of the special-purpose ones (private, loopback, multicast, etc) without visiting any site
+# Returns: String saying what kind of address it is (e.g. 'private'), or None if it's a normal public IP
+# External Modifications: None
+def classifyIP(IP):
+    '''Figures out if an IP is one of the special-purpose ones (private, loopback, multicast, etc) without
+            visiting any site. See 'SPECIAL_PURPOSE' for the full list.
+
+        Arguments:
+            IP: String IP address
+        Returns: String saying what kind of address it is (e.g. 'private'), or None if it's a normal public IP
+                 (or not an IPv4 address at all)
+        External Modifications: None
+    '''
+
+    number = par.ipToInt(IP)
+    if number is None:
+        return None
+
+    # The last block starting at or before the IP is the only one that could hold it
+    i = bisect.bisect_right(_SPECIAL_STARTS, number) - 1
+    if i >= 0 and number <= _SPECIAL_ENDS[i]:
+        return _SPECIAL_KINDS[i]
+
+    return None
+
 # Validates provided IP address
 # Returns: Boolean
 # External Modifications: None
@@ -33,31 +91,22 @@ def validateIP(IP):
     '''Validates provided IP address
 
         Arguments:
-            IP: String IP address
+            IP: String IP address (or a 'Session.IPLookup' holding it)
         Returns: Boolean
-        External Modifications: None
+        Raises: Transport.UpstreamError if the RDAP site won't answer, ValueError if it answers with garbage
+        External Modifications: Visits the RDAP site (unless the answer is already known)
     '''
 
-    # Free site to lookup RDAP 
-    RDAP_addr = 'https://rdap.apnic.net/ip/{}'
+    # Lookups have already grabbed (or will grab just once) the RDAP text. None means not valid/reserved
+    if hasattr(IP, 'getRDAPText'):
+        return IP.getRDAPText() is not None
 
-    # Jam out IP into the curly braces of 'RDAP_addr'
-    RDAP_URL = RDAP_addr.format(IP)
+    # Private, loopback, etc. RDAP would just tell us it's reserved
+    if classifyIP(IP) is not None:
+        return False
 
-    # Go to RDAP URL and bring up specific IP info
-    response = requests.get(RDAP_URL)
-    
-    # Grab the text and load it here in JSON format
-    rdap_text = json.loads(response.text)
-
-    # Validate by checking if there is an 'errorCode' section with '404' in it
-    try:
-        if rdap_text['errorCode'] == '404':
-            return False
-    except:
-        return True
-    
-    return
+    # Same lookup as everything else (caches, known network blocks, one visit per IP). None means not valid/reserved
+    return rdap.getRDAPText(IP) is not None
 
 
 
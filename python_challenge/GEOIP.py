@@ -6,14 +6,44 @@
 # Version 1: Added 'getIPData' to find relevant GEOIP data about provided IP
 #            Added 'printGEO' to print found data about IP
 # Version 2: Edited 'printGEO' to print only desired info. If all are false, it will print everything
-#            
+# Version 3: Edited 'getIPData' to save responses to (and serve them from) the on-disk cache (see 'Cache.py')
+#            Edited 'getIPData' to skip the GeoIP site for private/loopback/multicast/etc IPs (see 'Filter.classifyIP')
+#            Added 'setLocalDatabase' function so 'getIPData' can answer from a local range table (see 'GeoDB.py')
+#            Edited 'setLocalDatabase' to take compiled range tables too
+#            Edited 'getIPData' to reuse open connections (see 'Transport.py')
+#            Edited 'getIPData' to stay under the GeoIP site's rate limit and retry when it throttles us
+#            Added 'lookupGeoLocally' and 'saveGeoResponse' functions (split out of 'getIPData' for 'AsyncLookup.py')
+#            Added 'getGEOFields' function to pull the menu fields out of a response (for 'Stream_Driver.py')
+#            Edited 'printGEO' to build the whole result and write it in one go (see 'Output.py')
+#            Added 'parseGEO' function to pull every field out of a response in one scan, with lat/long as floats
+#                   (replaces the 8 'findall's in 'printGEO' and the 'getGEOFields' function)
+#            Edited 'lookupGeoLocally' to report cache hits (see 'Stats.py')
+#            Edited 'lookupGeoLocally' and 'saveGeoResponse' to leave the on-disk cache alone while recording or
+#                   playing back an archive (see 'Archive.py')
+#            Edited 'getIPData' so lookups of the same IP at the same time share one visit to the GeoIP site
+#                   (see 'SingleFlight.py')
+#            Added 'fetchGeoResponse' function (split out of 'getIPData')
+#            Edited 'getIPData' to raise 'Transport.UpstreamError' when the site won't answer, instead of calling the
+#                   IP invalid (and 'printGEO' to say so when there's no data at all)
+#            Added 'lookupGeoInMemory' and 'lookupGeoOnDisk' functions (split out of 'lookupGeoLocally' so
+#                   'AsyncLookup.py' only hands the disk part to a worker thread)
+#            Took out the 'urllib', 'pprint', and 'json' imports (nothing uses them since 'Transport.py' does the visiting)
 ###############################
 
-import urllib.request
-import urllib.parse
-import pprint
-import json
 import re
+import Cache
+import Filter as filt
+import GeoDB as geodb
+import os
+import threading
+import Transport as transport
+import Output as output
+import Stats as stats
+import Archive as archive
+import SingleFlight
+import sys
+import collections
+from xml.sax.saxutils import unescape
 
 # Free from: https://rdap.apnic.net    
 RDAP_addr = 'https://rdap.apnic.net/ip/{}'
@@ -24,35 +54,276 @@ GEOIP_addr = 'http://api.geoiplookup.net/?query={}'
 # Free with API Key from:     https://ipstack.com/quickstart
 GEOIP_more = 'http://api.ipstack.com/{0}?access_key=d81366ea95d6cef38e7bc524c8a88a09'#&output={1}'
 
+# Names of everything in the GeoIP menu, in the order they get printed, and the XML tag each one comes from
+GEO_FIELDS = ['ip', 'host', 'isp', 'city', 'c_code', 'c_name', 'lat', 'long']
+GEO_TAGS = {'ip': 'ip',
+            'host': 'host',
+            'isp': 'isp',
+            'city': 'city',
+            'c_code': 'countrycode',
+            'c_name': 'countryname',
+            'lat': 'latitude',
+            'long': 'longitude'
+            }
 
+# What 'parseGEO' hands back. Same names (and order) as 'GEO_FIELDS'
+#       lat and long are floats (or None if the site didn't give one), everything else is a string ('' if missing)
+GeoRecord = collections.namedtuple('GeoRecord', GEO_FIELDS)
 
+# Matches any <tag>value</tag> with nothing nested inside, so the outer <ip> that wraps the whole answer never matches
+GEO_TAG_REGEX = re.compile(r'<([a-z]+)>([^<]*)</\1>')
+_FIELD_FOR_TAG = {tag: field for field, tag in GEO_TAGS.items()}
+
+# Visits to the GeoIP site that are underway, by IP
+_flights = SingleFlight.SingleFlight('geoip')
+
+# Local range table checked before the GeoIP site (see 'setLocalDatabase').
+#       Can also be set with the GRIP_GEOIP_DB environment variable
+_local_db = None
+_local_db_loaded = False
+_local_db_lock = threading.Lock()
+
+
+
+
+# Points 'getIPData' at a local GeoIP range table so it only visits the GeoIP site for IPs the table doesn't have
+# Returns: Nothing
+# External Modifications: Loads the whole range table into memory
+def setLocalDatabase(db):
+    '''Points 'getIPData' at a local GeoIP range table so it only visits the GeoIP site for IPs the table doesn't have
+
+        Arguments:
+            db: Path to a range table CSV (see 'GeoDB.CSV_COLUMNS') or a compiled one (see 'GeoDB.buildBinary'),
+                an already loaded table, or None to stop using one
+        Returns: Nothing
+        External Modifications: Loads the whole range table into memory
+    '''
+
+    global _local_db, _local_db_loaded
+
+    if isinstance(db, str):
+        db = geodb.openDatabase(db)
+
+    with _local_db_lock:
+        _local_db = db
+        _local_db_loaded = True
+
+    return
+
+# Hands back the local range table, loading the one from GRIP_GEOIP_DB the first time
+# Returns: The range table, or None if there isn't one
+def getLocalDatabase():
+    global _local_db, _local_db_loaded
+
+    with _local_db_lock:
+        if not _local_db_loaded:
+            path = os.environ.get('GRIP_GEOIP_DB')
+            if path:
+                try:
+                    _local_db = geodb.openDatabase(path)
+                except (OSError, ValueError):
+                    print("Couldn't load the GeoIP table in GRIP_GEOIP_DB. Using the GeoIP site instead", file=sys.stderr)
+            _local_db_loaded = True
+
+    return _local_db
+
+# Tries to answer a GeoIP lookup out of memory (special-purpose IPs, local range table)
+# Returns: Tuple of (found, respData). If found is False, try 'lookupGeoOnDisk' next
+# External Modifications: None
+def lookupGeoInMemory(ip):
+    '''Tries to answer a GeoIP lookup out of memory (special-purpose IPs, local range table). Quick enough to
+            call straight from an event loop.
+
+        Arguments:
+            ip: String version of the IP address
+        Returns: Tuple of (found, respData). If found is False, try 'lookupGeoOnDisk' next
+        External Modifications: None
+    '''
+
+    # Private, loopback, etc. There's nothing to find out about these
+    kind = filt.classifyIP(ip)
+    if kind is not None:
+        stats.count('geoip special-purpose')
+        return (True, str(ip) + " was not a valid IP (" + kind + " address) (Error 404)")
+
+    # Local range table first, it's way faster than the site
+    local_db = getLocalDatabase()
+    if local_db is not None:
+        record = local_db.lookup(ip)
+        if record is not None:
+            stats.count('geoip local table hit')
+            return (True, geodb.toXML(record))
+
+    return (False, None)
+
+# Tries to answer a GeoIP lookup out of the on-disk cache
+# Returns: Tuple of (found, respData). If found is False, the site has to be visited
+# External Modifications: Reads the on-disk cache
+def lookupGeoOnDisk(ip):
+    '''Tries to answer a GeoIP lookup out of the on-disk cache
+
+        Arguments:
+            ip: String version of the IP address
+        Returns: Tuple of (found, respData). If found is False, the site has to be visited
+        External Modifications: Reads the on-disk cache
+    '''
+
+    # See if we've already asked about this IP recently. Not while recording or playing back an archive though,
+    #       the archive has to hold (and hand back) exactly what the site said
+    cache = Cache.getDefaultCache() if archive.getArchive() is None else None
+    if cache is not None:
+        with stats.timer('disk cache'):
+            found, respData = cache.get('geoip', ip)
+        if found:
+            stats.count('geoip disk cache hit')
+            # Saved as invalid
+            if respData is None:
+                respData = (str(ip) + " was not a valid IP (Error 404)")
+            return (True, respData)
+
+    stats.count('geoip cache miss')
+
+    return (False, None)
+
+# Tries to answer a GeoIP lookup without visiting the site (special-purpose IPs, local range table, on-disk cache)
+# Returns: Tuple of (found, respData). If found is False, the site has to be visited
+# External Modifications: Reads the on-disk cache
+def lookupGeoLocally(ip):
+    '''Tries to answer a GeoIP lookup without visiting the site (special-purpose IPs, local range table, on-disk cache)
+
+        Arguments:
+            ip: String version of the IP address
+        Returns: Tuple of (found, respData). If found is False, the site has to be visited
+        External Modifications: Reads the on-disk cache
+    '''
+
+    found, respData = lookupGeoInMemory(ip)
+    if found:
+        return (found, respData)
+
+    return lookupGeoOnDisk(ip)
+
+# Turns what the GeoIP site answered into respData, saving it to the on-disk cache
+# Returns: respData for parsing
+# External Modifications: Writes the on-disk cache
+def saveGeoResponse(ip, status, content):
+    '''Turns what the GeoIP site answered into respData, saving it to the on-disk cache
+
+        Arguments:
+            ip: String version of the IP address
+            status: HTTP status the site answered with
+            content: Body of the answer (bytes)
+        Returns: respData for parsing
+        External Modifications: Writes the on-disk cache (unless an archive is being played back)
+    '''
+
+    # Old answers played back from an archive shouldn't end up in the cache looking brand new
+    recorder = archive.getArchive()
+    cache = Cache.getDefaultCache() if recorder is None or not recorder.replaying else None
+
+    # The site answered, but didn't like the IP. Remember that so we don't ask again
+    if status >= 400:
+        if cache is not None:
+            cache.put('geoip', ip, None)
+        return (str(ip) + " was not a valid IP (Error 404)")
+
+    if cache is not None:
+        cache.put('geoip', ip, content)
+
+    return content
+
+# Visits the GEOIP site for an IP (no caches) and saves the answer
+# Returns: respData for parsing
+# External Modifications: Visits the GeoIP site. Writes the on-disk cache
+def fetchGeoResponse(ip):
+    '''Visits the GEOIP site for an IP (no caches) and saves the answer
+
+        Arguments:
+            ip: String version of the IP address
+        Returns: respData for parsing
+        Raises: Transport.UpstreamError if the site still won't answer after retrying (nothing gets remembered,
+                it might work next time)
+        External Modifications: Visits the GeoIP site. Writes the on-disk cache
+    '''
+
+    GEO_URL = GEOIP_addr.format(ip)
+    resp = transport.get(GEO_URL)
+
+    return saveGeoResponse(ip, resp.status_code, resp.content)
 
 # Visits the GEOIP site to grab the GEOIP data
 # Returns: respData for parsing
 # External Modifications: None
 def getIPData(ip):
-    '''Visits the GEOIP site to grab the GEOIP data
+    '''Visits the GEOIP site to grab the GEOIP data. Lookups of the same IP at the same time share one visit
 
         Arguments:
             ip: String version of the IP address
         Returns: respData for parsing
-        External Modifications: None
+        Raises: Transport.UpstreamError if the site still won't answer after retrying
+        External Modifications: Reads and writes the on-disk cache. Uses the local range table if there is one
     '''
 
-    # Will fail if IP is not valid
+    # Special-purpose IP, local range table, or on-disk cache
+    found, respData = lookupGeoLocally(ip)
+    if found:
+        return respData
+
+    return _flights.do(str(ip), fetchGeoResponse, ip)
+
+# Turns a latitude/longitude into a float
+# Returns: Float, or None if it's blank or garbage
+def _toFloat(value):
     try:
-        GEO_URL = GEOIP_addr.format(ip)
-        resp = urllib.request.urlopen(GEO_URL)
-        respData = resp.read()
-    except:
-        respData = (str(ip) + " was not a valid IP (Error 404)")
-        
-    return respData
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+# Pulls every field out of the GeoIP site's answer in one scan
+# Returns: GeoRecord, or None if the IP was not valid
+# External Modifications: None
+def parseGEO(respData):
+    '''Pulls every field out of the GeoIP site's answer in one scan (decodes it once, then walks the
+            tags front to back instead of searching the whole thing once per field)
+
+        Arguments:
+            respData: Response data from GEOIP request (from 'getIPData')
+        Returns: GeoRecord (see 'GEO_FIELDS' for the names) with lat and long as floats, or None if the IP was not valid
+        External Modifications: None
+    '''
+
+    # Not valid IPs come back as an error string instead of bytes
+    if respData is None:
+        return None
+    if isinstance(respData, (bytes, bytearray)):
+        text = respData.decode('utf-8', errors='replace')
+    else:
+        text = str(respData)
+        if '(Error 404)' in text:
+            return None
+
+    found = {}
+    for match in GEO_TAG_REGEX.finditer(text):
+        field = _FIELD_FOR_TAG.get(match.group(1))
+
+        # First one wins, same as the old findall()[0]
+        if field is not None and field not in found:
+            found[field] = unescape(match.group(2))
+
+    return GeoRecord(ip=found.get('ip', ''),
+                     host=found.get('host', ''),
+                     isp=found.get('isp', ''),
+                     city=found.get('city', ''),
+                     c_code=found.get('c_code', ''),
+                     c_name=found.get('c_name', ''),
+                     lat=_toFloat(found.get('lat')),
+                     long=_toFloat(found.get('long'))
+                     )
 
 # Prints all of the GEOIP data for a given IP with filter parameters
 # Returns: Nothing
 # External Modifications: None
-def printGEO(respData, ip=False, host=False, isp=False, city=False, c_code=False, c_name=False, lat=False, long=False):
+def printGEO(respData, ip=False, host=False, isp=False, city=False, c_code=False, c_name=False, lat=False, long=False, writer=None):
     '''Prints all of the GEOIP data for a given IP with filter parameters
 
         Arguments:
@@ -65,10 +336,16 @@ def printGEO(respData, ip=False, host=False, isp=False, city=False, c_code=False
             c_name: Displays the country name (e.g. United States)
             lat: Displays the latitude for the given IP address
             long: Displays the longitude for the given IP address
+            writer: 'Output' writer to add the results to (e.g. one shared by a whole batch). If not
+                    given, they're printed right away
         Returns: Nothing
         External Modifications: None
     '''
 
+    # Nobody gave us somewhere to put it, so it goes straight to the screen
+    own_writer = writer is None
+    if own_writer:
+        writer = output.PrettyWriter()
     
     # Used for validating IP address
     valid_ip = True
@@ -86,6 +363,11 @@ def printGEO(respData, ip=False, host=False, isp=False, city=False, c_code=False
     except:
         not_valid_ip = respData
 
+    # Nothing came back at all (the site wouldn't answer)
+    if respData is None:
+        valid_ip = False
+        not_valid_ip = "No GeoIP data (the site wouldn't answer)"
+
 
     # If the IP has been proven valid, continue
     if valid_ip:
@@ -107,57 +389,43 @@ def printGEO(respData, ip=False, host=False, isp=False, city=False, c_code=False
             for item in range(count):
                 bool_list[item] = True
 
-        #IP
-        ip_tag = re.findall(r'<ip>(\d.*?)</ip>', str(respData))
-        
-        #HOST
-        host_tag = re.findall(r'<host>(.*?)</host>', str(respData))
-        
-        #ISP
-        isp_tag = re.findall(r'<isp>(.*?)</isp>', str(respData))
-        
-        #CITY
-        city_tag = re.findall(r'<city>(.*?)</city>', str(respData))
-        
-        #COUNTRYCODE
-        c_code_tag = re.findall(r'<countrycode>(.*?)</countrycode>', str(respData))
-        
-        #COUNTRYNAME
-        c_name_tag = re.findall(r'<countryname>(.*?)</countryname>', str(respData))
-        
-        #LATITUDE
-        lat_tag = re.findall(r'<latitude>(.*?)</latitude>', str(respData))
-        
-        #LONGITUDE
-        long_tag = re.findall(r'<longitude>(.*?)</longitude>', str(respData))
+        # Pull everything out in one go
+        record = parseGEO(respData)
 
         # Store everything in a dictionary for "Pretty Printing" later
-        GEO_Data = {'IP': ip_tag,
-                    'HOST': host_tag,
-                    'ISP': isp_tag,
-                    'CITY': city_tag,
-                    'COUNTRY CODE': c_code_tag,
-                    'COUNTRY NAME': c_name_tag,
-                    'LATITUDE': lat_tag,
-                    'LONGITUDE': long_tag
+        GEO_Data = {'IP': record.ip,
+                    'HOST': record.host,
+                    'ISP': record.isp,
+                    'CITY': record.city,
+                    'COUNTRY CODE': record.c_code,
+                    'COUNTRY NAME': record.c_name,
+                    'LATITUDE': record.lat if record.lat is not None else '',
+                    'LONGITUDE': record.long if record.long is not None else ''
                     }
 
-        print('\n\n')
+        writer.writeText('\n\n\n')
         
         # bool_list index from above
         list_count = 0
 
-        # Print only those the user asked for.
-        # If none were specified, print everything
+        # Keep only those the user asked for.
+        # If none were specified, keep everything
+        wanted = {}
         for key, val in GEO_Data.items():
             if bool_list[list_count]:
-                pprint.pprint(key.ljust(20, '.') + str(val).rjust(30, ' '))
+                wanted[key] = val
             list_count += 1
-        print('\n\n')
+
+        # Whole thing goes out in one go
+        writer.write(wanted)
+        writer.writeText('\n\n\n')
 
     # IP was not valid, print so to the screen
     else:
-        print(not_valid_ip)
+        writer.writeText(str(not_valid_ip) + '\n')
+
+    if own_writer:
+        writer.close()
 
     return
     
@@ -0,0 +1,379 @@
+#! python3
+
+# GeoDB.py - A script that handles looking up GeoIP data from a local range table instead of the GeoIP site
+
+####### VERSION HISTORY #######
+# Version 1: Added 'GeoRangeDB' class to load a CSV range table and look IPs up in it by binary search
+#            Added 'toXML' function to dress a found record up like a response from the GeoIP site
+# Version 2: Added 'GeoRangeDB.save' and 'buildBinary' to compile a range table into a compact binary file
+#            Added 'MappedGeoDB' class to look IPs up straight out of a memory-mapped binary file
+#            Added 'openDatabase' function to open either kind of file
+# Version 3: Added '_flattenRanges' so overlapping ranges in the CSV get split up (the narrowest one wins)
+#               before lookups and compiled files ever see them
+#            Edited 'GeoRangeDB.save' to cut strings that are too long on a character boundary (so 'MappedGeoDB'
+#               can still read them)
+###############################
+
+import Parse as par
+import array
+import bisect
+import csv
+import heapq
+import mmap
+import struct
+import sys
+from xml.sax.saxutils import escape
+
+# Columns the CSV needs, in order. A header row is fine (it gets skipped)
+#       start_ip and end_ip can be dotted (1.0.0.0) or plain numbers (16777216)
+CSV_COLUMNS = ['start_ip', 'end_ip', 'country_code', 'country_name', 'city', 'isp', 'latitude', 'longitude']
+
+# Binary range table layout (everything little-endian):
+#       Header:   magic (8 bytes), number of ranges, number of records, size of string pool, unused (4 bytes each)
+#       Ranges:   first IPs (4 bytes each, sorted), then last IPs, then record numbers
+#       Records:  6 string pool offsets each (country code, country name, city, isp, latitude, longitude)
+#       Pool:     every different string once, as a 2 byte length followed by UTF-8
+BINARY_MAGIC = b'GRIPGEO1'
+BINARY_HEADER = struct.Struct('<8sIIII')
+RECORD_FIELDS = 6
+
+# What the GeoIP site sends back, so 'GEOIP.printGEO' can't tell the difference
+XML_TEMPLATE = ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<ip><results><result>'
+                '<ip>{ip}</ip>'
+                '<host>{host}</host>'
+                '<isp>{isp}</isp>'
+                '<city>{city}</city>'
+                '<countrycode>{countrycode}</countrycode>'
+                '<countryname>{countryname}</countryname>'
+                '<latitude>{latitude}</latitude>'
+                '<longitude>{longitude}</longitude>'
+                '</result></results></ip>')
+
+
+
+# Turns a start_ip/end_ip column into a number
+# Returns: Integer version of the IP, or None if it's garbage
+def _columnToInt(value):
+    value = value.strip()
+
+    if value.isdigit():
+        number = int(value)
+        return number if number <= 0xFFFFFFFF else None
+
+    return par.ipToInt(value)
+
+
+# Splits overlapping ranges up so every IP lands in exactly one of them. Where ranges overlap (e.g. a city
+#       inside a country-wide range), the narrowest one wins, and whatever's left of the wider one stays
+# Returns: Sorted list of (start, end, record number) with no overlaps
+def _flattenRanges(rows):
+    rows = sorted(rows)
+    flat = []
+
+    # Ranges holding the current IP, narrowest on top: (size, row number, end, record number)
+    holding = []
+
+    i = 0
+    point = 0
+    while i < len(rows) or holding:
+        # Gap in the table, skip ahead to the next range
+        if not holding:
+            point = rows[i][0]
+
+        while i < len(rows) and rows[i][0] == point:
+            start, end, record_id = rows[i]
+            heapq.heappush(holding, (end - start, i, end, record_id))
+            i += 1
+
+        # Throw out anything that's already ended
+        while holding and holding[0][2] < point:
+            heapq.heappop(holding)
+        if not holding:
+            continue
+
+        # The narrowest range wins until it ends or another range starts
+        end, record_id = holding[0][2], holding[0][3]
+        if i < len(rows) and rows[i][0] <= end:
+            end = rows[i][0] - 1
+
+        # Stick it onto the last piece if it's the same record carrying on
+        if flat and flat[-1][1] == point - 1 and flat[-1][2] == record_id:
+            flat[-1] = (flat[-1][0], end, record_id)
+        else:
+            flat.append((point, end, record_id))
+
+        point = end + 1
+
+    return flat
+
+
+# A GeoIP range table loaded into memory, sorted by the first IP of each range
+class GeoRangeDB():
+    '''A GeoIP range table loaded into memory, sorted by the first IP of each range. Lookups
+            are a binary search, so they stay fast no matter how big the table gets.
+
+            Overlapping ranges in the CSV are split up when it's loaded (see '_flattenRanges'), so
+            a narrower range inside a wider one wins for the IPs it holds.
+
+        Arguments:
+            csv_path: Path to a CSV with the columns in 'CSV_COLUMNS'
+    '''
+
+    def __init__(self, csv_path):
+        rows = []
+
+        # Lots of ranges share the same country/city/ISP, so each different one is only kept once
+        records = []
+        record_ids = {}
+
+        with open(csv_path, 'r', newline='', encoding='utf-8', errors='replace') as myfile:
+            for row in csv.reader(myfile):
+                if len(row) < len(CSV_COLUMNS):
+                    continue
+
+                start = _columnToInt(row[0])
+                end = _columnToInt(row[1])
+
+                # Header row or a broken line
+                if start is None or end is None or end < start:
+                    continue
+
+                record = tuple(field.strip() for field in row[2:len(CSV_COLUMNS)])
+                if record not in record_ids:
+                    record_ids[record] = len(records)
+                    records.append(record)
+
+                rows.append((start, end, record_ids[record]))
+
+        rows = _flattenRanges(rows)
+
+        self._starts = array.array(par.IP_TYPECODE, [row[0] for row in rows])
+        self._ends = array.array(par.IP_TYPECODE, [row[1] for row in rows])
+        self._record_ids = array.array('L', [row[2] for row in rows])
+        self._records = records
+
+    def __len__(self):
+        return len(self._starts)
+
+    # Compiles the range table into a compact binary file for 'MappedGeoDB'
+    # Returns: Nothing
+    # External Modifications: Writes 'out_path'
+    def save(self, out_path):
+        '''Compiles the range table into a compact binary file for 'MappedGeoDB' (see 'BINARY_MAGIC' for the layout)
+
+            Arguments:
+                out_path: Where to write the binary file
+            Returns: Nothing
+            External Modifications: Writes 'out_path'
+        '''
+
+        # Every different string only goes in the pool once
+        pool = bytearray()
+        pool_offsets = {}
+
+        record_table = array.array('I')
+        for record in self._records:
+            for field in record:
+                if field not in pool_offsets:
+                    # Anything too long for the 2 byte length gets cut, but never in the middle of a character
+                    data = field.encode('utf-8')[:0xFFFF].decode('utf-8', 'ignore').encode('utf-8')
+                    pool_offsets[field] = len(pool)
+                    pool += struct.pack('<H', len(data)) + data
+                record_table.append(pool_offsets[field])
+
+        with open(out_path, 'wb') as myfile:
+            myfile.write(BINARY_HEADER.pack(BINARY_MAGIC, len(self._starts), len(self._records), len(pool), 0))
+
+            for numbers in (self._starts, self._ends, self._record_ids, record_table):
+                myfile.write(struct.pack('<{}I'.format(len(numbers)), *numbers))
+
+            myfile.write(pool)
+
+        return
+
+    # Finds the range an IP falls in
+    # Returns: Dictionary of the same fields the GeoIP site gives, or None if no range holds the IP
+    # External Modifications: None
+    def lookup(self, ip):
+        '''Finds the range an IP falls in
+
+            Arguments:
+                ip: String version of IP address
+            Returns: Dictionary with 'ip', 'host', 'isp', 'city', 'countrycode', 'countryname', 'latitude',
+                     and 'longitude' (the same fields the GeoIP site gives), or None if no range holds the IP
+            External Modifications: None
+        '''
+
+        number = par.ipToInt(ip)
+        if number is None:
+            return None
+
+        # Ranges never overlap (see '_flattenRanges'), so the last one starting at or before the IP is the only one that could hold it
+        i = bisect.bisect_right(self._starts, number) - 1
+        if i < 0 or number > self._ends[i]:
+            return None
+
+        c_code, c_name, city, isp, lat, long = self._records[self._record_ids[i]]
+
+        return {'ip': str(ip),
+                'host': str(ip),
+                'isp': isp,
+                'city': city,
+                'countrycode': c_code,
+                'countryname': c_name,
+                'latitude': lat,
+                'longitude': long
+                }
+
+
+# A compiled range table (see 'GeoRangeDB.save') looked up straight out of a memory-mapped file
+class MappedGeoDB():
+    '''A compiled range table (see 'GeoRangeDB.save') looked up straight out of a memory-mapped file.
+            Opening it is instant no matter how big it is, nothing gets copied into Python objects
+            until a lookup actually hits, and every process with the file open shares the same pages.
+
+        Arguments:
+            path: Path to a binary file made by 'buildBinary'
+    '''
+
+    def __init__(self, path):
+        with open(path, 'rb') as myfile:
+            self._map = mmap.mmap(myfile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count, num_records, pool_size, unused = BINARY_HEADER.unpack_from(self._map, 0)
+        if magic != BINARY_MAGIC:
+            raise ValueError(str(path) + " is not a compiled GeoIP table")
+
+        self._count = count
+
+        offset = BINARY_HEADER.size
+        self._starts = self._numbers(offset, count)
+        self._ends = self._numbers(offset + 4 * count, count)
+        self._record_ids = self._numbers(offset + 8 * count, count)
+        self._record_table = self._numbers(offset + 12 * count, num_records * RECORD_FIELDS)
+        self._pool_offset = offset + 4 * (3 * count + num_records * RECORD_FIELDS)
+
+    # Hands back a run of 4 byte numbers from the file
+    def _numbers(self, offset, length):
+        # Little-endian machines (pretty much all of them) can read the mapped bytes directly
+        if sys.byteorder == 'little' and array.array('I').itemsize == 4:
+            return memoryview(self._map)[offset:offset + 4 * length].cast('I')
+
+        # Otherwise it has to be copied out and flipped around
+        numbers = array.array(par.IP_TYPECODE, struct.unpack_from('<{}I'.format(length), self._map, offset))
+        return numbers
+
+    # Reads a string out of the pool
+    def _string(self, offset):
+        start = self._pool_offset + offset
+        length = struct.unpack_from('<H', self._map, start)[0]
+        return self._map[start + 2:start + 2 + length].decode('utf-8')
+
+    def __len__(self):
+        return self._count
+
+    # Finds the range an IP falls in
+    # Returns: Dictionary of the same fields the GeoIP site gives, or None if no range holds the IP
+    # External Modifications: None
+    def lookup(self, ip):
+        '''Finds the range an IP falls in
+
+            Arguments:
+                ip: String version of IP address
+            Returns: Dictionary with 'ip', 'host', 'isp', 'city', 'countrycode', 'countryname', 'latitude',
+                     and 'longitude' (the same fields the GeoIP site gives), or None if no range holds the IP
+            External Modifications: None
+        '''
+
+        number = par.ipToInt(ip)
+        if number is None:
+            return None
+
+        # Ranges never overlap (see '_flattenRanges'), so the last one starting at or before the IP is the only one that could hold it
+        i = bisect.bisect_right(self._starts, number) - 1
+        if i < 0 or number > self._ends[i]:
+            return None
+
+        first = self._record_ids[i] * RECORD_FIELDS
+        c_code, c_name, city, isp, lat, long = [self._string(self._record_table[first + field]) for field in range(RECORD_FIELDS)]
+
+        return {'ip': str(ip),
+                'host': str(ip),
+                'isp': isp,
+                'city': city,
+                'countrycode': c_code,
+                'countryname': c_name,
+                'latitude': lat,
+                'longitude': long
+                }
+
+
+# Compiles a range table CSV into a compact binary file for 'MappedGeoDB'
+# Returns: Number of ranges written
+# External Modifications: Writes 'out_path'
+def buildBinary(csv_path, out_path):
+    '''Compiles a range table CSV into a compact binary file for 'MappedGeoDB'
+
+        Arguments:
+            csv_path: Path to a CSV with the columns in 'CSV_COLUMNS'
+            out_path: Where to write the binary file
+        Returns: Number of ranges written
+        External Modifications: Writes 'out_path'
+    '''
+
+    db = GeoRangeDB(csv_path)
+    db.save(out_path)
+
+    return len(db)
+
+# Opens a range table, whichever kind it is
+# Returns: MappedGeoDB for compiled files, GeoRangeDB for CSVs
+# External Modifications: None
+def openDatabase(path):
+    '''Opens a range table, whichever kind it is
+
+        Arguments:
+            path: Path to a compiled binary file (see 'buildBinary') or a CSV (see 'CSV_COLUMNS')
+        Returns: MappedGeoDB for compiled files, GeoRangeDB for CSVs
+        External Modifications: None
+    '''
+
+    with open(path, 'rb') as myfile:
+        magic = myfile.read(len(BINARY_MAGIC))
+
+    if magic == BINARY_MAGIC:
+        return MappedGeoDB(path)
+
+    return GeoRangeDB(path)
+
+
+# Dresses a found record up like a response from the GeoIP site
+# Returns: respData (bytes) for 'GEOIP.printGEO'
+# External Modifications: None
+def toXML(record):
+    '''Dresses a found record up like a response from the GeoIP site
+
+        Arguments:
+            record: Dictionary from 'GeoRangeDB.lookup'
+        Returns: respData (bytes) for 'GEOIP.printGEO'
+        External Modifications: None
+    '''
+
+    fields = {key: escape(str(val)) for key, val in record.items()}
+
+    return XML_TEMPLATE.format(**fields).encode('utf-8')
+
+
+
+
+
+##### MAIN #####
+if __name__ == '__main__':
+
+    # Compile a CSV:    python GeoDB.py table.csv table.grip
+    if len(sys.argv) == 3:
+        count = buildBinary(sys.argv[1], sys.argv[2])
+        print("Wrote " + str(count) + " ranges to " + sys.argv[2])
+    else:
+        print("Hello, World!")
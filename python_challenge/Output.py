@@ -0,0 +1,294 @@
+#! python3
+
+# Output.py - A script that handles writing results out (pretty text for people, NDJSON/CSV/JSON for other tools)
+
+####### VERSION HISTORY #######
+# Version 1: Added 'PrettyWriter', 'NDJSONWriter', 'CSVWriter', and 'JSONWriter' classes that build up whole
+#               records and write them out in big chunks instead of a little print per field
+#            Added 'openWriter' function to make a writer by format name
+# Version 2: Edited 'OutputWriter' to report how long rendering and writing take (see 'Stats.py')
+###############################
+
+import csv
+import io
+import json
+import pprint
+import sys
+import Stats as stats
+
+# Formats 'openWriter' knows about
+FORMATS = ['pretty', 'ndjson', 'csv', 'json']
+
+# How much text (in characters) a writer holds onto before actually writing it. 0 writes every record right away
+BUFFER_SIZE = 64 * 1024
+
+
+
+# Everything the writers have in common: holding onto text until there's enough of it to be worth writing
+class OutputWriter():
+    '''Everything the writers have in common: holding onto text until there's enough of it to be worth
+            writing. Don't use this one directly, use one of the writers below (or 'openWriter').
+
+        Arguments:
+            stream: Where to write (anything with 'write'). Defaults to whatever sys.stdout is when it's time to write
+            buffer_size: How many characters to hold onto before writing (0 writes every record right away)
+    '''
+
+    def __init__(self, stream=None, buffer_size=BUFFER_SIZE):
+        self.stream = stream
+        self.buffer_size = buffer_size
+
+        # Set by 'openWriter' when it opened the file itself, so 'close' knows to close it
+        self.owns_stream = False
+
+        self._pending = []
+        self._pending_size = 0
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    # Turns one record into text. Each writer has its own way of doing it
+    def render(self, record):
+        raise NotImplementedError
+
+    # Text written once after the last record (e.g. the closing ']' of a JSON document)
+    def footer(self):
+        return ''
+
+    # Holds onto some text, writing everything out once there's enough of it
+    def _add(self, text):
+        if not text:
+            return
+
+        self._pending.append(text)
+        self._pending_size += len(text)
+
+        if self._pending_size >= self.buffer_size:
+            self.flush()
+
+        return
+
+    # Adds a whole record to the output
+    # Returns: Nothing
+    # External Modifications: Writes to the stream once enough has built up
+    def write(self, record):
+        '''Adds a whole record to the output
+
+            Arguments:
+                record: Dictionary of field name -> value (printed in the order they're in)
+            Returns: Nothing
+            External Modifications: Writes to the stream once enough has built up
+        '''
+
+        with stats.timer('output render'):
+            text = self.render(record)
+
+        self._add(text)
+
+        return
+
+    # Adds some plain text (spacing, messages, etc). Only the pretty format keeps it
+    # Returns: Nothing
+    # External Modifications: None
+    def writeText(self, text):
+        '''Adds some plain text (spacing, messages, etc). Only the pretty format keeps it, the others
+                throw it out so the output stays loadable.
+
+            Arguments:
+                text: Text to add (exactly as is, so include any newlines)
+            Returns: Nothing
+            External Modifications: None
+        '''
+
+        return
+
+    # Writes out everything that's built up
+    # Returns: Nothing
+    # External Modifications: Writes to the stream
+    def flush(self):
+        '''Writes out everything that's built up
+
+            Arguments:
+                None
+            Returns: Nothing
+            External Modifications: Writes to the stream
+        '''
+
+        stream = self.stream if self.stream is not None else sys.stdout
+
+        with stats.timer('output write'):
+            if self._pending:
+                text = ''.join(self._pending)
+                self._pending = []
+                self._pending_size = 0
+                stream.write(text)
+
+            stream.flush()
+
+        return
+
+    # Finishes the output and writes out anything left
+    # Returns: Nothing
+    # External Modifications: Writes to the stream. Closes it if 'openWriter' opened it
+    def close(self):
+        '''Finishes the output (e.g. ends the JSON document) and writes out anything left. Leaves sys.stdout
+                open, but closes any file 'openWriter' opened.
+
+            Arguments:
+                None
+            Returns: Nothing
+            External Modifications: Writes to the stream. Closes it if 'openWriter' opened it
+        '''
+
+        if self._closed:
+            return
+        self._closed = True
+
+        self._add(self.footer())
+        self.flush()
+
+        if self.owns_stream:
+            self.stream.close()
+
+        return
+
+
+# The same text the menus have always printed, one padded line per field
+class PrettyWriter(OutputWriter):
+    '''The same text the menus have always printed, one padded line per field
+            (e.g. "'ISP.................                 Google LLC'")
+    '''
+
+    def render(self, record):
+        # pformat + newline is exactly what pprint.pprint would have printed
+        return ''.join(pprint.pformat(key.ljust(20, '.') + str(val).rjust(30, ' ')) + '\n' for key, val in record.items())
+
+    def writeText(self, text):
+        self._add(text)
+        return
+
+
+# One JSON object per line
+class NDJSONWriter(OutputWriter):
+    '''One JSON object per line (a.k.a. NDJSON or JSON Lines). Easy to stream, easy to load into
+            just about anything.
+    '''
+
+    def render(self, record):
+        return json.dumps(record, default=str) + '\n'
+
+
+# One row per record, with a header row first
+class CSVWriter(OutputWriter):
+    '''One row per record, with a header row first. Lists (like 'rdapConformance') go in as JSON text.
+
+        Arguments:
+            stream: Where to write (see 'OutputWriter')
+            buffer_size: How many characters to hold onto before writing (see 'OutputWriter')
+            fields: Column names, in order. Defaults to the fields of the first record
+    '''
+
+    def __init__(self, stream=None, buffer_size=BUFFER_SIZE, fields=None):
+        OutputWriter.__init__(self, stream, buffer_size)
+
+        self.fields = list(fields) if fields is not None else None
+        self._header_done = False
+
+        # The csv module does the quoting, we just grab what it wrote
+        self._row_text = io.StringIO()
+        self._rows = csv.writer(self._row_text, lineterminator='\n')
+
+    def _row(self, values):
+        self._row_text.seek(0)
+        self._row_text.truncate()
+        self._rows.writerow(values)
+        return self._row_text.getvalue()
+
+    def render(self, record):
+        text = ''
+
+        if not self._header_done:
+            if self.fields is None:
+                self.fields = list(record.keys())
+            text = self._row(self.fields)
+            self._header_done = True
+
+        values = []
+        for field in self.fields:
+            val = record.get(field)
+            if val is None:
+                val = ''
+            elif isinstance(val, (list, tuple, dict)):
+                val = json.dumps(val, default=str)
+            values.append(val)
+
+        return text + self._row(values)
+
+
+# Every record in one JSON list
+class JSONWriter(OutputWriter):
+    '''Every record in one JSON list (a single document, for tools that want the whole thing at once)
+    '''
+
+    def __init__(self, stream=None, buffer_size=BUFFER_SIZE):
+        OutputWriter.__init__(self, stream, buffer_size)
+        self._count = 0
+
+    def render(self, record):
+        text = ('[\n' if self._count == 0 else ',\n') + json.dumps(record, default=str)
+        self._count += 1
+        return text
+
+    def footer(self):
+        if self._count == 0:
+            return '[]\n'
+        return '\n]\n'
+
+
+
+# Makes a writer by format name
+# Returns: Writer (see the classes above)
+# External Modifications: Opens 'path' for writing if it's given
+def openWriter(format, path=None, buffer_size=BUFFER_SIZE, **kwargs):
+    '''Makes a writer by format name
+
+        Arguments:
+            format: One of 'FORMATS' ('pretty', 'ndjson', 'csv', or 'json')
+            path: File to write to (overwritten). Defaults to sys.stdout
+            buffer_size: How many characters to hold onto before writing (0 writes every record right away)
+            kwargs: Anything else the writer takes (e.g. 'fields' for CSV)
+        Returns: Writer (see the classes above). Call 'close' (or use 'with') when you're done
+        Raises: ValueError if the format isn't one of 'FORMATS'
+        External Modifications: Opens 'path' for writing if it's given
+    '''
+
+    writers = {'pretty': PrettyWriter,
+               'ndjson': NDJSONWriter,
+               'csv': CSVWriter,
+               'json': JSONWriter
+               }
+
+    if format not in writers:
+        raise ValueError("Unknown output format '" + str(format) + "' (pick from: " + ', '.join(FORMATS) + ")")
+
+    stream = None
+    if path:
+        stream = open(path, 'w', newline='', encoding='utf-8')
+
+    writer = writers[format](stream=stream, buffer_size=buffer_size, **kwargs)
+    writer.owns_stream = stream is not None
+
+    return writer
+
+
+
+
+
+##### MAIN #####
+if __name__ == '__main__':
+    print("Hello, World!")
@@ -2,53 +2,515 @@
 
 ####### VERSION HISTORY #######
 # Version 1: Added 'getIPs' function to allow for return of a list of valid IPs upon receiving valid text file
+# Version 2: Added 'ipToInt' and 'intToIP' functions to flip IPv4 addresses between strings and numbers
+# Version 3: Added 'iterIPs' function to read files a chunk at a time instead of all at once
+#            Edited 'getIPs' to use 'iterIPs' (lines don't get glued together anymore either)
+# Version 4: Added 'IPCounter' class and 'countIPs' function to boil a list of IPs down to unique ones (with counts)
+# Version 5: Added 'packIPs' function to squish IPs into a packed array of numbers, throwing out the fake ones in bulk
+#            Added 'unpackIPs' function to turn them back into strings
+# Version 6: Edited 'iterIPs' to report how long reading and searching takes (see 'Stats.py')
+# Version 7: Edited 'IPCounter' to find IPs with bisect in a sorted packed array instead of a dict (much smaller)
+#            Added 'IPStream' class to throw out the fake IPs a batch at a time as the file gets read, so lookups
+#               can start before the whole file has been gone through
+#            Edited 'packIPs' to check a batch one IP at a time if anything in it isn't exactly four octets
 ###############################
 
 import re
 import pprint
+import array
+import bisect
+import operator
+import time
+import Stats as stats
+
+# Regex for IPv4 address
+#valid_IPV4_regex = re.compile(r'\b(25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])\.(25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])\.(25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])\.(25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])\b')
+ALL_IPV4_FORMAT_REGEX = re.compile(r'\b\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}\b')
+
+#'valid' will only display valid IPs, where as 'all' will display any set of numbers with a dot format
+#       similar to that of IPv4. I went with 'all' because there were several 'non-valid' addresses
+#       in 'valid' and vice versa. Better to just keep them all and let the URL decide which ones
+#       are legit
+
+# How many characters 'iterIPs' reads at a time
+CHUNK_SIZE = 1024 * 1024
+
+# How many IPs 'packIPs' checks at once
+PACK_BATCH = 65536
+
+# Array type that holds an unsigned 32-bit number (4 bytes per IP instead of a ~60 byte string)
+IP_TYPECODE = 'I' if array.array('I').itemsize >= 4 else 'L'
+
+# How many dots are in a string (for checking a whole batch in one go)
+_countDots = operator.methodcaller('count', '.')
+
+
 
 # Parses through a provided file and strips all of the IPs out
 # Returns: A list of IPv4 addresses
 # External Modifications: None
 def getIPs(file_path):
     ''' Parses through file and loads them all into a list that is returned. Be sure you
-            have a list to catch them all.
+            have a list to catch them all. (For big files, use 'iterIPs' instead)
 
         Arguments:
-            file_path: This is the complete path from main drive to file (e.g. C:\...\file.txt)
+            file_path: This is the complete path from main drive to file (e.g. C:\\...\\file.txt)
         Returns: list of IP addresses
         External Modifications: None
     '''
-    
-    # Regex for IPv4 address
-    #valid_IPV4_regex = re.compile(r'\b(25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])\.(25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])\.(25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])\.(25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])\b')
-    all_IPV4_format_regex = re.compile(r'\b\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}\b')
-    
-    #'valid' will only display valid IPs, where as 'all' will display any set of numbers with a dot format
-    #       similar to that of IPv4. I went with 'all' because there were several 'non-valid' addresses
-    #       in 'valid' and vice versa. Better to just keep them all and let the URL decide which ones
-    #       are legit
 
+    # Return our list of IP addresses
+    return list(iterIPs(file_path))
+
+# Finds where it's safe to split a chunk of text without cutting an IP in half
+# Returns: Index of the last character that can't be part of an IP, or -1 if there isn't one
+# External Modifications: None
+def _findSafeCut(text):
+    i = len(text) - 1
 
-    # List to hold all of the extracted IPs for returning
-    return_list = []
+    while i >= 0 and (text[i].isdecimal() or text[i] == '.'):
+        i -= 1
+
+    return i
+
+# Parses through a provided file a chunk at a time and hands back the IPs as they're found
+# Returns: Generator of IPv4 addresses
+# External Modifications: None
+def iterIPs(file_path, chunk_size=CHUNK_SIZE):
+    ''' Parses through a provided file a chunk at a time and hands back the IPs as they're found.
+            Only about one chunk of the file is ever in memory, so this works on files of any size.
+
+        Arguments:
+            file_path: This is the complete path from main drive to file (e.g. C:\\...\\file.txt)
+            chunk_size: How many characters to read at a time
+        Returns: Generator of IP addresses (in the order they show up in the file)
+        External Modifications: None
+    '''
 
     # Essentially will only break if 'file_path' doesn't exist or code is messed with
     try:
-        with open(file_path, 'r') as myfile:
-            data = myfile.read().replace('\n', '')
-            disjoint_ip_list = all_IPV4_format_regex.findall(data)
-            
-            for ip in disjoint_ip_list:
-                #new_ip_format = ".".join(ip)
-                return_list.append(ip)#new_ip_format)
-            
-
-    except:
+        with open(file_path, 'r', errors='replace') as myfile:
+
+            # Whatever was left at the end of the last chunk (it might be the start of an IP)
+            carry = ''
+
+            while True:
+                # Time spent reading and searching (not waiting on whoever is using the IPs)
+                started = time.perf_counter()
+
+                chunk = myfile.read(chunk_size)
+
+                # End of file, everything left over is fair game
+                if not chunk:
+                    found = ALL_IPV4_FORMAT_REGEX.findall(carry)
+                    stats.addTime('parse', time.perf_counter() - started)
+                    for ip in found:
+                        yield ip
+                    break
+
+                data = carry + chunk
+
+                # Split right on the last character that can't be in an IP. That character goes to both
+                #       halves so the '\b' on either side of the split still sees what it would have seen
+                cut = _findSafeCut(data)
+
+                # A whole chunk of nothing but digits and dots. Keep reading until it ends
+                if cut < 0:
+                    carry = data
+                    stats.addTime('parse', time.perf_counter() - started)
+                    continue
+
+                found = ALL_IPV4_FORMAT_REGEX.findall(data, 0, cut + 1)
+                carry = data[cut:]
+                stats.addTime('parse', time.perf_counter() - started)
+
+                for ip in found:
+                    yield ip
+
+    except (OSError, UnicodeError):
         print("File not found or error in 'getIPs' function")
 
-    # Return our list of IP addresses
-    return return_list
+    return
+
+# Turns a dotted IPv4 address into a single number (e.g. 1.0.0.1 ---> 16777217)
+# Returns: Integer version of the IP, or None if it isn't a proper IPv4 address
+# External Modifications: None
+def ipToInt(ip):
+    '''Turns a dotted IPv4 address into a single number (e.g. 1.0.0.1 ---> 16777217)
+
+        Arguments:
+            ip: String version of IP address
+        Returns: Integer version of the IP, or None if it isn't a proper IPv4 address
+        External Modifications: None
+    '''
+
+    octets = str(ip).strip().split('.')
+
+    if len(octets) != 4:
+        return None
+
+    number = 0
+
+    for octet in octets:
+        try:
+            value = int(octet)
+        except ValueError:
+            return None
+
+        if not octet.isdigit() or value > 255:
+            return None
+
+        number = (number << 8) | value
+
+    return number
+
+# Turns a number back into a dotted IPv4 address (e.g. 16777217 ---> 1.0.0.1)
+# Returns: String version of the IP
+# External Modifications: None
+def intToIP(number):
+    '''Turns a number back into a dotted IPv4 address (e.g. 16777217 ---> 1.0.0.1)
+
+        Arguments:
+            number: Integer version of IP address
+        Returns: String version of the IP
+        External Modifications: None
+    '''
+
+    return '{}.{}.{}.{}'.format((number >> 24) & 255, (number >> 16) & 255, (number >> 8) & 255, number & 255)
+
+# Checks and packs one batch of IP strings
+# Returns: Number of IPs thrown out
+def _packBatch(batch, packed):
+    joined = '.'.join(batch)
+
+    # Usual case (straight from the regex): every item is exactly four runs of digits, so every octet of every
+    #       IP can go in one flat array and be checked all at once
+    if set(map(_countDots, batch)) == {3} and joined.replace('.', '').isdigit():
+        try:
+            octets = array.array('H', map(int, joined.split('.')))
+        except (ValueError, OverflowError):
+            octets = None
+
+        if octets is not None:
+            firsts = octets[0::4]
+            seconds = octets[1::4]
+            thirds = octets[2::4]
+            fourths = octets[3::4]
+
+            # Nothing over 255 anywhere in the batch, so everything can be packed without looking closer
+            if max(octets) <= 255:
+                packed.extend([(a << 24) | (b << 16) | (c << 8) | d for a, b, c, d in zip(firsts, seconds, thirds, fourths)])
+                return 0
+
+            before = len(packed)
+            packed.extend([(a << 24) | (b << 16) | (c << 8) | d for a, b, c, d in zip(firsts, seconds, thirds, fourths)
+                           if a <= 255 and b <= 255 and c <= 255 and d <= 255])
+
+            return len(batch) - (len(packed) - before)
+
+    # Something in here has too many or too few octets (or a blank one), which would throw every IP after it
+    #       out of line in the flat array. Check this batch one IP at a time instead
+    before = len(packed)
+    packed.extend([number for number in map(ipToInt, batch) if number is not None])
+
+    return len(batch) - (len(packed) - before)
+
+# Squishes IPs into a packed array of 32-bit numbers, throwing out anything that can't be a real IP (e.g. 999.1.1.1)
+# Returns: Tuple of (array of packed IPs in the same order, number of IPs thrown out)
+# External Modifications: None
+def packIPs(IPs, batch_size=PACK_BATCH):
+    '''Squishes IPs into a packed array of 32-bit numbers, throwing out anything that can't be a real IP
+            (e.g. 999.1.1.1) so it never costs a lookup. The octets are checked a whole batch at a time.
+
+        Arguments:
+            IPs: Any iterable of string IP addresses in dotted format (e.g. from 'iterIPs')
+            batch_size: How many IPs get checked at once
+        Returns: Tuple of (array of packed IPs in the same order, number of IPs thrown out)
+        External Modifications: None
+    '''
+
+    packed = array.array(IP_TYPECODE)
+    rejected = 0
+    batch = []
+
+    for ip in IPs:
+        batch.append(ip)
+
+        if len(batch) >= batch_size:
+            rejected += _packBatch(batch, packed)
+            batch = []
+
+    if batch:
+        rejected += _packBatch(batch, packed)
+
+    return (packed, rejected)
+
+# Checks IPs a batch at a time as they come in and hands back the real ones, without reading everything first
+class IPStream():
+    '''Checks IPs a batch at a time as they come in (e.g. straight from 'iterIPs') and hands back the real
+            ones, throwing out anything that can't be a real IP (e.g. 999.1.1.1). Only one batch is held at
+            a time, so the first IPs can be looked up before the rest of the file has even been read.
+
+        Arguments:
+            IPs: Any iterable of string IP addresses in dotted format (e.g. from 'iterIPs')
+            batch_size: How many IPs get checked at once
+    '''
+
+    def __init__(self, IPs, batch_size=PACK_BATCH):
+        self._IPs = IPs
+        self.batch_size = max(1, int(batch_size))
+
+        # How many have been thrown out so far (all of them once it's been gone through)
+        self.rejected = 0
+
+    def __iter__(self):
+        return unpackIPs(self.packed())
+
+    # Hands back the real IPs packed into numbers, a batch at a time
+    # Returns: Generator of integer IPs (in the same order)
+    # External Modifications: Reads whatever 'IPs' reads
+    def packed(self):
+        '''Hands back the real IPs packed into numbers (e.g. for 'countIPs'), checked a batch at a time
+
+            Arguments:
+                None
+            Returns: Generator of integer IPs (in the same order)
+            External Modifications: Reads whatever 'IPs' reads
+        '''
+
+        batch = []
+
+        for ip in self._IPs:
+            batch.append(ip)
+
+            if len(batch) >= self.batch_size:
+                yield from self._check(batch)
+                batch = []
+
+        if batch:
+            yield from self._check(batch)
+
+        return
+
+    # Packs one batch, counting whatever got thrown out
+    def _check(self, batch):
+        packed = array.array(IP_TYPECODE)
+        self.rejected += _packBatch(batch, packed)
+        return packed
+
+# Turns packed IPs back into strings
+# Returns: Generator of string IP addresses
+# External Modifications: None
+def unpackIPs(packed):
+    '''Turns packed IPs back into strings
+
+        Arguments:
+            packed: Array (or any iterable) of packed IPs (e.g. from 'packIPs')
+        Returns: Generator of string IP addresses
+        External Modifications: None
+    '''
+
+    for number in packed:
+        yield intToIP(number)
+
+
+# Keeps track of every unique IP (in the order they first showed up) and how many times each one was seen
+class IPCounter():
+    '''Keeps track of every unique IP (in the order they first showed up) and how many times each one was seen.
+            Nothing is kept per IP but packed numbers: the IP and its count in first-seen order, plus a
+            sorted copy of the IPs (each one with its spot tucked in the low 32 bits) that gets searched
+            with bisect. That's about 20 bytes per unique IP, where a dict would be over 100.
+
+            New IPs sit in a small dict until there are enough of them to be worth merging into the sorted
+            copy (an eighth of its size), so adding stays quick and the dict never gets big.
+
+        Arguments:
+            None
+    '''
+
+    # Fewest new IPs that get merged in at once
+    MERGE_MIN = 16384
+
+    def __init__(self):
+        # In first-seen order. Things that aren't real IPv4 addresses (e.g. 999.1.1.1) are stored as
+        #       negative numbers pointing into '_others'
+        self._order = array.array('q')
+        self._counts = array.array(IP_TYPECODE)
+        self._others = []
+        self._other_slots = {}
+
+        # (IP << 32) | spot in '_order', sorted, for every real IP except the newest ones
+        self._sorted = array.array('Q')
+
+        # Keys added since the last merge -> spot in '_order' (the '_others' always keep theirs in '_other_spots')
+        self._recent = {}
+        self._other_spots = {}
+
+    def __len__(self):
+        return len(self._order)
+
+    # Works out the key an IP is stored under
+    def _key(self, ip):
+        # Already packed (e.g. from 'packIPs')
+        if isinstance(ip, int):
+            return ip
+
+        number = ipToInt(ip)
+
+        if number is not None:
+            return number
+
+        ip = str(ip)
+        if ip not in self._other_slots:
+            self._others.append(ip)
+            self._other_slots[ip] = -len(self._others)
+
+        return self._other_slots[ip]
+
+    # Finds a key's spot in '_order'
+    # Returns: The spot, or None if it's never been seen
+    def _slot(self, key):
+        if key < 0:
+            return self._other_spots.get(key)
+
+        slot = self._recent.get(key)
+        if slot is not None:
+            return slot
+
+        i = bisect.bisect_left(self._sorted, key << 32)
+        if i < len(self._sorted) and self._sorted[i] >> 32 == key:
+            return self._sorted[i] & 0xFFFFFFFF
+
+        return None
+
+    # Folds the newest keys into the sorted copy. Only the new keys get looped over, everything in between
+    #       gets copied across in slices
+    def _merge(self):
+        merged = array.array('Q')
+        start = 0
+
+        for key, slot in sorted(self._recent.items()):
+            packed = (key << 32) | slot
+            cut = bisect.bisect_left(self._sorted, packed, start)
+            merged.extend(self._sorted[start:cut])
+            merged.append(packed)
+            start = cut
+
+        merged.extend(self._sorted[start:])
+
+        self._sorted = merged
+        self._recent = {}
+
+        return
+
+    # Counts one more sighting of an IP
+    # Returns: True if this is the first time the IP was seen, False otherwise
+    # External Modifications: None
+    def add(self, ip):
+        '''Counts one more sighting of an IP
+
+            Arguments:
+                ip: String version of IP address (or a packed one from 'packIPs')
+            Returns: True if this is the first time the IP was seen, False otherwise
+            External Modifications: None
+        '''
+
+        key = ip if isinstance(ip, int) else self._key(ip)
+        slot = self._slot(key)
+
+        if slot is not None:
+            self._counts[slot] += 1
+            return False
+
+        if key < 0:
+            self._other_spots[key] = len(self._order)
+        else:
+            self._recent[key] = len(self._order)
+
+        self._order.append(key)
+        self._counts.append(1)
+
+        if len(self._recent) >= max(self.MERGE_MIN, len(self._sorted) // 8):
+            self._merge()
+
+        return True
+
+    # How many times an IP was seen
+    # Returns: Integer count (0 if it was never seen)
+    # External Modifications: None
+    def count(self, ip):
+        '''How many times an IP was seen
+
+            Arguments:
+                ip: String version of IP address (or a packed one from 'packIPs')
+            Returns: Integer count (0 if it was never seen)
+            External Modifications: None
+        '''
+
+        number = ip if isinstance(ip, int) else ipToInt(ip)
+        key = number if number is not None else self._other_slots.get(str(ip))
+        slot = None if key is None else self._slot(key)
+
+        if slot is None:
+            return 0
+
+        return self._counts[slot]
+
+    # Turns a stored key back into the IP string
+    def _ip(self, key):
+        if key >= 0:
+            return intToIP(key)
+        return self._others[-key - 1]
+
+    # Hands back every unique IP in the order they first showed up
+    # Returns: Generator of string IP addresses
+    # External Modifications: None
+    def ips(self):
+        '''Hands back every unique IP in the order they first showed up
+
+            Arguments:
+                None
+            Returns: Generator of string IP addresses
+            External Modifications: None
+        '''
+
+        for key in self._order:
+            yield self._ip(key)
+
+    # Hands back every unique IP with how many times it was seen
+    # Returns: Generator of (IP, count) tuples in first-seen order
+    # External Modifications: None
+    def items(self):
+        '''Hands back every unique IP with how many times it was seen
+
+            Arguments:
+                None
+            Returns: Generator of (IP, count) tuples in first-seen order
+            External Modifications: None
+        '''
+
+        for key, count in zip(self._order, self._counts):
+            yield (self._ip(key), count)
+
+
+# Boils a bunch of IPs down to the unique ones, counting how many times each one showed up
+# Returns: IPCounter
+# External Modifications: None
+def countIPs(IPs):
+    '''Boils a bunch of IPs down to the unique ones, counting how many times each one showed up
+
+        Arguments:
+            IPs: Any iterable of string IP addresses (e.g. from 'iterIPs') or packed ones (e.g. from 'packIPs')
+        Returns: IPCounter
+        External Modifications: None
+    '''
+
+    counter = IPCounter()
+
+    for ip in IPs:
+        counter.add(ip)
+
+    return counter
 
 
 
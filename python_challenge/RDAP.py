@@ -14,16 +14,65 @@
 #            Added 'printRdapIPInfo' function to print the main RDAP info
 #            Added 'printEntryInfo' function to print info for a specific entry
 #            Added 'printAllUpdateEntries' function to print info for all update entries
+# Version 3: Edited 'printRdapIPInfo' to accept RDAP text that has already been grabbed
+#            Edited 'getRDAPText' to save responses to (and serve them from) the on-disk cache (see 'Cache.py')
+#            Edited 'getRDAPText' to answer any IP inside an already-seen network block without asking again
+#            Added 'fetchRDAPText' function so the functions below can be handed a 'Session.IPLookup' instead
+#                   of visiting the RDAP site every time
+#            Edited 'getRDAPText' to skip the RDAP site for private/loopback/multicast/etc IPs (see 'Filter.classifyIP')
+#            Edited 'getRDAPText' to reuse open connections (see 'Transport.py')
+#            Edited 'getRDAPText' to stay under the RDAP site's rate limit and retry when it throttles us
+#            Added 'lookupRDAPLocally' and 'saveRDAPResponse' functions (split out of 'getRDAPText' for 'AsyncLookup.py')
+#            Added 'getRdapIPFields' function (split out of 'printRdapIPInfo' for 'Stream_Driver.py')
+#            Edited 'printRdapIPInfo' and 'printEntryInfo' to build the whole result and write it in one go (see 'Output.py')
+#            Added 'parseEventDate' function, a fast (and remembered) ISO-8601 parse for RDAP event dates
+#            Added 'orderEntries' and 'pickEntry' functions to sort/pick update entries off one list of precomputed keys
+#            Edited 'returnMostRecentUpdateEntry', 'returnOldestUpdateEntry', and 'printAllUpdateEntries' to use them
+#                   (fixes entries that share a day getting printed more than once)
+#            Added 'getVcardFields' function to pull every vCard field out of an entity in one pass
+#            Edited 'printEntryInfo' to use it (email and telephone no longer get swapped when tel comes first)
+#            Added 'RDAPResult' class, a small record of the menu fields that can let go of the full RDAP text
+#            Edited 'printRdapIPInfo' to take an 'RDAPResult' in place of the RDAP text
+#            Edited 'lookupRDAPLocally', 'saveRDAPResponse', and 'convertToDatetime' to report cache hits and timings
+#                   (see 'Stats.py')
+#            Added 'getRangeCache' function so recording/playing back an archive uses its own network blocks
+#            Edited 'lookupRDAPLocally' and 'saveRDAPResponse' to leave the on-disk cache alone while recording or
+#                   playing back an archive (see 'Archive.py')
+#            Edited 'getRDAPText' so lookups of the same IP at the same time share one visit to the RDAP site
+#                   (see 'SingleFlight.py')
+#            Added 'fetchRDAPResponse' function (split out of 'getRDAPText' for 'AsyncLookup.py')
+#            Added 'RDAPResult.fromValues' to rebuild a result from its saved fields (see 'Checkpoint.py')
+#            Edited 'orderEntries', 'pickEntry', 'returnMostRecentUpdateEntry', 'returnOldestUpdateEntry',
+#                   'printEntryInfo', and 'printAllUpdateEntries' to go through the entity index (see 'RDAPIndex.py'),
+#                   so update entries nested anywhere count and events are matched by name instead of position
+#            Took out the 'requests' import (every visit goes through 'Transport.py')
+#            Added 'lookupRDAPInMemory' and 'lookupRDAPOnDisk' functions (split out of 'lookupRDAPLocally' so
+#                   'AsyncLookup.py' only hands the disk part to a worker thread)
+#            Edited 'orderEntries' and 'pickEntry' to stick to the entries right under the first entity again
+#                   (found through the entity index), so the menus don't pick up the registrant and such
+#            Added 'pickEntryAnywhere' function for the newest/oldest event anywhere in the answer
+#            Edited 'pickEntry' to find the newest/oldest entry in one pass again instead of sorting them all
+#            Took out the 'urllib' and 'pprint' imports (nothing uses them since 'Transport.py' does the visiting)
 ###############################
 
-import urllib.request
-import urllib.parse
-import pprint
 import json
 import re
-import requests
 import dateutil.parser
 import datetime
+import calendar
+import functools
+import heapq
+import sys
+import Cache
+import Filter as filt
+import Transport as transport
+import Output as output
+import Stats as stats
+import Archive as archive
+import Parse as par
+import RDAPIndex as rdapindex
+import SingleFlight
+import threading
 
 MONTHS = {'1': 'January',
           '2': 'February',
@@ -44,6 +93,19 @@ MONTHS = {'1': 'January',
 # Free from: https://rdap.apnic.net    
 RDAP_addr = 'https://rdap.apnic.net/ip/{}'
 
+# Names of everything in the "Main RDAP Info" menu, in the order they get printed
+RDAP_FIELDS = ['registration', 'handle', 'ipVersion', 'name', 'objectClassName', 'parentHandle', 'port43', 'rdapConformance', 'startAddress']
+
+# Which event the 'option' for the update entry functions means (0 for "last_changed", 1 for "registration")
+ENTRY_EVENTS = {0: 'last changed', 1: 'registration'}
+
+# Network blocks seen while recording or playing back an archive: (archive, Cache.RangeCache). See 'getRangeCache'
+_archive_ranges = (None, None)
+_archive_ranges_lock = threading.Lock()
+
+# Visits to the RDAP site that are underway, by IP
+_flights = SingleFlight.SingleFlight('rdap')
+
 # Homemade function to act as a very specialized lambda-esque try/except (See 'printRdapIPInfo')
 # Returns: String of element at arg2 position of arg1
 # External Modifications: None
@@ -63,37 +125,251 @@ def tryExcept(text, thing):
     except:
         return ''
 
+# Pulls every field out of an entity's contact card (its 'vcardArray') in one pass
+# Returns: Dictionary of vCard field name (e.g. 'fn', 'email', 'tel', 'adr') -> value
+# External Modifications: None
+def getVcardFields(entity):
+    '''Pulls every field out of an entity's contact card (its 'vcardArray') in one pass
 
-# Visits RDAP site to grab RDAP info about provided IP
-# Returns: Text of RDAP info in JSON layout OR error message
-# External Modifications: Visits website utilizing 'requests' module
-def getRDAPText(IP):
-    '''Visits RDAP site to grab RDAP info about provided IP
+        Arguments:
+            entity: JSON for one entity (e.g. from 'returnMostRecentUpdateEntry')
+        Returns: Dictionary of vCard field name (e.g. 'fn', 'email', 'tel', 'adr') -> value. If a field shows up
+                 more than once (e.g. two emails), the first one wins. Empty if the entity doesn't have a card
+        External Modifications: None
+    '''
+
+    fields = {}
+
+    try:
+        properties = entity['vcardArray'][1]
+    except (KeyError, IndexError, TypeError):
+        return fields
+
+    # Each one looks like ["email", {params}, "text", "someone@example.com"]
+    for item in properties:
+        if isinstance(item, list) and len(item) >= 4 and item[0] not in fields:
+            fields[item[0]] = item[3]
+
+    return fields
+
+
+# Hands back the known network blocks to answer lookups from
+# Returns: Cache.RangeCache
+# External Modifications: Reads every RDAP answer in the archive the first time it's called while playing one back
+def getRangeCache():
+    '''Hands back the known network blocks to answer lookups from. Normally that's the shared one (saved
+            between runs), but while an archive is being recorded or played back it's one of its own that
+            only knows the blocks in the archive. When playing back, it starts out with every block in the
+            archive, so IPs that got answered by a known block while recording get the same answer no matter
+            what order the lookups finish in.
+
+        Arguments:
+            None
+        Returns: Cache.RangeCache
+        External Modifications: Reads every RDAP answer in the archive the first time it's called while playing one back
+    '''
+
+    global _archive_ranges
+
+    recorder = archive.getArchive()
+    if recorder is None:
+        return Cache.getDefaultRangeCache()
+
+    with _archive_ranges_lock:
+        if _archive_ranges[0] is not recorder:
+            ranges = Cache.RangeCache(None)
+
+            if recorder.replaying:
+                prefix = RDAP_addr.format('')
+                for url, status, body in recorder.answers(prefix):
+                    if status >= 400:
+                        continue
+                    try:
+                        ranges.add(url[len(prefix):], json.loads(body.decode('utf-8', errors='replace')))
+                    except ValueError:
+                        pass
+
+            _archive_ranges = (recorder, ranges)
+
+        return _archive_ranges[1]
+
+# Tries to answer an RDAP lookup out of memory (special-purpose IPs, known network blocks)
+# Returns: Tuple of (found, RDAP text). If found is False, try 'lookupRDAPOnDisk' next
+# External Modifications: None
+def lookupRDAPInMemory(IP):
+    '''Tries to answer an RDAP lookup out of memory (special-purpose IPs, known network blocks). Quick enough to
+            call straight from an event loop (a known network block only reads the disk the first time it's used).
 
         Arguments:
             IP: String version of IP address
-        Returns: Text of RDAP info in JSON layout
-        External Modifications: Visits webstie utilizing 'requests' module
+        Returns: Tuple of (found, RDAP text). If found is False, try 'lookupRDAPOnDisk' next. RDAP text is
+                 None for invalid/reserved IPs
+        External Modifications: None
     '''
 
-    # Concatenate URL with specified IP address
-    RDAP_URL = RDAP_addr.format(IP)
+    # Private, loopback, etc. Don't even bother asking, the answer is always 'reserved'
+    if filt.classifyIP(IP) is not None:
+        stats.count('rdap special-purpose')
+        return (True, None)
+
+    # See if the IP is inside a network block we already know about
+    rdap_text = getRangeCache().lookup(IP)
+    if rdap_text is not None:
+        stats.count('rdap range cache hit')
+        return (True, rdap_text)
+
+    return (False, None)
+
+# Tries to answer an RDAP lookup out of the on-disk cache
+# Returns: Tuple of (found, RDAP text). If found is False, the site has to be visited
+# External Modifications: Reads the on-disk cache
+def lookupRDAPOnDisk(IP):
+    '''Tries to answer an RDAP lookup out of the on-disk cache
+
+        Arguments:
+            IP: String version of IP address
+        Returns: Tuple of (found, RDAP text). If found is False, the site has to be visited. RDAP text is
+                 None for invalid/reserved IPs
+        External Modifications: Reads the on-disk cache
+    '''
+
+    # See if we've already asked about this IP recently. Not while recording or playing back an archive though,
+    #       the archive has to hold (and hand back) exactly what the site said
+    cache = Cache.getDefaultCache() if archive.getArchive() is None else None
+    if cache is not None:
+        with stats.timer('disk cache'):
+            found, payload = cache.get('rdap', IP)
+        if found:
+            stats.count('rdap disk cache hit')
+            # Saved as invalid/reserved
+            if payload is None:
+                return (True, None)
+            with stats.timer('rdap json'):
+                return (True, json.loads(payload))
+
+    stats.count('rdap cache miss')
+
+    return (False, None)
+
+# Tries to answer an RDAP lookup without visiting the site (special-purpose IPs, known network blocks, on-disk cache)
+# Returns: Tuple of (found, RDAP text). If found is False, the site has to be visited
+# External Modifications: Reads the on-disk cache
+def lookupRDAPLocally(IP):
+    '''Tries to answer an RDAP lookup without visiting the site (special-purpose IPs, known network blocks, on-disk cache)
+
+        Arguments:
+            IP: String version of IP address
+        Returns: Tuple of (found, RDAP text). If found is False, the site has to be visited. RDAP text is
+                 None for invalid/reserved IPs
+        External Modifications: Reads the on-disk cache
+    '''
+
+    found, rdap_text = lookupRDAPInMemory(IP)
+    if found:
+        return (found, rdap_text)
+
+    return lookupRDAPOnDisk(IP)
+
+# Turns what the RDAP site answered into RDAP text, saving it to the on-disk cache and the known network blocks
+# Returns: Text of RDAP info in JSON layout OR None if not valid
+# External Modifications: Writes the on-disk cache
+def saveRDAPResponse(IP, response_text):
+    '''Turns what the RDAP site answered into RDAP text, saving it to the on-disk cache and the known network blocks
+
+        Arguments:
+            IP: String version of IP address
+            response_text: Body of the answer (JSON string)
+        Returns: Text of RDAP info in JSON layout OR None if not valid
+        External Modifications: Writes the on-disk cache (unless an archive is being played back)
+    '''
+
+    # Old answers played back from an archive shouldn't end up in the cache looking brand new
+    recorder = archive.getArchive()
+    cache = Cache.getDefaultCache() if recorder is None or not recorder.replaying else None
 
-    # Go to RDAP URL and bring up specific IP info
-    response = requests.get(RDAP_URL)
-    
     # Grab the text and load it here in JSON format
-    rdap_text = json.loads(response.text)
+    with stats.timer('rdap json'):
+        rdap_text = json.loads(response_text)
 
     # If the rdap_text contains a 404 error code, return error string
     try:
         if rdap_text['errorCode'] == '404':
             rdap_text = (str(IP) + " was not a valid IP or is reserved by the IANA")
+
+            # Remember that this one is a dud
+            if cache is not None:
+                cache.put('rdap', IP, None)
     except:
+        if cache is not None:
+            cache.put('rdap', IP, response_text)
+
+        # Every other IP in this network block gets the same answer (unless the block can still be carved up)
+        getRangeCache().add(IP, rdap_text)
         return rdap_text
     
     return
 
+# Visits the RDAP site for an IP (no caches) and saves the answer
+# Returns: Text of RDAP info in JSON layout OR None if not valid
+# External Modifications: Visits the RDAP site. Writes the on-disk cache
+def fetchRDAPResponse(IP):
+    '''Visits the RDAP site for an IP (no caches) and saves the answer
+
+        Arguments:
+            IP: String version of IP address
+        Returns: Text of RDAP info in JSON layout OR None if not valid
+        Raises: Transport.UpstreamError if the site still won't answer after retrying
+        External Modifications: Visits the RDAP site. Writes the on-disk cache
+    '''
+
+    # Concatenate URL with specified IP address
+    RDAP_URL = RDAP_addr.format(IP)
+
+    # Go to RDAP URL and bring up specific IP info
+    response = transport.get(RDAP_URL)
+
+    return saveRDAPResponse(IP, response.text)
+
+# Visits RDAP site to grab RDAP info about provided IP
+# Returns: Text of RDAP info in JSON layout OR error message
+# External Modifications: Visits website utilizing 'requests' module
+def getRDAPText(IP):
+    '''Visits RDAP site to grab RDAP info about provided IP. Lookups of the same IP at the same time share
+            one visit, so a log full of the same scanner only asks once. Other IPs in the same network
+            get answered by the known network blocks once that visit is done.
+
+        Arguments:
+            IP: String version of IP address
+        Returns: Text of RDAP info in JSON layout
+        Raises: Transport.UpstreamError if the site still won't answer after retrying
+        External Modifications: Visits webstie utilizing 'requests' module (see 'Transport.py'). Reads and writes the on-disk cache
+    '''
+
+    # Special-purpose IP, known network block, or on-disk cache
+    found, rdap_text = lookupRDAPLocally(IP)
+    if found:
+        return rdap_text
+
+    return _flights.do(str(IP), fetchRDAPResponse, IP)
+
+# Grabs the RDAP text for an IP, or from the lookup holding it if we were handed one (see 'Session.py')
+# Returns: Text of RDAP info in JSON layout OR None if not valid
+# External Modifications: Visits RDAP site if the text hasn't been grabbed yet
+def fetchRDAPText(IP):
+    '''Grabs the RDAP text for an IP, or from the lookup holding it if we were handed one (see 'Session.py')
+
+        Arguments:
+            IP: String version of IP address, or a 'Session.IPLookup'
+        Returns: Text of RDAP info in JSON layout OR None if not valid
+        External Modifications: Visits RDAP site if the text hasn't been grabbed yet
+    '''
+
+    # Lookups only visit the site the first time
+    if hasattr(IP, 'getRDAPText'):
+        return IP.getRDAPText()
+
+    return getRDAPText(IP)
+
 # Converts provided date into something more readable (e.g. 2018-07-05   --->   July 5, 2018)
 # Returns: list of MONTH, DAY, and YEAR for manipulation by later print function
 # External Modifications: None
@@ -126,10 +402,183 @@ def convertToDatetime(date):
         External Modifications: None
     '''
     
-    new_date = dateutil.parser.parse(date)
+    with stats.timer('dateutil'):
+        new_date = dateutil.parser.parse(date)
 
     return new_date
 
+# Pieces of an ISO-8601 date like the ones RDAP uses (e.g. 2018-07-05T14:03:22Z or 2018-07-05T14:03:22.5+10:00)
+ISO_8601_REGEX = re.compile(r'^(\d{4})-(\d{2})-(\d{2})'
+                            r'(?:[T ](\d{2}):(\d{2})(?::(\d{2})(\.\d+)?)?)?'
+                            r'\s*(Z|[+-]\d{2}(?::?\d{2})?)?$', re.IGNORECASE)
+
+# Turns an RDAP event date into seconds since 1970 (UTC)
+# Returns: Float timestamp, or None if it can't be read
+# External Modifications: None
+@functools.lru_cache(maxsize=4096)
+def parseEventDate(date):
+    '''Turns an RDAP event date into seconds since 1970 (UTC). Plain ISO-8601 dates (pretty much all of them)
+            are picked apart directly, which is a lot faster than dateutil. Anything else falls back to dateutil.
+            Answers are remembered, since the same dates show up over and over.
+
+        Arguments:
+            date: String version of a date
+        Returns: Float timestamp, or None if it can't be read. Dates without a time zone are taken as UTC
+        External Modifications: None
+    '''
+
+    match = ISO_8601_REGEX.match(str(date).strip())
+
+    # Something unusual, let dateutil have a go at it
+    if match is None:
+        try:
+            new_date = convertToDatetime(str(date))
+        except (ValueError, OverflowError):
+            return None
+        if new_date.tzinfo is None:
+            new_date = new_date.replace(tzinfo=datetime.timezone.utc)
+        return new_date.timestamp()
+
+    year, month, day, hour, minute, second, fraction, zone = match.groups()
+
+    try:
+        stamp = calendar.timegm((int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0)))
+    except ValueError:
+        return None
+
+    if fraction:
+        stamp += float(fraction)
+
+    # Move it back to UTC
+    if zone and zone.upper() != 'Z':
+        digits = zone[1:].replace(':', '')
+        offset = int(digits[:2]) * 3600 + int(digits[2:4] or 0) * 60
+        stamp += -offset if zone[0] == '+' else offset
+
+    return float(stamp)
+
+# Hands back an entity index for some RDAP text (building one if that's not what it already is)
+def _asIndex(rdap_text):
+    if isinstance(rdap_text, rdapindex.EntityIndex):
+        return rdap_text
+    return rdapindex.EntityIndex(rdap_text)
+
+# Grabs the entity index for an IP, reusing the one a 'Session.IPLookup' already built
+# Returns: RDAPIndex.EntityIndex
+def _entityIndex(IP, rdap_text):
+    if hasattr(IP, 'getEntityIndex'):
+        index = IP.getEntityIndex()
+        if index is not None:
+            return index
+
+    return _asIndex(rdap_text)
+
+# The update entries the menus go by: the entities right under the first entity, found through the index
+def _updateEntries(index):
+    top = index.childrenOf(None)
+    if not top:
+        return []
+
+    return index.childrenOf(top[0])
+
+# Precomputed sort keys for the update entries: (no date?, timestamp (flipped for newest first), position)
+def _entryKeys(index, option, newest_first):
+    action = ENTRY_EVENTS[option]
+    keys = []
+
+    for position, entry in enumerate(_updateEntries(index)):
+        stamp = index.eventTime(entry, action)
+
+        # Entries without a readable date always end up last. Ties go to whichever came first
+        if stamp is None:
+            keys.append((1, 0.0, position))
+        else:
+            keys.append((0, -stamp if newest_first else stamp, position))
+
+    return keys
+
+# Puts the update entries in order by date
+# Returns: List of the entries' JSON, in order
+# External Modifications: None
+def orderEntries(rdap_text, option, newest_first=True, limit=None):
+    '''Puts the update entries (the entities right under the first entity) in order by date. The dates all
+            come pre-read out of the entity index (see 'RDAPIndex.py'), so everything sorts off a list of
+            precomputed keys.
+
+        Arguments:
+            rdap_text: Full RDAP text in JSON layout (from 'getRDAPText'), or an 'RDAPIndex.EntityIndex' of it
+            option: 0 for "last_changed"
+                    1 for "registration"
+            newest_first: True for newest to oldest, False for oldest to newest
+            limit: Only hand back this many (e.g. the 5 newest). Defaults to all of them
+        Returns: List of the entries' JSON, in order. Each entry shows up exactly once. Entries without a readable
+                 date always come last (ties go to whichever came first)
+        External Modifications: None
+    '''
+
+    index = _asIndex(rdap_text)
+    entries = _updateEntries(index)
+    keys = _entryKeys(index, option, newest_first)
+
+    # Only need the first few, so don't bother sorting the whole thing
+    if limit is not None and limit < len(keys):
+        keys = heapq.nsmallest(max(0, int(limit)), keys)
+    else:
+        keys.sort()
+
+    return [entries[key[2]] for key in keys]
+
+# Picks the newest (or oldest) update entry in one pass
+# Returns: The entry's JSON, or None if there aren't any
+# External Modifications: None
+def pickEntry(rdap_text, option, newest=True):
+    '''Picks the newest (or oldest) update entry in one pass over the precomputed keys (no sorting)
+
+        Arguments:
+            rdap_text: Full RDAP text in JSON layout (from 'getRDAPText'), or an 'RDAPIndex.EntityIndex' of it
+            option: 0 for "last_changed"
+                    1 for "registration"
+            newest: True for the newest entry, False for the oldest
+        Returns: The entry's JSON, or None if there aren't any. Ties go to whichever came first
+        External Modifications: None
+    '''
+
+    index = _asIndex(rdap_text)
+    keys = _entryKeys(index, option, newest)
+    if not keys:
+        return None
+
+    return _updateEntries(index)[min(keys)[2]]
+
+# Picks the newest (or oldest) event of one type anywhere in the answer (any entity at any depth, or the network)
+# Returns: The JSON of whatever the event is on, or None if there aren't any
+# External Modifications: None
+def pickEntryAnywhere(rdap_text, option, newest=True):
+    '''Picks the newest (or oldest) event of one type anywhere in the answer: the network itself, or any
+            entity no matter how deep it's nested. Unlike 'pickEntry', this isn't limited to the update entries
+
+        Arguments:
+            rdap_text: Full RDAP text in JSON layout (from 'getRDAPText'), or an 'RDAPIndex.EntityIndex' of it
+            option: 0 for "last_changed"
+                    1 for "registration"
+            newest: True for the newest event, False for the oldest
+        Returns: The JSON of the entity the event is on (the full RDAP text if it's on the network itself),
+                 or None if there aren't any
+        External Modifications: None
+    '''
+
+    index = _asIndex(rdap_text)
+
+    if newest:
+        found = index.latestEvent(ENTRY_EVENTS[option])
+    else:
+        found = index.oldestEvent(ENTRY_EVENTS[option])
+
+    if found is None or found[0] is None:
+        return None
+
+    return index.rdap_text if found[1] is None else found[1]
+
 # Calculates the most recent entry from the RDAP response based on its datetime
 # Returns: String version of the JSON entry from RDAP response OR error message
 # External Modifications: None
@@ -137,7 +586,7 @@ def returnMostRecentUpdateEntry(IP, option):
     '''Calculates the most recent entry from the RDAP response based on its datetime
 
         Arguments:
-            IP: String version of IP address
+            IP: String version of IP address (or a 'Session.IPLookup' holding it)
             option: 0 for "last_changed"
                     1 for "registration"
         Returns: String version of the JSON entry from RDAP response OR error message
@@ -145,7 +594,7 @@ def returnMostRecentUpdateEntry(IP, option):
     '''
 
     # Grab all of the RDAP text from the site in JSON layout
-    full_RDAP_text = getRDAPText(IP)
+    full_RDAP_text = fetchRDAPText(IP)
 
     # Used for validating IP address
     valid_ip = True
@@ -168,25 +617,8 @@ def returnMostRecentUpdateEntry(IP, option):
     # If the IP has been proven valid, continue
     if valid_ip:
 
-        # Number of update event registries
-        num_entries = len(full_RDAP_text["entities"][0]["entities"])
-
-        count = 0
-        times = []
-        
-        # Create a list of all the times in relation to today for each entry
-        for time in range(num_entries):
-            date = convertToDatetime(str(full_RDAP_text["entities"][0]["entities"][count]["events"][option]["eventDate"]))
-            times.append((NOW - date).days)
-            count += 1
-
-        # This is the index of the most recent entry from the RDAP stuff
-        most_recent = times.index(min(times))
-
-        # Delete the list. If this scales to be super huge, we don't need this potentially massive list sitting around
-        times = []
-
-        result = full_RDAP_text["entities"][0]["entities"][most_recent]
+        # The most recent entry from the RDAP stuff
+        result = pickEntry(_entityIndex(IP, full_RDAP_text), option, newest=True)
 
         return result
 
@@ -202,7 +634,7 @@ def returnOldestUpdateEntry(IP, option):
     '''Calculates the oldest entry from the RDAP response based on its datetime
 
         Arguments:
-            IP: String version of IP address
+            IP: String version of IP address (or a 'Session.IPLookup' holding it)
             option: 0 for "last_changed"
                     1 for "registration"
         Returns: String version of the JSON entry from RDAP response
@@ -210,7 +642,7 @@ def returnOldestUpdateEntry(IP, option):
     '''
 
     # Grab full RDAP text from the site in JSON layout
-    full_RDAP_text = getRDAPText(IP)
+    full_RDAP_text = fetchRDAPText(IP)
 
     # Used for validating IP address
     valid_ip = True
@@ -234,47 +666,218 @@ def returnOldestUpdateEntry(IP, option):
     # If the IP has been proven valid, continue
     if valid_ip:
 
-        # Number of update event registries
-        num_entries = len(full_RDAP_text["entities"][0]["entities"])
+        # The oldest entry from the RDAP stuff
+        result = pickEntry(_entityIndex(IP, full_RDAP_text), option, newest=False)
 
-        count = 0
-        times = []
-        
-        # Create a list of all the times in relation to today for each entry
-        for time in range(num_entries):
-            date = convertToDatetime(str(full_RDAP_text["entities"][0]["entities"][count]["events"][option]["eventDate"]))
-            times.append((NOW - date).days)
-            count += 1
+        return result
+
+    else:
+        print(result)
+
+    return 
+
+# Pulls the main RDAP info (the stuff in the "Main RDAP Info" menu) out of the RDAP text
+# Returns: Dictionary of menu field name -> value
+# External Modifications: None
+def getRdapIPFields(rdap_text):
+    '''Pulls the main RDAP info (the stuff in the "Main RDAP Info" menu) out of the RDAP text
+
+        Arguments:
+            rdap_text: Text of RDAP info in JSON layout (from 'getRDAPText')
+        Returns: Dictionary of menu field name (see 'RDAP_FIELDS') -> value
+        External Modifications: None
+    '''
+
+    # Get the date it was created and make it more readable
+    date_list = convertToHumanDatetime(rdap_text["events"][0]["eventDate"])
+    RDAPCreated = MONTHS[str(date_list[0])] + " " + str(date_list[1]) + ", " + str(date_list[2])
+
+    # Archived (Old way I did it)
+    '''
+    handle = rdap_text['handle']
+    ipVersion = rdap_text['ipVersion']
+    name = rdap_text['name']
+    objectClassName = rdap_text['objectClassName']
+    parentHandle = rdap_text['parentHandle']
+    port43 = rdap_text['port43']
+    rdapConformance = rdap_text['rdapConformance']
+    startAddress = rdap_text['startAddress']
+    '''
+
+    # Grabs all the stuff we want via a homemade try/except function
+    handle = tryExcept(rdap_text, 'handle')
+    ipVersion = tryExcept(rdap_text, 'ipVersion')
+    name = tryExcept(rdap_text, 'name')
+    objectClassName = tryExcept(rdap_text, 'objectClassName')
+    parentHandle = tryExcept(rdap_text, 'parentHandle')
+    port43 = tryExcept(rdap_text, 'port43')
+    rdapConformance = tryExcept(rdap_text, 'rdapConformance')
+    startAddress = tryExcept(rdap_text, 'startAddress')
+    
+    # Store everything in a dictionary to "Pretty Print" later
+    RDAP_INFO = {'registration': RDAPCreated,
+                 'handle': handle,
+                 'ipVersion': ipVersion,
+                 'name': name,
+                 'objectClassName': objectClassName,
+                 'parentHandle': parentHandle,
+                 'port43': port43,
+                 'rdapConformance': rdapConformance,
+                 'startAddress': startAddress
+                 }
 
-        # This is the index of the most recent entry from the RDAP stuff
-        oldest = times.index(max(times))
+    return RDAP_INFO
 
-        # Delete the list. If this scales to be super huge, we don't need this potentially massive list sitting around
-        times = []
+# The main RDAP info for one IP, in as little memory as possible
+class RDAPResult():
+    '''The main RDAP info (the "Main RDAP Info" menu fields) for one IP, in as little memory as possible.
+            The fields are only pulled out of the RDAP text the first time one is asked for. After that
+            (or right away with 'compact') the full RDAP text can be let go, which is most of the memory.
 
-        result = full_RDAP_text["entities"][0]["entities"][oldest]
+        Arguments:
+            IP: String version of IP address
+            rdap_text: Full RDAP text in JSON layout (from 'getRDAPText')
+            keep_raw: True to hang onto the full RDAP text after the fields are pulled out
+    '''
+
+    # No __dict__ per result, just these
+    __slots__ = ('ip', '_raw', '_values', '_keep_raw')
+
+    def __init__(self, IP, rdap_text, keep_raw=False):
+        self.ip = str(IP)
+        self._raw = rdap_text
+        self._values = None
+        self._keep_raw = keep_raw
+
+    # Pulls the fields out the first time, then hands back the same ones every time after that
+    def _extract(self):
+        if self._values is None:
+            try:
+                fields = getRdapIPFields(self._raw)
+            except (KeyError, IndexError, TypeError, ValueError):
+                fields = {}
+
+            # Lots of results share the same values (e.g. 'ip network', 'v4'), so only keep one copy of each
+            self._values = tuple(sys.intern(str(fields.get(field, ''))) for field in RDAP_FIELDS)
+
+            if not self._keep_raw:
+                self._raw = None
+
+        return self._values
+
+    # Rebuilds a result from its fields (e.g. ones saved with 'asDict')
+    # Returns: RDAPResult
+    # External Modifications: None
+    @classmethod
+    def fromValues(cls, IP, values):
+        '''Rebuilds a result from its fields (e.g. ones saved with 'asDict')
+
+            Arguments:
+                IP: String version of IP address
+                values: The fields' values, in 'RDAP_FIELDS' order
+            Returns: RDAPResult (with no RDAP text behind it)
+            External Modifications: None
+        '''
+
+        result = cls(IP, None)
+        result._values = tuple(sys.intern(str(value)) for value in values)
 
         return result
 
-    else:
-        print(result)
+    # Pulls the fields out now and lets go of the full RDAP text
+    # Returns: Itself (so it can be chained)
+    # External Modifications: None
+    def compact(self):
+        '''Pulls the fields out now and lets go of the full RDAP text (even if 'keep_raw' was True)
+
+            Arguments:
+                None
+            Returns: Itself (so it can be chained)
+            External Modifications: None
+        '''
+
+        self._extract()
+        self._raw = None
+
+        return self
+
+    # The full RDAP text, if it's still around
+    @property
+    def raw(self):
+        return self._raw
+
+    # Grabs one field by its menu name
+    # Returns: The field's value ('' if the RDAP text didn't have it)
+    # External Modifications: None
+    def get(self, field, default=None):
+        '''Grabs one field by its menu name
+
+            Arguments:
+                field: Menu field name (see 'RDAP_FIELDS')
+                default: What to hand back if there's no field by that name
+            Returns: The field's value ('' if the RDAP text didn't have it)
+            External Modifications: None
+        '''
+
+        if field not in RDAP_FIELDS:
+            return default
+
+        return self._extract()[RDAP_FIELDS.index(field)]
+
+    # Hands back every field
+    # Returns: Dictionary of menu field name -> value, in menu order (same as 'getRdapIPFields')
+    # External Modifications: None
+    def asDict(self):
+        '''Hands back every field
+
+            Arguments:
+                None
+            Returns: Dictionary of menu field name -> value, in menu order (same as 'getRdapIPFields')
+            External Modifications: None
+        '''
+
+        return dict(zip(RDAP_FIELDS, self._extract()))
+
+    # Acts like the RDAP text for the "is it valid" check in 'printRdapIPInfo' (field names, not values)
+    def __contains__(self, field):
+        return field in RDAP_FIELDS
+
+    def __repr__(self):
+        return 'RDAPResult(' + repr(self.ip) + ')'
+
+
+# Every menu field gets a read-only attribute (e.g. result.handle)
+def _resultField(position):
+    return property(lambda self: self._extract()[position])
+
+for _position, _field in enumerate(RDAP_FIELDS):
+    setattr(RDAPResult, _field, _resultField(_position))
 
-    return 
 
 # Prints all of the relevant information regarding the initial RDAP entry (doesnt include subsequent update entry log)
 # Returns: Nothing
 # External Modifications: None
-def printRdapIPInfo(IP, registration=False, handle=False, ipVersion=False, name=False, objectClassName=False, parentHandle=False, port43=False, rdapConformance=False, startAddress=False):
+def printRdapIPInfo(IP, registration=False, handle=False, ipVersion=False, name=False, objectClassName=False, parentHandle=False, port43=False, rdapConformance=False, startAddress=False, rdap_text=None, writer=None):
     '''Prints all of the relevant information regarding the initial RDAP entry (doesn't include subsequent update entry log)
 
         Arguments:
-            IP: String version of IP address
+            IP: String version of IP address (or a 'Session.IPLookup' holding it)
+            rdap_text: RDAP text (or an 'RDAPResult') that has already been grabbed (e.g. by 'Batch.enrichIPs').
+                       If not given, it will be grabbed from the site
+            writer: 'Output' writer to add the results to (e.g. one shared by a whole batch). If not
+                    given, they're printed right away
         Returns: Nothing
         External Modifications: None
     '''
 
-    # Get full RDAP text from site in JSON layout
-    rdap_text = getRDAPText(IP)
+    # Nobody gave us somewhere to put it, so it goes straight to the screen
+    own_writer = writer is None
+    if own_writer:
+        writer = output.PrettyWriter()
+
+    # Get full RDAP text from site in JSON layout (unless somebody already did it for us)
+    if rdap_text is None:
+        rdap_text = fetchRDAPText(IP)
 
     # Used for validating IP address
     valid_ip = True
@@ -313,84 +916,69 @@ def printRdapIPInfo(IP, registration=False, handle=False, ipVersion=False, name=
             for item in range(count):
                 bool_list[item] = True
 
-        # Get the date it was created and make it more readable
-        date_list = convertToHumanDatetime(rdap_text["events"][0]["eventDate"])
-        RDAPCreated = MONTHS[str(date_list[0])] + " " + str(date_list[1]) + ", " + str(date_list[2])
-
-        # Archived (Old way I did it)
-        '''
-        handle = rdap_text['handle']
-        ipVersion = rdap_text['ipVersion']
-        name = rdap_text['name']
-        objectClassName = rdap_text['objectClassName']
-        parentHandle = rdap_text['parentHandle']
-        port43 = rdap_text['port43']
-        rdapConformance = rdap_text['rdapConformance']
-        startAddress = rdap_text['startAddress']
-        '''
-
-        # Grabs all the stuff we want via a homemade try/except function
-        handle = tryExcept(rdap_text, 'handle')
-        ipVersion = tryExcept(rdap_text, 'ipVersion')
-        name = tryExcept(rdap_text, 'name')
-        objectClassName = tryExcept(rdap_text, 'objectClassName')
-        parentHandle = tryExcept(rdap_text, 'parentHandle')
-        port43 = tryExcept(rdap_text, 'port43')
-        rdapConformance = tryExcept(rdap_text, 'rdapConformance')
-        startAddress = tryExcept(rdap_text, 'startAddress')
-        
-        # Store everything in a dictionary to "Pretty Print" later
-        RDAP_INFO = {'registration': RDAPCreated,
-                     'handle': handle,
-                     'ipVersion': ipVersion,
-                     'name': name,
-                     'objectClassName': objectClassName,
-                     'parentHandle': parentHandle,
-                     'port43': port43,
-                     'rdapConformance': rdapConformance,
-                     'startAddress': startAddress
-                     }
+        # Grab everything the menu knows about
+        if isinstance(rdap_text, RDAPResult):
+            RDAP_INFO = rdap_text.asDict()
+        else:
+            RDAP_INFO = getRdapIPFields(rdap_text)
         
-        print('\n\n')
+        writer.writeText('\n\n\n')
 
         list_count = 0
 
-        # Print only those the user asked for
-        # If none were specified, print everything
+        # Keep only those the user asked for
+        # If none were specified, keep everything
+        wanted = {}
         for key, val in RDAP_INFO.items():
             if bool_list[list_count]:
-                pprint.pprint(key.ljust(20, '.') + str(val).rjust(30, ' '))
+                wanted[key] = val
             list_count += 1
 
+        # Whole thing goes out in one go
+        writer.write(wanted)
+
     else:
-        print(result)
+        writer.writeText(str(result) + '\n')
+
+    if own_writer:
+        writer.close()
         
     return
 
+# Finds when something happened to an entry and makes it readable (e.g. July 5, 2018)
+# Returns: String date, or '' if the entry doesn't say
+def _entryDate(entry, action):
+    for event in entry.get('events', []):
+        if isinstance(event, dict) and str(event.get('eventAction', '')).lower() == action and isinstance(event.get('eventDate'), str):
+            date_list = convertToHumanDatetime(event['eventDate'])
+            return MONTHS[str(date_list[0])] + " " + str(date_list[1]) + ", " + str(date_list[2])
+
+    return ''
+
 # Prints relevant data for a specified entry
 # Returns: Nothing
 # External Modifications: None
-def printEntryInfo(rdap_text):
+def printEntryInfo(rdap_text, writer=None, index=None):
     '''Prints relevant data for a specified entry
 
         Arguments:
             rdap_text: This is the text for only one entry (e.g. if you ran printMostRecentUpdateEntry and piped that here)
+            writer: 'Output' writer to add the results to. If not given, they're printed right away
+            index: 'RDAPIndex.EntityIndex' the entry came from, so its contact card doesn't get pulled out again
         Returns: Nothing
         External Modifications: None
     '''
 
     # Get dates and make them more readable
-    date_list = convertToHumanDatetime(rdap_text["events"][1]["eventDate"])
-    RDAPCreated = MONTHS[str(date_list[0])] + " " + str(date_list[1]) + ", " + str(date_list[2])
-    date_list = convertToHumanDatetime(rdap_text["events"][0]["eventDate"])
-    RDAPUpdated = MONTHS[str(date_list[0])] + " " + str(date_list[1]) + ", " + str(date_list[2])
+    RDAPCreated = _entryDate(rdap_text, ENTRY_EVENTS[1])
+    RDAPUpdated = _entryDate(rdap_text, ENTRY_EVENTS[0])
 
-    # Grab relevant data from RDAP text
-    handle = rdap_text['handle']
-    objectClassName = rdap_text['objectClassName']
-    port43 = rdap_text['port43']
-    roles = rdap_text['roles']
-    status = rdap_text['status']
+    # Grab relevant data from RDAP text (entities nested anywhere can leave some of these out)
+    handle = rdap_text.get('handle', '')
+    objectClassName = rdap_text.get('objectClassName', '')
+    port43 = rdap_text.get('port43', '')
+    roles = rdap_text.get('roles', [])
+    status = rdap_text.get('status', [])
 
     # Store in a dictionary for "Pretty Printing" later
     RDAP_INFO = {'registration': RDAPCreated,
@@ -402,27 +990,12 @@ def printEntryInfo(rdap_text):
                  'status': status
                  }
 
-    # How many items are in the 'vcardArray' entry block
-    new_range = len(rdap_text['vcardArray'][1])
-
-    # List of indices of desired data
-    list_of_indices = []
+    # Everything in the contact card, grabbed in one pass (or already grabbed by the index)
+    vcard = index.vcard(rdap_text) if index is not None else getVcardFields(rdap_text)
 
-    # Deleted in the process
     # We really only care about the helpful email, and helpful tel number
-    want_list = ['email', 'tel']
-
-    # Find the indices in 'vcardArray' of everything in our want_list
-    for i in range(new_range):
-        want_item = rdap_text['vcardArray'][1][i][0]
-        
-        if want_item in want_list:
-            list_of_indices.append(i)
-            want_list.remove(want_item)
-
-    
-    email = rdap_text['vcardArray'][1][int(list_of_indices[0])][3]
-    tel = rdap_text['vcardArray'][1][int(list_of_indices[1])][3]
+    email = vcard.get('email', '')
+    tel = vcard.get('tel', '')
         
 
     VCARD_INFO = {
@@ -431,60 +1004,47 @@ def printEntryInfo(rdap_text):
                   }
     
 
-    # Print it all!
-    for key, val in RDAP_INFO.items():
-        pprint.pprint(key.ljust(20, '.') + str(val).rjust(30, ' '))
+    # Print it all! (in one go)
+    RDAP_INFO.update(VCARD_INFO)
 
-    for key, val in VCARD_INFO.items():
-        pprint.pprint(key.ljust(20, '.') + str(val).rjust(30, ' '))
+    if writer is None:
+        with output.PrettyWriter() as writer:
+            writer.write(RDAP_INFO)
+    else:
+        writer.write(RDAP_INFO)
         
     return 
 
 # Prints some info about all of the update entries for a given IP
 # Returns: Nothing
 # External Modifications: None
-def printAllUpdateEntries(IP, option, reverse=False):
+def printAllUpdateEntries(IP, option, reverse=False, limit=None):
     '''Prints some info about all of the update entries for a given IP
 
         Arguments:
-            IP: String version of an IP address
+            IP: String version of an IP address (or a 'Session.IPLookup' holding it)
             option: 0 for "last_changed"
                     1 for "registration"
             reverse: Defaults to ascending if not specified
                      True for "descending"
                      False for "ascending"
+                     (ascending goes by how long ago, so newest first)
+            limit: Only print this many (e.g. the 5 newest). Defaults to all of them
         Returns: Nothing
         External Modifications: None
     '''
 
-    # Returned RDAP data as text in JSON format
-    full_RDAP_text = getRDAPText(IP)
-
-    # Number of update event registries
-    num_entries = len(full_RDAP_text["entities"][0]["entities"])
+    # Returned RDAP data as text in JSON format, indexed
+    index = _entityIndex(IP, fetchRDAPText(IP))
 
-    # Counter to indicate which entry we are on
-    count = 0
+    # 'ascending' is newest to oldest, 'descending' is oldest to newest
+    entries = orderEntries(index, option, newest_first=(reverse != True), limit=limit)
 
-    # List to keep track of times
-    times = []
-
-    # Find out how far away (in days) each entry is from right now and store those numbers
-    for time in range(num_entries):
-        date = convertToDatetime(str(full_RDAP_text["entities"][0]["entities"][count]["events"][option]["eventDate"]))
-        times.append((NOW - date).days)
-        count += 1
-
-    # If reverse has not been set above, we want to print in 'ascending' order
-    if reverse != True:
-        for time in sorted(times):
-            printEntryInfo(full_RDAP_text["entities"][0]["entities"][times.index(int(time))])
-            print('\n\n')
-    # Otherwise, we want 'descending'
-    else:
-        for time in sorted(times, reverse=True):
-            printEntryInfo(full_RDAP_text["entities"][0]["entities"][times.index(int(time))])
-            print('\n\n')
+    # Everything gets built up and printed at the end instead of a line at a time
+    with output.PrettyWriter() as writer:
+        for entry in entries:
+            printEntryInfo(entry, writer, index)
+            writer.writeText('\n\n\n')
 
 
 # Datetime of right now in ISO-8601 format
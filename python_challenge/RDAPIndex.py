@@ -0,0 +1,277 @@
+#! python3
+
+# RDAPIndex.py - A script that handles finding things anywhere in an RDAP answer without digging through it every time
+
+####### VERSION HISTORY #######
+# Version 1: Added 'EntityIndex' class to walk the whole (nested) entity tree once and look entities up by
+#               handle, role, and event type, with their contact cards already pulled out
+#            Edited 'EntityIndex' to skip event dates that aren't strings instead of crashing on them
+#            Added 'EntityIndex.childrenOf' and 'EntityIndex.eventTime' so the update entry menus can stick to the
+#               entries right under the first entity (see 'RDAP.orderEntries')
+###############################
+
+import RDAP as rdap
+
+
+
+# Every entity in an RDAP answer (no matter how deep), walked once and filed away for quick lookups
+class EntityIndex():
+    '''Every entity in an RDAP answer (no matter how deep), walked once and filed away for quick lookups.
+            Questions like "all the abuse contacts" or "the latest 'last changed' anywhere" are then
+            just dictionary lookups.
+
+        Arguments:
+            rdap_text: Full RDAP text in JSON layout (from 'RDAP.getRDAPText')
+    '''
+
+    def __init__(self, rdap_text):
+        self.rdap_text = rdap_text
+
+        # Every entity in the order they show up in the answer (parents before their children)
+        self.entities = []
+
+        self._by_handle = {}
+        self._by_role = {}
+        self._vcards = {}
+        self._parents = {}
+
+        # id of the parent entity (None for the top level) -> its child entities, in the order they show up
+        self._children = {}
+
+        # (id of the entity or None for the network itself, eventAction) -> timestamp of its first event of that type
+        self._stamps = {}
+
+        # eventAction (e.g. 'last changed') -> list of (timestamp, entity or None, event), newest first.
+        #       Events on the network itself have None for the entity
+        self._events = {}
+
+        self._fileEvents(None, rdap_text.get('events', []))
+
+        # Walk the tree with our own stack instead of recursion, so a silly-deep answer can't blow up on us
+        stack = [(entity, None) for entity in reversed(rdap_text.get('entities', []))]
+        while stack:
+            entity, parent = stack.pop()
+            if not isinstance(entity, dict):
+                continue
+
+            self.entities.append(entity)
+            self._parents[id(entity)] = parent
+            self._children.setdefault(None if parent is None else id(parent), []).append(entity)
+            self._vcards[id(entity)] = rdap.getVcardFields(entity)
+
+            handle = entity.get('handle')
+            if handle is not None and handle not in self._by_handle:
+                self._by_handle[handle] = entity
+
+            for role in entity.get('roles', []):
+                self._by_role.setdefault(str(role).lower(), []).append(entity)
+
+            self._fileEvents(entity, entity.get('events', []))
+
+            stack.extend((child, entity) for child in reversed(entity.get('entities', [])))
+
+        # Sort each event list once (newest first, ties go to whichever showed up first)
+        for action, events in self._events.items():
+            events.sort(key=lambda item: (item[0] is None, -(item[0] or 0.0), item[3]))
+            self._events[action] = [item[:3] for item in events]
+
+    # Files away the events for one entity (or the network itself)
+    def _fileEvents(self, entity, events):
+        for event in events:
+            if not isinstance(event, dict):
+                continue
+
+            action = str(event.get('eventAction', '')).lower()
+            # Only strings get read. Anything else (a list, a dict) can't be a date and can't go in parseEventDate's memory
+            date = event.get('eventDate')
+            stamp = rdap.parseEventDate(date) if isinstance(date, str) else None
+
+            self._stamps.setdefault((None if entity is None else id(entity), action), stamp)
+
+            events_list = self._events.setdefault(action, [])
+            events_list.append((stamp, entity, event, len(events_list)))
+
+        return
+
+    def __len__(self):
+        return len(self.entities)
+
+    # Finds an entity by its handle
+    # Returns: The entity's JSON, or None if nothing has that handle
+    # External Modifications: None
+    def byHandle(self, handle):
+        '''Finds an entity by its handle
+
+            Arguments:
+                handle: Handle of the entity (e.g. 'IRT-APNICRANDNET-AU')
+            Returns: The entity's JSON, or None if nothing has that handle
+            External Modifications: None
+        '''
+
+        return self._by_handle.get(handle)
+
+    # Finds every entity with a role
+    # Returns: List of the entities' JSON (empty if there aren't any)
+    # External Modifications: None
+    def byRole(self, role):
+        '''Finds every entity with a role
+
+            Arguments:
+                role: Role name (e.g. 'abuse', 'technical', 'administrative', 'registrant')
+            Returns: List of the entities' JSON, in the order they show up (empty if there aren't any)
+            External Modifications: None
+        '''
+
+        return list(self._by_role.get(str(role).lower(), []))
+
+    # Hands back an entity's contact card (already pulled out)
+    # Returns: Dictionary of vCard field name -> value (see 'RDAP.getVcardFields')
+    # External Modifications: None
+    def vcard(self, entity):
+        '''Hands back an entity's contact card (already pulled out)
+
+            Arguments:
+                entity: The entity's JSON, or its handle
+            Returns: Dictionary of vCard field name -> value (see 'RDAP.getVcardFields'). Empty if it doesn't have one
+            External Modifications: None
+        '''
+
+        if not isinstance(entity, dict):
+            entity = self.byHandle(entity)
+            if entity is None:
+                return {}
+
+        fields = self._vcards.get(id(entity))
+        if fields is None:
+            fields = rdap.getVcardFields(entity)
+
+        return fields
+
+    # Finds the entity another entity is nested under
+    # Returns: The parent entity's JSON, or None if it's at the top
+    # External Modifications: None
+    def parentOf(self, entity):
+        '''Finds the entity another entity is nested under
+
+            Arguments:
+                entity: The entity's JSON
+            Returns: The parent entity's JSON, or None if it's at the top
+            External Modifications: None
+        '''
+
+        return self._parents.get(id(entity))
+
+    # Lists the entities nested right under another entity
+    # Returns: List of the child entities' JSON (empty if there aren't any)
+    # External Modifications: None
+    def childrenOf(self, entity=None):
+        '''Lists the entities nested right under another entity (not their children too)
+
+            Arguments:
+                entity: The entity's JSON. Defaults to None for the entities at the top of the answer
+            Returns: List of the child entities' JSON, in the order they show up (empty if there aren't any)
+            External Modifications: None
+        '''
+
+        return list(self._children.get(None if entity is None else id(entity), []))
+
+    # Finds when an entity's event of one type happened (already read when the index was built)
+    # Returns: Timestamp (seconds since the epoch, UTC), or None if it doesn't have one we can read
+    # External Modifications: None
+    def eventTime(self, entity, action):
+        '''Finds when an entity's event of one type happened (already read when the index was built)
+
+            Arguments:
+                entity: The entity's JSON, or None for the network itself
+                action: eventAction (e.g. 'registration', 'last changed')
+            Returns: Timestamp (seconds since the epoch, UTC) of its first event of that type, or None if it
+                     doesn't have one (or its date can't be read)
+            External Modifications: None
+        '''
+
+        return self._stamps.get((None if entity is None else id(entity), str(action).lower()))
+
+    # Lists the contact info for every entity with a role (e.g. all the abuse contacts)
+    # Returns: List of dictionaries with 'handle', 'roles', 'name', 'email', and 'telephone'
+    # External Modifications: None
+    def contacts(self, role):
+        '''Lists the contact info for every entity with a role (e.g. all the abuse contacts)
+
+            Arguments:
+                role: Role name (e.g. 'abuse')
+            Returns: List of dictionaries with 'handle', 'roles', 'name', 'email', and 'telephone'
+                     ('' for anything the contact card doesn't have)
+            External Modifications: None
+        '''
+
+        results = []
+
+        for entity in self._by_role.get(str(role).lower(), []):
+            card = self._vcards.get(id(entity), {})
+            results.append({'handle': entity.get('handle', ''),
+                            'roles': entity.get('roles', []),
+                            'name': card.get('fn', ''),
+                            'email': card.get('email', ''),
+                            'telephone': card.get('tel', '')
+                            })
+
+        return results
+
+    # Lists every event of one type, anywhere in the answer
+    # Returns: List of (timestamp, entity or None, event), newest first
+    # External Modifications: None
+    def events(self, action):
+        '''Lists every event of one type, anywhere in the answer (the network itself and every entity)
+
+            Arguments:
+                action: eventAction (e.g. 'registration', 'last changed')
+            Returns: List of (timestamp, entity or None, event), newest first. entity is None for events on
+                     the network itself. Events with unreadable dates come last (with a None timestamp)
+            External Modifications: None
+        '''
+
+        return list(self._events.get(str(action).lower(), []))
+
+    # Finds the newest event of one type, anywhere in the answer
+    # Returns: Tuple of (timestamp, entity or None, event), or None if there aren't any
+    # External Modifications: None
+    def latestEvent(self, action):
+        '''Finds the newest event of one type, anywhere in the answer
+
+            Arguments:
+                action: eventAction (e.g. 'registration', 'last changed')
+            Returns: Tuple of (timestamp, entity or None, event), or None if there aren't any
+            External Modifications: None
+        '''
+
+        events = self._events.get(str(action).lower())
+        if not events:
+            return None
+
+        return events[0]
+
+    # Finds the oldest event of one type, anywhere in the answer
+    # Returns: Tuple of (timestamp, entity or None, event), or None if there aren't any
+    # External Modifications: None
+    def oldestEvent(self, action):
+        '''Finds the oldest event of one type, anywhere in the answer
+
+            Arguments:
+                action: eventAction (e.g. 'registration', 'last changed')
+            Returns: Tuple of (timestamp, entity or None, event), or None if there aren't any
+            External Modifications: None
+        '''
+
+        events = [item for item in self._events.get(str(action).lower(), []) if item[0] is not None]
+        if not events:
+            return None
+
+        return events[-1]
+
+
+
+
+
+##### MAIN #####
+if __name__ == '__main__':
+    print("Hello, World!")
@@ -0,0 +1,143 @@
+#! python3
+
+# Session.py - A script that holds onto everything we've grabbed for the IP that's being looked at
+
+####### VERSION HISTORY #######
+# Version 1: Added 'IPLookup' class to grab the RDAP and GeoIP data for an IP only once
+# Version 2: Added 'IPLookup.getEntityIndex' to build the RDAP entity index only once (see 'RDAPIndex.py')
+#            Added 'IPLookup.prefetch' to start grabbing the RDAP and GeoIP data in the background right away
+###############################
+
+import GEOIP as geo
+import RDAP as rdap
+import RDAPIndex as rdapindex
+import threading
+
+
+
+# Holds the RDAP and GeoIP data for one IP. Each one is only grabbed the first time it's asked for,
+#       every time after that it's handed right back
+class IPLookup():
+    '''Holds the RDAP and GeoIP data for one IP. Each one is only grabbed the first time it's asked for,
+            every time after that it's handed right back. Can be passed to the RDAP.py functions and
+            'Filter.validateIP' in place of a string IP.
+
+        Arguments:
+            IP: String version of IP address
+    '''
+
+    def __init__(self, IP):
+        self.ip = str(IP).strip()
+
+        self._rdap_text = None
+        self._rdap_done = False
+        self._rdap_lock = threading.Lock()
+
+        self._geo_data = None
+        self._geo_done = False
+        self._geo_lock = threading.Lock()
+
+        self._entity_index = None
+        self._index_lock = threading.Lock()
+
+    def __str__(self):
+        return self.ip
+
+    # Grabs the RDAP text for the IP (only visits the site the first time)
+    # Returns: Text of RDAP info in JSON layout, or None if the IP is not valid or reserved
+    # External Modifications: Visits the RDAP site the first time it's called
+    def getRDAPText(self):
+        '''Grabs the RDAP text for the IP (only visits the site the first time)
+
+            Arguments:
+                None
+            Returns: Text of RDAP info in JSON layout, or None if the IP is not valid or reserved
+            External Modifications: Visits the RDAP site the first time it's called
+        '''
+
+        # The lock makes anybody else asking at the same time wait for the one visit
+        with self._rdap_lock:
+            if not self._rdap_done:
+                self._rdap_text = rdap.getRDAPText(self.ip)
+                self._rdap_done = True
+
+        return self._rdap_text
+
+    # Grabs the GeoIP data for the IP (only visits the site the first time)
+    # Returns: respData for parsing
+    # External Modifications: Visits the GeoIP site the first time it's called
+    def getIPData(self):
+        '''Grabs the GeoIP data for the IP (only visits the site the first time)
+
+            Arguments:
+                None
+            Returns: respData for parsing
+            External Modifications: Visits the GeoIP site the first time it's called
+        '''
+
+        with self._geo_lock:
+            if not self._geo_done:
+                self._geo_data = geo.getIPData(self.ip)
+                self._geo_done = True
+
+        return self._geo_data
+
+    # Starts grabbing the RDAP and/or GeoIP data in the background, so it's (hopefully) there by the time it's asked for
+    # Returns: Itself
+    # External Modifications: Visits the RDAP and/or GeoIP sites in the background
+    def prefetch(self, rdap_data=True, geo_data=True):
+        '''Starts grabbing the RDAP and/or GeoIP data in the background, so it's (hopefully) there by the
+                time it's asked for. Asking before it's done just waits for the visit that's already underway
+                instead of making another one. If the background visit fails, asking for it tries again
+                (and the error shows up then, like it always has).
+
+            Arguments:
+                rdap_data: True to grab the RDAP text (and build the entity index)
+                geo_data: True to grab the GeoIP data
+            Returns: Itself
+            External Modifications: Visits the RDAP and/or GeoIP sites in the background
+        '''
+
+        if rdap_data:
+            threading.Thread(target=self._quietly, args=(self.getEntityIndex,), daemon=True).start()
+        if geo_data:
+            threading.Thread(target=self._quietly, args=(self.getIPData,), daemon=True).start()
+
+        return self
+
+    # Runs a grab in the background without letting errors spill all over the menus
+    def _quietly(self, grab):
+        try:
+            grab()
+        except Exception:
+            pass
+
+    # Indexes every entity in the RDAP text (only walks it the first time)
+    # Returns: RDAPIndex.EntityIndex, or None if the IP is not valid or reserved
+    # External Modifications: Visits the RDAP site if it hasn't been already
+    def getEntityIndex(self):
+        '''Indexes every entity in the RDAP text (only walks it the first time)
+
+            Arguments:
+                None
+            Returns: RDAPIndex.EntityIndex, or None if the IP is not valid or reserved
+            External Modifications: Visits the RDAP site if it hasn't been already
+        '''
+
+        rdap_text = self.getRDAPText()
+        if not isinstance(rdap_text, dict):
+            return None
+
+        with self._index_lock:
+            if self._entity_index is None:
+                self._entity_index = rdapindex.EntityIndex(rdap_text)
+
+        return self._entity_index
+
+
+
+
+
+##### MAIN #####
+if __name__ == '__main__':
+    print("Hello, World!")
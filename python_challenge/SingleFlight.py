@@ -0,0 +1,167 @@
+#! python3
+
+# SingleFlight.py - A script that handles making sure the same thing only gets fetched once at a time
+
+####### VERSION HISTORY #######
+# Version 1: Added 'SingleFlight' class so threads asking for the same thing at the same time share one fetch
+#            Added 'AsyncSingleFlight' class to do the same for coroutines
+#            Edited 'AsyncSingleFlight.do' to make its future on the loop that's actually running
+###############################
+
+import asyncio
+import threading
+import Stats as stats
+
+# The event loop running this coroutine ('get_running_loop' is Python 3.7+, 'get_event_loop' does the same from a
+#       coroutine on 3.6)
+_runningLoop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+
+
+# One fetch that's underway, and what came of it
+class _Call():
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# Makes threads asking for the same thing at the same time share one fetch
+class SingleFlight():
+    '''Makes threads asking for the same thing at the same time share one fetch. The first thread to ask
+            does the fetch, everybody who asks while it's underway waits for it and gets the same answer
+            (or the same error). Nothing is remembered once the fetch is over, that's what the caches are for.
+
+        Arguments:
+            name: What's being fetched (e.g. 'rdap'). Shares get counted as 'coalesced <name>' (see 'Stats.py')
+    '''
+
+    def __init__(self, name=''):
+        self.name = name
+
+        # key -> _Call for every fetch that's underway
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._calls)
+
+    # Fetches something, or waits for whoever is already fetching it
+    # Returns: Whatever 'function' returns
+    # External Modifications: Whatever 'function' does (only once for everybody asking at the same time)
+    def do(self, key, function, *args):
+        '''Fetches something, or waits for whoever is already fetching it
+
+            Arguments:
+                key: What's being fetched (e.g. the IP). Asks with the same key share one fetch
+                function: Does the fetch
+                args: Handed to 'function'
+            Returns: Whatever 'function' returns
+            Raises: Whatever 'function' raises
+            External Modifications: Whatever 'function' does (only once for everybody asking at the same time)
+        '''
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            stats.count('coalesced ' + self.name)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function(*args)
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+
+# Makes coroutines asking for the same thing at the same time share one fetch
+class AsyncSingleFlight():
+    '''Makes coroutines asking for the same thing at the same time share one fetch (the asyncio version
+            of 'SingleFlight'). If the coroutine doing the fetch gets cancelled, the next one in line
+            starts over instead of getting cancelled too.
+
+        Arguments:
+            name: What's being fetched (e.g. 'rdap'). Shares get counted as 'coalesced <name>' (see 'Stats.py')
+    '''
+
+    def __init__(self, name=''):
+        self.name = name
+
+        # key -> asyncio.Future for every fetch that's underway
+        self._calls = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    # Fetches something, or waits for whoever is already fetching it
+    # Returns: Whatever 'function' returns
+    # External Modifications: Whatever 'function' does (only once for everybody asking at the same time)
+    async def do(self, key, function, *args):
+        '''Fetches something, or waits for whoever is already fetching it
+
+            Arguments:
+                key: What's being fetched (e.g. the IP). Asks with the same key share one fetch
+                function: Coroutine function that does the fetch
+                args: Handed to 'function'
+            Returns: Whatever 'function' returns
+            Raises: Whatever 'function' raises
+            External Modifications: Whatever 'function' does (only once for everybody asking at the same time)
+        '''
+
+        while key in self._calls:
+            future = self._calls[key]
+            stats.count('coalesced ' + self.name)
+            try:
+                # Shielded, so us getting cancelled doesn't cancel the fetch for everybody else
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Whoever was fetching got cancelled, not us. Go again
+                if future.cancelled():
+                    continue
+                raise
+
+        future = _runningLoop().create_future()
+
+        # Nobody might be waiting to see the error, so don't let asyncio complain that nobody did
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+        self._calls[key] = future
+
+        try:
+            result = await function(*args)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._calls[key]
+
+        return result
+
+
+
+
+
+##### MAIN #####
+if __name__ == '__main__':
+    print("Hello, World!")
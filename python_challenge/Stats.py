@@ -0,0 +1,345 @@
+#! python3
+
+# Stats.py - A script that handles keeping track of where the time goes (timings and counters for every stage)
+
+####### VERSION HISTORY #######
+# Version 1: Added 'timer', 'addTime', and 'count' functions for the other scripts to report what they're doing
+#            Added 'snapshot', 'printSummary', and 'saveReport' functions to show it all at the end of a run
+#            Added 'Progress' class to print IPs/second and time left every so often while a batch runs
+###############################
+
+import json
+import os
+import sys
+import threading
+import time
+
+# Set the GRIP_STATS environment variable to 'off' to skip all of this (it's cheap, but not free)
+ENABLED = os.environ.get('GRIP_STATS', '').lower() not in ('0', 'off', 'no', 'false')
+
+# stage -> [how many times, total seconds, slowest seconds]
+_timings = {}
+
+# name -> number
+_counters = {}
+
+_lock = threading.Lock()
+
+# When the numbers were last cleared (see 'reset')
+_started = time.perf_counter()
+
+
+
+# Times one go at a stage ('with Stats.timer("parse"):')
+class _Timer():
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        addTime(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+# Stands in for '_Timer' when stats are turned off
+class _NoTimer():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NO_TIMER = _NoTimer()
+
+
+
+# Times a stage (use it with 'with')
+# Returns: Something to use with 'with'
+# External Modifications: None
+def timer(stage):
+    '''Times a stage, e.g.
+
+            with Stats.timer('rdap.json'):
+                rdap_text = json.loads(response_text)
+
+        Arguments:
+            stage: Name of the stage (e.g. 'parse', 'http rdap.apnic.net', 'rdap.json')
+        Returns: Something to use with 'with'
+        External Modifications: Adds to the stage's time when the 'with' block ends
+    '''
+
+    if not ENABLED:
+        return _NO_TIMER
+
+    return _Timer(stage)
+
+# Adds some time to a stage
+# Returns: Nothing
+# External Modifications: None
+def addTime(stage, seconds):
+    '''Adds some time to a stage
+
+        Arguments:
+            stage: Name of the stage
+            seconds: How long it took
+        Returns: Nothing
+        External Modifications: None
+    '''
+
+    if not ENABLED:
+        return
+
+    with _lock:
+        timing = _timings.get(stage)
+        if timing is None:
+            _timings[stage] = [1, seconds, seconds]
+        else:
+            timing[0] += 1
+            timing[1] += seconds
+            if seconds > timing[2]:
+                timing[2] = seconds
+
+    return
+
+# Adds to a counter
+# Returns: Nothing
+# External Modifications: None
+def count(name, amount=1):
+    '''Adds to a counter
+
+        Arguments:
+            name: Name of the counter (e.g. 'requests rdap.apnic.net', 'cache rdap hit')
+            amount: How much to add
+        Returns: Nothing
+        External Modifications: None
+    '''
+
+    if not ENABLED:
+        return
+
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+    return
+
+# Looks up a counter
+# Returns: The number (0 if nothing has been counted yet)
+# External Modifications: None
+def getCount(name):
+    '''Looks up a counter
+
+        Arguments:
+            name: Name of the counter
+        Returns: The number (0 if nothing has been counted yet)
+        External Modifications: None
+    '''
+
+    return _counters.get(name, 0)
+
+# Clears every timing and counter (e.g. between benchmark runs)
+# Returns: Nothing
+# External Modifications: None
+def reset():
+    '''Clears every timing and counter (e.g. between benchmark runs)
+
+        Arguments:
+            None
+        Returns: Nothing
+        External Modifications: None
+    '''
+
+    global _started
+
+    with _lock:
+        _timings.clear()
+        _counters.clear()
+        _started = time.perf_counter()
+
+    return
+
+# Hands back everything recorded so far
+# Returns: Dictionary that can go straight into 'json.dumps'
+# External Modifications: None
+def snapshot():
+    '''Hands back everything recorded so far
+
+        Arguments:
+            None
+        Returns: Dictionary with 'elapsed_s', 'stages' (stage -> 'count', 'total_s', 'avg_ms', 'max_ms'),
+                 and 'counters' (name -> number)
+        External Modifications: None
+    '''
+
+    with _lock:
+        stages = {}
+        for stage, (times, total, slowest) in sorted(_timings.items()):
+            stages[stage] = {'count': times,
+                             'total_s': round(total, 4),
+                             'avg_ms': round(total / times * 1000, 3),
+                             'max_ms': round(slowest * 1000, 3)
+                             }
+
+        counters = dict(sorted(_counters.items()))
+        elapsed = time.perf_counter() - _started
+
+    return {'elapsed_s': round(elapsed, 3),
+            'stages': stages,
+            'counters': counters
+            }
+
+# Lays everything recorded so far out as a table
+# Returns: String
+# External Modifications: None
+def summaryText():
+    '''Lays everything recorded so far out as a table (slowest stages first)
+
+        Arguments:
+            None
+        Returns: String
+        External Modifications: None
+    '''
+
+    report = snapshot()
+
+    lines = ['Stage'.ljust(36) + 'Count'.rjust(10) + 'Total s'.rjust(12) + 'Avg ms'.rjust(12) + 'Max ms'.rjust(12)]
+
+    for stage, timing in sorted(report['stages'].items(), key=lambda item: -item[1]['total_s']):
+        lines.append(stage[:35].ljust(36) + str(timing['count']).rjust(10) + ('%.3f' % timing['total_s']).rjust(12) +
+                     ('%.2f' % timing['avg_ms']).rjust(12) + ('%.2f' % timing['max_ms']).rjust(12))
+
+    lines.append('')
+    lines.append('Counter'.ljust(36) + 'Value'.rjust(10))
+    for name, value in report['counters'].items():
+        lines.append(name[:35].ljust(36) + str(value).rjust(10))
+
+    lines.append('')
+    lines.append('Elapsed'.ljust(36) + ('%.3f s' % report['elapsed_s']).rjust(10))
+
+    ips = report['counters'].get('ips', 0)
+    if ips and report['elapsed_s'] > 0:
+        lines.append('IPs/second'.ljust(36) + ('%.1f' % (ips / report['elapsed_s'])).rjust(10))
+
+    return '\n'.join(lines) + '\n'
+
+# Prints the table from 'summaryText'
+# Returns: Nothing
+# External Modifications: Writes to the stream
+def printSummary(stream=None):
+    '''Prints the table from 'summaryText'
+
+        Arguments:
+            stream: Where to print it. Defaults to sys.stderr, so it stays out of piped output
+        Returns: Nothing
+        External Modifications: Writes to the stream
+    '''
+
+    stream = stream if stream is not None else sys.stderr
+    stream.write('\n' + summaryText())
+    stream.flush()
+
+    return
+
+# Saves everything recorded so far as JSON
+# Returns: Nothing
+# External Modifications: Writes 'path'
+def saveReport(path):
+    '''Saves everything recorded so far as JSON (see 'snapshot' for the layout)
+
+        Arguments:
+            path: Where to save it (overwritten)
+        Returns: Nothing
+        External Modifications: Writes 'path'
+    '''
+
+    with open(path, 'w') as myfile:
+        json.dump(snapshot(), myfile, indent=2)
+        myfile.write('\n')
+
+    return
+
+
+# Prints a progress line every so often while a batch runs
+class Progress():
+    '''Prints a progress line (IPs done, IPs/second, and time left) every so often while a batch runs.
+            Goes by the 'ips' counter, which 'Batch.enrichIP' adds to, so nothing else needs to call it.
+
+        Arguments:
+            total: How many IPs there are in all (or None if nobody knows, then there's no time left)
+            interval: Seconds between lines
+            stream: Where to print. Defaults to sys.stderr
+    '''
+
+    def __init__(self, total=None, interval=5.0, stream=None):
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+
+        self._first = getCount('ips')
+        self._began = time.perf_counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    # Builds the progress line
+    # Returns: String like "Progress: 1200/5000 IPs (24%)   180.2 IPs/s   about 21s left"
+    def line(self):
+        done = getCount('ips') - self._first
+        seconds = time.perf_counter() - self._began
+        rate = done / seconds if seconds > 0 else 0.0
+
+        text = 'Progress: ' + str(done)
+        if self.total:
+            text += '/' + str(self.total) + ' IPs (' + str(int(100 * done / self.total)) + '%)'
+        else:
+            text += ' IPs'
+        text += '   %.1f IPs/s' % rate
+
+        if self.total and rate > 0 and done < self.total:
+            left = int((self.total - done) / rate)
+            text += '   about ' + (str(left // 60) + 'm ' if left >= 60 else '') + str(left % 60) + 's left'
+
+        return text
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            stream = self.stream if self.stream is not None else sys.stderr
+            stream.write(self.line() + '\n')
+            stream.flush()
+
+    # Starts printing in the background
+    # Returns: Itself
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    # Stops printing
+    # Returns: Nothing
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return
+
+
+
+
+
+##### MAIN #####
+if __name__ == '__main__':
+    print("Hello, World!")
@@ -0,0 +1,189 @@
+#! python3
+
+# Stream_Driver.py - A script that handles the non-interactive (pipeline) version of the G.R.I.P. System
+
+####### VERSION HISTORY #######
+# Version 1: Reads IPs (or raw log text) from stdin or files and prints one JSON object per IP as soon as it's ready
+# Version 2: Added '--format' to print CSV or one big JSON document instead (see 'Output.py')
+#            Moved 'buildRecord' to 'Batch.py' so 'CLI_Driver.py' can use it too
+#            Added '--stats', '--stats-json', and '--progress' to show where the time went (see 'Stats.py')
+#            Added '--record' and '--replay' to save what the sites answered and run it again later without
+#               the internet (see 'Archive.py')
+###############################
+
+import Parse as par
+import GEOIP as geo
+import RDAP as rdap
+import Batch as batch
+import Output as output
+import Stats as stats
+import Archive as archive
+import argparse
+import os.path
+import sys
+
+
+
+# Pulls IPs out of stdin (a line at a time, so 'tail -f' works) or out of files
+# Returns: Generator of string IP addresses
+# External Modifications: Reads stdin and/or files
+def iterInputIPs(paths):
+    '''Pulls IPs out of stdin (a line at a time, so 'tail -f' works) or out of files
+
+        Arguments:
+            paths: List of file paths. Empty (or '-') means stdin
+        Returns: Generator of string IP addresses, in the order they show up
+        External Modifications: Reads stdin and/or files
+    '''
+
+    for path in (paths or ['-']):
+        if path == '-':
+            for line in iter(sys.stdin.readline, ''):
+                for ip in par.ALL_IPV4_FORMAT_REGEX.findall(line):
+                    yield ip
+
+        elif os.path.isfile(path):
+            for ip in par.iterIPs(path):
+                yield ip
+
+        else:
+            print("Not a valid file: " + path, file=sys.stderr)
+
+    return
+
+# Throws out anything that can't be a real IP (e.g. 999.1.1.1), and repeats if asked to
+# Returns: Generator of string IP addresses
+# External Modifications: None
+def filterIPs(IPs, unique=False):
+    '''Throws out anything that can't be a real IP (e.g. 999.1.1.1), and repeats if asked to
+
+        Arguments:
+            IPs: Any iterable of string IP addresses
+            unique: True to only let each IP through the first time it shows up
+        Returns: Generator of string IP addresses
+        External Modifications: None
+    '''
+
+    seen = set()
+
+    for ip in IPs:
+        number = par.ipToInt(ip)
+        if number is None:
+            continue
+
+        if unique:
+            if number in seen:
+                continue
+            seen.add(number)
+
+        yield ip
+
+    return
+
+# Works out which fields were asked for
+# Returns: List of field names, or None if that data type wasn't asked for at all
+def _pickFields(asked, allowed, parser, option):
+    if asked is None:
+        return None
+
+    # '--geo' on its own means everything
+    if len(asked) == 0:
+        return list(allowed)
+
+    for field in asked:
+        if field not in allowed:
+            parser.error("unknown " + option + " field '" + field + "' (pick from: " + ' '.join(allowed) + ")")
+
+    return asked
+
+# Runs the whole pipeline: read IPs, look them up, print a JSON object per line
+# Returns: Exit code
+# External Modifications: Reads stdin/files, visits the GeoIP and RDAP sites, writes stdout
+def main(argv=None):
+    '''Runs the whole pipeline: read IPs, look them up, print a JSON object per line
+
+        Arguments:
+            argv: Command line arguments (defaults to sys.argv)
+        Returns: Exit code
+        External Modifications: Reads stdin/files, visits the GeoIP and RDAP sites, writes stdout
+    '''
+
+    parser = argparse.ArgumentParser(description="The G.R.I.P. System, pipeline edition. Reads IPs (or raw log text) "
+                                                 "and prints one JSON object per IP, e.g.  tail -f access.log | "
+                                                 "python Stream_Driver.py --geo isp c_code | jq .")
+    parser.add_argument('files', nargs='*', help="Files to read IPs out of (default: stdin)")
+    parser.add_argument('--geo', nargs='*', metavar='FIELD', help="GeoIP fields to include (" + ' '.join(geo.GEO_FIELDS) + "). No fields means all of them")
+    parser.add_argument('--rdap', nargs='*', metavar='FIELD', help="RDAP fields to include (" + ' '.join(rdap.RDAP_FIELDS) + "). No fields means all of them")
+    parser.add_argument('--workers', type=int, default=batch.DEFAULT_WORKERS, help="How many IPs to look up at the same time")
+    parser.add_argument('--unique', action='store_true', help="Only look up (and print) each IP the first time it shows up")
+    parser.add_argument('--format', choices=output.FORMATS, default='ndjson', help="How to print the results (default: ndjson)")
+    parser.add_argument('--stats', action='store_true', help="Print a table of where the time went to stderr at the end")
+    parser.add_argument('--stats-json', metavar='PATH', help="Save where the time went as JSON at the end")
+    parser.add_argument('--progress', type=float, nargs='?', const=5.0, metavar='SECONDS', help="Print IPs/second to stderr every so often (default: every 5 seconds)")
+    replay_options = parser.add_mutually_exclusive_group()
+    replay_options.add_argument('--record', metavar='ARCHIVE', help="Save everything the sites answer to ARCHIVE (e.g. monday.grip.gz) so the run can be played back later")
+    replay_options.add_argument('--replay', metavar='ARCHIVE', help="Answer everything out of ARCHIVE instead of visiting the sites (IPs that aren't in it come out as null)")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.record:
+            archive.startRecording(args.record)
+        elif args.replay:
+            archive.startReplay(args.replay)
+    except archive.ArchiveError as error:
+        parser.error(str(error))
+
+    geo_fields = _pickFields(args.geo, geo.GEO_FIELDS, parser, 'GeoIP')
+    rdap_fields = _pickFields(args.rdap, rdap.RDAP_FIELDS, parser, 'RDAP')
+
+    # Nothing asked for, so give them all the GeoIP stuff
+    if geo_fields is None and rdap_fields is None:
+        geo_fields = list(geo.GEO_FIELDS)
+
+    IPs = filterIPs(iterInputIPs(args.files), unique=args.unique)
+
+    # Every record goes out the door as soon as it's ready, somebody downstream might be waiting on it
+    writer = output.openWriter(args.format, buffer_size=0)
+
+    progress = None
+    if args.progress:
+        progress = stats.Progress(interval=args.progress).start()
+
+    try:
+        for ip, geo_data, rdap_text in batch.enrichIPs(IPs, geo_data=geo_fields is not None, rdap_data=rdap_fields is not None, workers=args.workers):
+            writer.write(batch.buildRecord(ip, geo_data, rdap_text, geo_fields, rdap_fields))
+
+        writer.close()
+
+    # Whoever we were piping into (e.g. 'head') stopped listening
+    except BrokenPipeError:
+        try:
+            sys.stdout.close()
+        except BrokenPipeError:
+            pass
+        return 0
+
+    except KeyboardInterrupt:
+        return 130
+
+    finally:
+        if progress is not None:
+            progress.stop()
+
+        if args.record or args.replay:
+            archive.stop()
+
+        if args.stats:
+            stats.printSummary()
+        if args.stats_json:
+            stats.saveReport(args.stats_json)
+
+    return 0
+
+
+
+
+
+##### MAIN #####
+if __name__ == '__main__':
+    sys.exit(main())
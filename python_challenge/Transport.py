@@ -0,0 +1,512 @@
+#! python3
+
+# Transport.py - A script that handles actually talking to the RDAP and GeoIP sites
+
+####### VERSION HISTORY #######
+# Version 1: Added 'getSession' function to keep one pool of open connections per site
+#            Added 'get' function to visit a URL through those pools
+#            Added 'configure' function to change pool sizes and timeouts
+# Version 2: Added 'TokenBucket' class and 'setRateLimit' function to keep each site under its request rate
+#               (the rate backs off when a site throttles us and creeps back up when it stops)
+#            Edited 'get' to retry throttled/failed visits with exponential backoff and jitter (honouring Retry-After)
+#            Added 'UpstreamError' for when a site still won't answer after all the retries
+# Version 3: Edited 'get' to report visit times, bytes, retries, and errors per site (see 'Stats.py')
+# Version 4: Edited 'get' to save every answer to the archive being recorded, or answer straight out of the
+#               archive being played back without visiting anything (see 'Archive.py')
+# Version 5: Edited 'backoff' to wait as long as Retry-After says (up to RETRY_AFTER_MAX) instead of BACKOFF_MAX
+#            Edited 'TokenBucket' so a site's rate can creep above where it started (up to its ceiling), and
+#               'setRateLimit' to take the ceiling
+#            Added 'ensurePoolSize' function so the pools can be sized from how many workers there are
+#            Added 'checkRetryAfter' function so a site asking for more than RETRY_AFTER_MAX gets given up on
+#               instead of stalling every worker visiting it
+###############################
+
+import requests
+import requests.adapters
+import threading
+import urllib.parse
+import time
+import random
+import email.utils
+import Stats as stats
+import Archive as archive
+
+# How many open connections we keep around for each site. 'Batch.enrichIPs' grows it to its worker count
+#       (see 'ensurePoolSize') so no worker has to wait for a connection
+POOL_SIZE = 32
+
+# Seconds to wait for a connection, then seconds to wait for the answer
+TIMEOUT = (5, 30)
+
+# One session (with its own connection pool) per site, e.g. 'https://rdap.apnic.net'
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# Requests per second (and how many can go out back-to-back) each site starts at. Good visits creep the rate
+#       up to the site's ceiling (RATE_HEADROOM times this unless a third number says otherwise), being
+#       throttled halves it. Sites not listed here get 'DEFAULT_RATE_LIMIT'
+RATE_LIMITS = {'rdap.apnic.net': (10, 20),
+               'api.geoiplookup.net': (5, 10)
+               }
+DEFAULT_RATE_LIMIT = (10, 20)
+
+# Answers that mean "slow down" or "try again later"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# How many times a visit is retried before giving up
+MAX_RETRIES = 5
+
+# Seconds for the first backoff (doubles every retry) and the most we'll ever wait between tries on our own
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 60
+
+# Most we'll wait when a site tells us how long with Retry-After. Everybody visiting the site waits along with
+#       us, so if it asks for longer than this we give up on the visit instead (see 'checkRetryAfter')
+RETRY_AFTER_MAX = 30
+
+# Slowest a throttled site gets visited (per second), and how much of its starting rate each good visit wins back
+MIN_RATE = 0.2
+RATE_STEP = 0.02
+
+# How far above its starting rate a site gets tried, if it doesn't have a ceiling of its own
+RATE_HEADROOM = 2.0
+
+# One bucket per site (see 'getBucket')
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+
+# Raised when a site still won't give a proper answer after all the retries
+class UpstreamError(Exception):
+    '''Raised when a site still won't give a proper answer after all the retries
+
+        Arguments:
+            message: What went wrong
+            status: Last HTTP status the site gave (or None if it never answered)
+    '''
+
+    def __init__(self, message, status=None):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+# Hands out permission to visit a site at a steady rate, with a little room for bursts
+class TokenBucket():
+    '''Hands out permission to visit a site at a steady rate, with a little room for bursts.
+            Safe to share between threads.
+
+        Arguments:
+            rate: How many visits per second are allowed on average to start with
+            burst: How many visits can go out back-to-back before the rate kicks in
+            ceiling: Fastest the rate can creep up to (defaults to RATE_HEADROOM times 'rate')
+    '''
+
+    def __init__(self, rate, burst, ceiling=None):
+        # 'rate' drops when the site throttles us and creeps up towards 'max_rate' as visits succeed
+        self.start_rate = float(rate)
+        self.max_rate = float(ceiling) if ceiling is not None else self.start_rate * RATE_HEADROOM
+        self.rate = float(rate)
+        self.burst = float(max(1, burst))
+
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+        # Nobody gets a token before this (set by 'pause')
+        self._paused_until = 0.0
+
+        self._lock = threading.Lock()
+
+    # Takes a token, even if it hasn't shown up yet
+    # Returns: Seconds to wait before the visit is allowed (0 if it can go right now)
+    # External Modifications: None
+    def reserve(self):
+        '''Takes a token, even if it hasn't shown up yet. Doesn't wait, so it works for threads and asyncio alike.
+
+            Arguments:
+                None
+            Returns: Seconds to wait before the visit is allowed (0 if it can go right now)
+            External Modifications: None
+        '''
+
+        with self._lock:
+            now = time.monotonic()
+
+            # Top the bucket back up for the time that has passed
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            # Going negative is how we keep track of people already waiting in line
+            self._tokens -= 1
+            wait = 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+            return max(wait, self._paused_until - now)
+
+    # Waits until a visit is allowed
+    # Returns: Nothing
+    # External Modifications: Sleeps
+    def acquire(self):
+        '''Waits until a visit is allowed
+
+            Arguments:
+                None
+            Returns: Nothing
+            External Modifications: Sleeps
+        '''
+
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+        return
+
+    # Stops everybody from visiting for a while (e.g. when the site says Retry-After)
+    # Returns: Nothing
+    # External Modifications: None
+    def pause(self, seconds):
+        '''Stops everybody from visiting for a while (e.g. when the site says Retry-After)
+
+            Arguments:
+                seconds: How long to stop for
+            Returns: Nothing
+            External Modifications: None
+        '''
+
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+        return
+
+    # Halves the rate after the site throttles us
+    # Returns: Nothing
+    # External Modifications: None
+    def slowDown(self):
+        '''Halves the rate after the site throttles us (never below 'MIN_RATE')
+
+            Arguments:
+                None
+            Returns: Nothing
+            External Modifications: None
+        '''
+
+        with self._lock:
+            self.rate = max(MIN_RATE, self.rate / 2)
+
+        return
+
+    # Nudges the rate back up after a visit goes through fine
+    # Returns: Nothing
+    # External Modifications: None
+    def speedUp(self):
+        '''Nudges the rate up after a visit goes through fine, past where it started if the site keeps
+                up (never above 'max_rate')
+
+            Arguments:
+                None
+            Returns: Nothing
+            External Modifications: None
+        '''
+
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.start_rate * RATE_STEP)
+
+        return
+
+
+
+# Changes how many connections are kept per site and how long we wait on them
+# Returns: Nothing
+# External Modifications: Closes every open connection so the new settings take effect
+def configure(pool_size=None, timeout=None):
+    '''Changes how many connections are kept per site and how long we wait on them
+
+        Arguments:
+            pool_size: How many open connections to keep for each site
+            timeout: Seconds to wait for an answer, or a tuple of (connect seconds, read seconds)
+        Returns: Nothing
+        External Modifications: Closes every open connection so the new settings take effect
+    '''
+
+    global POOL_SIZE, TIMEOUT
+
+    with _sessions_lock:
+        if pool_size is not None:
+            POOL_SIZE = max(1, int(pool_size))
+        if timeout is not None:
+            TIMEOUT = timeout
+
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+    return
+
+# Makes sure each site keeps enough connections open for this many threads visiting it at the same time
+# Returns: Nothing
+# External Modifications: Closes every open connection if the pools have to grow
+def ensurePoolSize(size):
+    '''Makes sure each site keeps enough connections open for this many threads visiting it at the same time.
+            Pools only ever grow here, and nothing changes if they're already big enough.
+
+        Arguments:
+            size: How many threads could be visiting one site at once (e.g. the worker count)
+        Returns: Nothing
+        External Modifications: Closes every open connection if the pools have to grow
+    '''
+
+    if int(size) > POOL_SIZE:
+        configure(pool_size=size)
+
+    return
+
+# Hands back the session for whatever site a URL is on, making it the first time
+# Returns: requests.Session that keeps its connections open between visits
+# External Modifications: None
+def getSession(url):
+    '''Hands back the session for whatever site a URL is on, making it the first time. Visits through
+            the same session reuse the same connections, so DNS, TCP, and TLS only happen once.
+
+        Arguments:
+            url: Any URL on the site
+        Returns: requests.Session that keeps its connections open between visits
+        External Modifications: None
+    '''
+
+    parts = urllib.parse.urlsplit(url)
+    site = parts.scheme + '://' + parts.netloc
+
+    with _sessions_lock:
+        session = _sessions.get(site)
+
+        if session is None:
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _sessions[site] = session
+
+    return session
+
+# Changes how fast a site can be visited
+# Returns: Nothing
+# External Modifications: Replaces the site's bucket
+def setRateLimit(host, rate, burst=None, ceiling=None):
+    '''Changes how fast a site can be visited
+
+        Arguments:
+            host: Name of the site (e.g. 'rdap.apnic.net')
+            rate: How many visits per second are allowed on average to start with
+            burst: How many visits can go out back-to-back (defaults to twice the rate)
+            ceiling: Fastest the rate can creep up to while the site keeps up (defaults to RATE_HEADROOM
+                     times the rate). Make it the same as 'rate' for a hard limit
+        Returns: Nothing
+        External Modifications: Replaces the site's bucket
+    '''
+
+    if burst is None:
+        burst = rate * 2
+
+    with _buckets_lock:
+        RATE_LIMITS[host] = (rate, burst, ceiling)
+        _buckets[host] = TokenBucket(rate, burst, ceiling)
+
+    return
+
+# Hands back the bucket for whatever site a URL is on, making it the first time
+# Returns: TokenBucket
+# External Modifications: None
+def getBucket(url):
+    '''Hands back the bucket for whatever site a URL is on, making it the first time
+
+        Arguments:
+            url: Any URL on the site
+        Returns: TokenBucket
+        External Modifications: None
+    '''
+
+    host = urllib.parse.urlsplit(url).hostname or ''
+
+    with _buckets_lock:
+        bucket = _buckets.get(host)
+
+        if bucket is None:
+            bucket = TokenBucket(*RATE_LIMITS.get(host, DEFAULT_RATE_LIMIT))
+            _buckets[host] = bucket
+
+    return bucket
+
+# Works out how long the site asked us to wait
+# Returns: Seconds, or None if it didn't say (or said something we can't read)
+# External Modifications: None
+def parseRetryAfter(value):
+    '''Works out how long the site asked us to wait
+
+        Arguments:
+            value: The Retry-After header (either seconds or an HTTP date)
+        Returns: Seconds, or None if it didn't say (or said something we can't read)
+        External Modifications: None
+    '''
+
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if when is None:
+        return None
+
+    return max(0.0, when.timestamp() - time.time())
+
+# Works out how long to wait before the next try
+# Returns: Seconds
+# External Modifications: None
+def backoff(attempt, retry_after=None):
+    '''Works out how long to wait before the next try. Doubles every time with "full jitter" (a random
+            amount up to the doubled time) so a bunch of threads don't all come back at once. If the site
+            said how long to wait, we wait at least that long (up to RETRY_AFTER_MAX, see 'checkRetryAfter').
+
+        Arguments:
+            attempt: How many tries have failed so far (starting at 0)
+            retry_after: Seconds the site asked us to wait, if it said
+        Returns: Seconds
+        External Modifications: None
+    '''
+
+    wait = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+    # Never come back before the site told us to
+    if retry_after is not None:
+        wait = max(wait, min(retry_after, RETRY_AFTER_MAX))
+
+    return wait
+
+# Works out how long the site asked us to wait, giving up if it's too long to sit there for
+# Returns: Seconds, or None if it didn't say
+# External Modifications: None
+def checkRetryAfter(url, status, value):
+    '''Works out how long the site asked us to wait (shared by 'get' and 'AsyncLookup.fetch'). Waiting
+            holds up every worker visiting the site (and the menus just sit there), so if the site wants
+            us gone for longer than RETRY_AFTER_MAX, the visit gets given up on instead.
+
+        Arguments:
+            url: URL that was visited
+            status: HTTP status the site answered with
+            value: The Retry-After header (or None)
+        Returns: Seconds, or None if it didn't say
+        Raises: UpstreamError if the site asked us to wait longer than RETRY_AFTER_MAX
+        External Modifications: None
+    '''
+
+    retry_after = parseRetryAfter(value)
+
+    if retry_after is not None and retry_after > RETRY_AFTER_MAX:
+        stats.count('gave up ' + (urllib.parse.urlsplit(url).hostname or ''))
+        raise UpstreamError(url + " answered " + str(status) + " and asked us to come back in " + str(int(retry_after)) + " seconds", status)
+
+    return retry_after
+
+# Answers a visit out of the archive being played back
+# Returns: Archive.ArchivedResponse
+# External Modifications: None
+def replay(recorder, url):
+    '''Answers a visit out of the archive being played back (shared by 'get' and 'AsyncLookup.fetch')
+
+        Arguments:
+            recorder: Archive.ResponseArchive being played back
+            url: URL to visit
+        Returns: Archive.ArchivedResponse
+        Raises: UpstreamError if the URL isn't in the archive (the same as a site that never answered)
+        External Modifications: None
+    '''
+
+    response = recorder.replay(url)
+
+    if response is None:
+        stats.count('replay misses')
+        raise UpstreamError(url + " isn't in the archive being played back (" + recorder.path + ")")
+
+    stats.count('replay hits')
+
+    return response
+
+# Visits a URL using the pooled connections for its site, staying under its rate limit and retrying when it struggles
+# Returns: requests.Response
+# External Modifications: Visits the URL (maybe several times). Sleeps while waiting on the rate limit or backoff
+def get(url):
+    '''Visits a URL using the pooled connections for its site, staying under its rate limit and retrying
+            throttled (429), broken (5xx), and timed out visits with exponential backoff and jitter.
+
+        Arguments:
+            url: URL to visit
+        Returns: requests.Response (or Archive.ArchivedResponse when playing back an archive)
+        Raises: UpstreamError if the site still won't answer properly after 'MAX_RETRIES' retries (or if the
+                URL isn't in the archive being played back)
+        External Modifications: Visits the URL (maybe several times). Sleeps while waiting on the rate limit or backoff.
+                                Saves the answer to the archive being recorded
+    '''
+
+    recorder = archive.getArchive()
+    if recorder is not None and recorder.replaying:
+        return replay(recorder, url)
+
+    bucket = getBucket(url)
+    host = urllib.parse.urlsplit(url).hostname or ''
+
+    for attempt in range(MAX_RETRIES + 1):
+        if attempt > 0:
+            stats.count('retries ' + host)
+
+        # Time spent waiting our turn is its own stage, so a slow site and a tight rate limit look different
+        with stats.timer('rate limit ' + host):
+            bucket.acquire()
+
+        try:
+            with stats.timer('http ' + host):
+                response = getSession(url).get(url, timeout=TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout) as error:
+            stats.count('connection errors ' + host)
+            if attempt == MAX_RETRIES:
+                stats.count('gave up ' + host)
+                raise UpstreamError("Couldn't reach " + url + ": " + str(error))
+            time.sleep(backoff(attempt))
+            continue
+
+        stats.count('requests ' + host)
+        stats.count('bytes ' + host, len(response.content))
+
+        if response.status_code not in RETRY_STATUSES:
+            bucket.speedUp()
+            if recorder is not None:
+                recorder.record(url, response.status_code, response.content)
+            return response
+
+        stats.count('status ' + str(response.status_code) + ' ' + host)
+
+        if attempt == MAX_RETRIES:
+            stats.count('gave up ' + host)
+            raise UpstreamError(url + " kept answering " + str(response.status_code), response.status_code)
+
+        # Throttled. Everybody visiting this site waits (and slows down afterwards), not just us
+        if response.status_code == 429:
+            bucket.slowDown()
+
+        wait = backoff(attempt, checkRetryAfter(url, response.status_code, response.headers.get('Retry-After')))
+        bucket.pause(wait)
+        time.sleep(wait)
+
+    return response
+
+
+
+
+
+##### MAIN #####
+if __name__ == '__main__':
+    print("Hello, World!")
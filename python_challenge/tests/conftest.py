@@ -0,0 +1,8 @@
+#! python3
+
+# conftest.py - A script that handles letting the tests import the scripts the same way they import each other
+
+import os.path
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,90 @@
+#! python3
+
+# test_Archive.py - A script that handles testing 'Archive.py'
+
+import os
+import pytest
+import Archive as archive
+
+RDAP_URL = 'https://rdap.apnic.net/ip/{}'
+
+# Bytes that aren't proper UTF-8 have to come back exactly as they went in
+ODD_BODY = b'{"name": "caf\xe9"}\xff'
+
+
+
+# Records a few answers (two IPs share a body, like IPs in the same network block)
+def _recordSome(path, first=1):
+    recording = archive.ResponseArchive(path, archive.RECORD)
+    for number in range(first, first + 5):
+        recording.record(RDAP_URL.format('1.0.0.' + str(number)), 200, b'{"handle": "BLOCK-' + str(number // 2).encode() + b'"}')
+    recording.record(RDAP_URL.format('9.9.9.9'), 404, ODD_BODY)
+    recording.close()
+    return recording
+
+def test_record_and_replay(tmp_path):
+    path = str(tmp_path / 'run.grip.gz')
+    _recordSome(path)
+
+    replaying = archive.ResponseArchive(path, archive.REPLAY)
+    assert len(replaying) == 6
+    assert RDAP_URL.format('1.0.0.3') in replaying
+
+    answer = replaying.replay(RDAP_URL.format('1.0.0.3'))
+    assert answer.status_code == 200
+    assert answer.content == b'{"handle": "BLOCK-1"}'
+    assert answer.text == '{"handle": "BLOCK-1"}'
+
+    assert replaying.replay(RDAP_URL.format('9.9.9.9')).content == ODD_BODY
+    assert replaying.replay(RDAP_URL.format('8.8.8.8')) is None
+
+    assert sorted(url for url, status, body in replaying.answers(RDAP_URL.format('1.'))) == \
+           sorted(RDAP_URL.format('1.0.0.' + str(number)) for number in range(1, 6))
+
+    # Nothing gets written while playing back
+    replaying.record(RDAP_URL.format('8.8.8.8'), 200, b'{}')
+    assert archive.ResponseArchive(path, archive.REPLAY).replay(RDAP_URL.format('8.8.8.8')) is None
+
+def test_recording_again_adds_to_the_file(tmp_path):
+    path = str(tmp_path / 'run.grip.gz')
+    _recordSome(path)
+    _recordSome(path, first=100)
+
+    replaying = archive.ResponseArchive(path, archive.REPLAY)
+    assert len(replaying) == 11
+    assert replaying.replay(RDAP_URL.format('1.0.0.1')).content == b'{"handle": "BLOCK-0"}'
+    assert replaying.replay(RDAP_URL.format('1.0.0.104')).content == b'{"handle": "BLOCK-52"}'
+
+def test_truncated_last_member(tmp_path):
+    path = str(tmp_path / 'run.grip.gz')
+    _recordSome(path)
+    first_size = os.path.getsize(path)
+
+    # A second run that got killed partway through writing
+    _recordSome(path, first=100)
+    with open(path, 'r+b') as myfile:
+        myfile.truncate(first_size + (os.path.getsize(path) - first_size) // 2)
+
+    # Everything from the first run still plays back
+    replaying = archive.ResponseArchive(path, archive.REPLAY)
+    assert replaying._cut_off
+    for number in range(1, 6):
+        assert replaying.replay(RDAP_URL.format('1.0.0.' + str(number))) is not None
+    assert replaying.replay(RDAP_URL.format('9.9.9.9')).content == ODD_BODY
+
+    # Recording onto it gets rid of the cut first, so the new answers can be read back too
+    recording = archive.ResponseArchive(path, archive.RECORD)
+    recording.record(RDAP_URL.format('7.7.7.7'), 200, b'{"handle": "NEW"}')
+    recording.close()
+
+    replaying = archive.ResponseArchive(path, archive.REPLAY)
+    assert replaying.replay(RDAP_URL.format('7.7.7.7')).content == b'{"handle": "NEW"}'
+    assert replaying.replay(RDAP_URL.format('1.0.0.5')).content == b'{"handle": "BLOCK-2"}'
+    assert not os.path.exists(path + '.tmp')
+
+def test_bad_archives(tmp_path):
+    with pytest.raises(archive.ArchiveError):
+        archive.ResponseArchive(str(tmp_path / 'missing.grip.gz'), archive.REPLAY)
+
+    with pytest.raises(ValueError):
+        archive.ResponseArchive(str(tmp_path / 'run.grip.gz'), 'rewind')
@@ -0,0 +1,85 @@
+#! python3
+
+# test_AsyncLookup.py - A script that handles testing 'AsyncLookup.py' against the pretend sites in 'Benchmark.py'
+
+import asyncio
+import concurrent.futures
+import pytest
+import AsyncLookup as asyncl
+import Benchmark as bench
+import Cache
+import GEOIP as geo
+import RDAP as rdap
+import Transport as transport
+
+# Public IPs (with some repeats) plus one private one that never gets asked about
+IPS = ['8.8.8.8', '1.1.1.1', '8.8.8.8', '9.9.9.9', '10.0.0.1', '1.1.1.1', '4.4.4.4']
+
+
+
+# Pretend RDAP/GeoIP sites, with everything pointed at them and no caches left over from anything else
+@pytest.fixture
+def stub(monkeypatch):
+    server = bench.StubServer().start()
+
+    monkeypatch.setattr(rdap, 'RDAP_addr', server.url + '/ip/{}')
+    monkeypatch.setattr(geo, 'GEOIP_addr', server.url + '/?query={}')
+    geo.setLocalDatabase(None)
+    transport.setRateLimit('127.0.0.1', 100000)
+    Cache.setDefaultCache(None)
+
+    yield server
+
+    Cache.setDefaultCache(None)
+    server.stop()
+
+# Worker threads that blow up if anything gets handed to them
+class _NoThreads(concurrent.futures.ThreadPoolExecutor):
+    def submit(self, *args, **kwargs):
+        raise AssertionError("Something left the event loop")
+
+# Runs 'enrichMany' on a fresh event loop
+def _enrich(IPs, executor=None, **options):
+    loop = asyncio.new_event_loop()
+    if executor is not None:
+        loop.set_default_executor(executor)
+
+    try:
+        return loop.run_until_complete(asyncl.enrichMany(IPs, **options))
+    finally:
+        loop.run_until_complete(asyncl.closeConnections())
+        loop.close()
+
+
+def test_enrich_many_answers_in_order(stub):
+    results = _enrich(IPS, limit=4)
+
+    assert [ip for ip, geo_data, rdap_text in results] == IPS
+
+    for ip, geo_data, rdap_text in results:
+        if ip == '10.0.0.1':
+            assert rdap_text is None
+            continue
+        assert geo.parseGEO(geo_data).isp == 'Benchmark ISP'
+        assert rdap_text['startAddress'] == ip
+
+
+def test_enrich_many_stays_on_the_loop_without_a_disk_cache(stub):
+    results = _enrich(IPS * 3, executor=_NoThreads(1), compact=True)
+
+    assert len(results) == len(IPS) * 3
+    assert results[-1][2].asDict()['startAddress'] == '4.4.4.4'
+
+
+def test_enrich_many_uses_the_disk_cache(stub, tmp_path):
+    Cache.setDefaultCache(Cache.ResponseCache(str(tmp_path)))
+
+    first = _enrich(IPS)
+    visits = stub.counts['requests']
+
+    # Same IPs again with the known network blocks forgotten. Everything comes off the disk
+    Cache.setDefaultCache(Cache.ResponseCache(str(tmp_path)))
+    second = _enrich(IPS)
+
+    assert stub.counts['requests'] == visits
+    assert [rdap_text for ip, geo_data, rdap_text in second] == [rdap_text for ip, geo_data, rdap_text in first]
@@ -0,0 +1,97 @@
+#! python3
+
+# test_Cache.py - A script that handles testing the network block cache in 'Cache.py'
+
+import itertools
+import random
+import Cache
+import Parse as par
+
+
+
+# An RDAP answer for the block from 'start' to 'end'
+def _block(start, end, kind='ASSIGNED PORTABLE'):
+    return {'handle': start + ' - ' + end, 'name': 'TEST-NET', 'type': kind,
+            'startAddress': start, 'endAddress': end}
+
+# The smallest block holding the IP, found the slow way
+def _smallest(blocks, ip):
+    number = par.ipToInt(ip)
+    holding = [block for block in blocks
+               if par.ipToInt(block['startAddress']) <= number <= par.ipToInt(block['endAddress'])]
+    if not holding:
+        return None
+    return min(holding, key=lambda block: par.ipToInt(block['endAddress']) - par.ipToInt(block['startAddress']))
+
+def test_nested_blocks_in_any_order():
+    wide = _block('10.0.0.0', '10.0.255.255')
+    narrow = _block('10.0.5.0', '10.0.5.255')
+
+    for blocks in ([wide, narrow], [narrow, wide]):
+        cache = Cache.RangeCache()
+        for block in blocks:
+            assert cache.add(block['startAddress'], block)
+
+        assert cache.lookup('10.0.5.7') is narrow
+        assert cache.lookup('10.0.5.0') is narrow
+        assert cache.lookup('10.0.6.1') is wide
+        assert cache.lookup('10.0.0.0') is wide
+        assert cache.lookup('10.1.0.0') is None
+        assert cache.lookup('9.255.255.255') is None
+
+def test_deep_nesting_and_neighbours_match_a_slow_search():
+    blocks = [_block('10.0.0.0', '10.255.255.255'),
+              _block('10.1.0.0', '10.1.255.255'),
+              _block('10.1.0.0', '10.1.0.255'),
+              _block('10.1.0.16', '10.1.0.31'),
+              _block('10.1.0.32', '10.1.0.47'),
+              _block('10.1.1.0', '10.1.1.255'),
+              _block('10.2.0.0', '10.2.0.255'),
+              _block('10.1.255.0', '10.1.255.255'),
+              _block('11.0.0.0', '11.0.0.0')]
+
+    ips = ['10.0.0.1', '10.1.0.0', '10.1.0.15', '10.1.0.16', '10.1.0.31', '10.1.0.32', '10.1.0.48',
+           '10.1.1.9', '10.1.2.0', '10.1.255.255', '10.2.0.200', '10.2.1.0', '11.0.0.0', '11.0.0.1', '9.0.0.0']
+
+    shuffler = random.Random(5)
+    orders = [blocks, list(reversed(blocks))] + [shuffler.sample(blocks, len(blocks)) for attempt in range(20)]
+
+    for order in orders:
+        cache = Cache.RangeCache()
+        for block in order:
+            assert cache.add(block['startAddress'], block)
+
+        for ip in ips:
+            assert cache.lookup(ip) is _smallest(blocks, ip), ip
+
+def test_half_overlapping_blocks_get_turned_away():
+    first = _block('10.0.0.0', '10.0.1.255')
+    second = _block('10.0.1.0', '10.0.2.255')
+    before = _block('9.255.255.0', '10.0.0.127')
+
+    for blocks in itertools.permutations([first, second, before]):
+        cache = Cache.RangeCache()
+        kept = [block for block in blocks if cache.add(block['startAddress'], block)]
+
+        # Whichever went in first wins, and nothing that half-overlaps it gets in after
+        assert kept[0] is blocks[0]
+        for block in kept:
+            assert cache.lookup(block['endAddress']) is block
+
+        for ip in ['9.255.255.1', '10.0.0.5', '10.0.1.5', '10.0.2.5']:
+            assert cache.lookup(ip) is _smallest(kept, ip)
+
+def test_same_block_gets_replaced_and_allocations_stay_out():
+    cache = Cache.RangeCache()
+    old = _block('10.0.0.0', '10.0.0.255')
+    new = _block('10.0.0.0', '10.0.0.255')
+
+    assert cache.add('10.0.0.1', old)
+    assert cache.add('10.0.0.2', new)
+    assert cache.lookup('10.0.0.3') is new
+
+    assert not cache.add('10.1.0.1', _block('10.1.0.0', '10.1.255.255', kind='ALLOCATED PORTABLE'))
+    assert cache.lookup('10.1.0.1') is None
+
+    # The IP has to be inside the block it got answered with
+    assert not cache.add('10.2.0.1', _block('10.3.0.0', '10.3.0.255'))
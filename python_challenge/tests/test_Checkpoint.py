@@ -0,0 +1,132 @@
+#! python3
+
+# test_Checkpoint.py - A script that handles testing 'Checkpoint.py'
+
+import gzip
+import Batch as batch
+import Checkpoint as ckpt
+
+RUN = {'file': 'ips.txt', 'options': {'data': '2'}}
+
+# 10 lookups, the site wouldn't answer 3 and 7
+FAILED = {3, 7}
+
+
+
+# Makes the lookups a run would get back
+def _lookups(numbers, failed=()):
+    for number in numbers:
+        ip = '1.0.0.' + str(number)
+        if number in failed:
+            yield batch.Lookup((ip, None, None), failed=True)
+        else:
+            yield batch.Lookup((ip, None, {'handle': 'NET-' + str(number)}))
+
+# Stands in for 'Batch.enrichIPs' when the run gets picked back up (everything answers this time)
+class _Retry():
+    def __init__(self):
+        self.asked = []
+
+    def __call__(self, IPs):
+        for ip in IPs:
+            self.asked.append(ip)
+            yield batch.Lookup((ip, None, {'handle': 'RETRY-' + ip}))
+
+# Runs until 'stop' lookups have come out, then dies without saving anything else (like a crash)
+def _runUntil(checkpoint, results, stop, retry=None):
+    seen = []
+    run = checkpoint.run(results, retry=retry)
+    for result in run:
+        seen.append(result)
+        if len(seen) == stop:
+            break
+    return seen
+
+
+def test_failed_lookups_get_looked_up_again_after_a_crash(tmp_path):
+    path = str(tmp_path / 'ips.txt.grip-checkpoint')
+
+    checkpoint = ckpt.BatchCheckpoint(path, RUN, every=0)
+    assert checkpoint.load() == 0
+    first = _runUntil(checkpoint, _lookups(range(10), FAILED), 6)
+    assert len(first) == 6
+
+    # Picked back up: 3 gets asked about again, 7 hasn't been looked up yet at all
+    retry = _Retry()
+    checkpoint = ckpt.BatchCheckpoint(path, RUN, every=0)
+    assert checkpoint.load() == 6
+    second = list(checkpoint.run(_lookups(range(6, 10), FAILED), retry=retry))
+
+    assert retry.asked == ['1.0.0.3']
+    assert [ip for ip, geo_data, rdap_text in second] == ['1.0.0.' + str(number) for number in range(10)]
+    assert second[3][2] == {'handle': 'RETRY-1.0.0.3'}
+    assert second[5][2] == {'handle': 'NET-5'}
+    assert second[7][2] is None
+
+
+def test_looked_up_again_answers_are_saved(tmp_path):
+    path = str(tmp_path / 'ips.txt.grip-checkpoint')
+
+    checkpoint = ckpt.BatchCheckpoint(path, RUN, every=0)
+    checkpoint.load()
+    _runUntil(checkpoint, _lookups(range(10), FAILED), 8)
+
+    # Dies again right after 3 and 7 got their answers
+    retry = _Retry()
+    checkpoint = ckpt.BatchCheckpoint(path, RUN, every=0)
+    assert checkpoint.load() == 8
+    _runUntil(checkpoint, _lookups(range(8, 10), FAILED), 8, retry=retry)
+    assert retry.asked == ['1.0.0.3', '1.0.0.7']
+
+    # Nothing left to ask about again
+    retry = _Retry()
+    checkpoint = ckpt.BatchCheckpoint(path, RUN, every=0)
+    assert checkpoint.load() == 8
+    third = list(checkpoint.run(_lookups(range(8, 10)), retry=retry))
+
+    assert retry.asked == []
+    assert third[7][2] == {'handle': 'RETRY-1.0.0.7'}
+    assert len(third) == 10
+
+
+def test_without_retry_failed_lookups_come_back_empty(tmp_path):
+    path = str(tmp_path / 'ips.txt.grip-checkpoint')
+
+    checkpoint = ckpt.BatchCheckpoint(path, RUN, every=0)
+    checkpoint.load()
+    _runUntil(checkpoint, _lookups(range(10), FAILED), 5)
+
+    checkpoint = ckpt.BatchCheckpoint(path, RUN, every=0)
+    checkpoint.load()
+    results = list(checkpoint.run(_lookups(range(5, 10))))
+
+    assert results[3] == ('1.0.0.3', None, None)
+    assert len(results) == 10
+
+
+def test_cut_off_save_gets_rewritten(tmp_path):
+    path = str(tmp_path / 'ips.txt.grip-checkpoint')
+
+    checkpoint = ckpt.BatchCheckpoint(path, RUN, every=0)
+    checkpoint.load()
+    _runUntil(checkpoint, _lookups(range(10)), 4)
+
+    # A save that only got halfway onto the disk
+    member = gzip.compress(b'["1.0.0.4",null,null]\n{"done": 5}\n')
+    with open(path, 'ab') as myfile:
+        myfile.write(member[:len(member) // 2])
+
+    checkpoint = ckpt.BatchCheckpoint(path, RUN, every=0)
+    assert checkpoint.load() == 4
+
+    # Written back out clean, so whatever gets saved after it can be read back
+    with gzip.open(path, 'rt') as myfile:
+        assert len(myfile.read().splitlines()) == 6
+
+    _runUntil(checkpoint, _lookups(range(4, 10)), 7)
+
+    checkpoint = ckpt.BatchCheckpoint(path, RUN, every=0)
+    assert checkpoint.load() == 7
+    results = list(checkpoint.run(_lookups(range(7, 10))))
+
+    assert [rdap_text['handle'] for ip, geo_data, rdap_text in results] == ['NET-' + str(number) for number in range(10)]
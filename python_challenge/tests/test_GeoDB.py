@@ -0,0 +1,57 @@
+#! python3
+
+# test_GeoDB.py - A script that handles testing 'GeoDB.py'
+
+import csv
+import GeoDB as geodb
+
+# Longer than the 2 byte length in the string pool, and 0xFFFF lands in the middle of one of the characters
+LONG_CITY = 'é' * 40000
+
+ROWS = [['start_ip', 'end_ip', 'country_code', 'country_name', 'city', 'isp', 'latitude', 'longitude'],
+        ['1.0.0.0', '1.0.0.255', 'AU', 'Australia', 'Brisbane', 'APNIC', '-27.47', '153.02'],
+        ['16777472', '16777727', 'CN', 'China', '福州', '中国电信', '26.06', '119.30'],
+        ['8.8.8.0', '8.8.8.255', 'US', 'United States', LONG_CITY, 'Google', '37.40', '-122.08'],
+        # Narrower range inside the first one
+        ['1.0.0.16', '1.0.0.31', 'AU', 'Australia', 'München', 'Test ISP', '0', '0']
+        ]
+
+
+
+# Writes the range table CSV
+def _writeCSV(path):
+    with open(path, 'w', newline='', encoding='utf-8') as myfile:
+        csv.writer(myfile).writerows(ROWS)
+    return path
+
+def test_save_and_mapped_lookups_match(tmp_path):
+    csv_path = _writeCSV(str(tmp_path / 'ranges.csv'))
+    bin_path = str(tmp_path / 'ranges.bin')
+
+    assert geodb.buildBinary(csv_path, bin_path) == 5
+
+    loaded = geodb.GeoRangeDB(csv_path)
+    mapped = geodb.openDatabase(bin_path)
+    assert isinstance(mapped, geodb.MappedGeoDB)
+    assert len(mapped) == len(loaded)
+
+    for ip in ['1.0.0.0', '1.0.0.15', '1.0.0.16', '1.0.0.31', '1.0.0.32', '1.0.0.255', '1.0.1.7', '8.8.8.8', '9.9.9.9', 'nope']:
+        expected = loaded.lookup(ip)
+        if ip == '8.8.8.8':
+            # The only field that had to be cut
+            assert expected['city'] == LONG_CITY
+            expected = dict(expected, city=mapped.lookup(ip)['city'])
+        assert mapped.lookup(ip) == expected
+
+    assert mapped.lookup('1.0.0.20')['city'] == 'München'
+    assert mapped.lookup('1.0.1.1')['isp'] == '中国电信'
+
+def test_long_strings_get_cut_on_a_character(tmp_path):
+    bin_path = str(tmp_path / 'ranges.bin')
+    geodb.buildBinary(_writeCSV(str(tmp_path / 'ranges.csv')), bin_path)
+
+    city = geodb.MappedGeoDB(bin_path).lookup('8.8.8.8')['city']
+
+    assert len(city.encode('utf-8')) <= 0xFFFF
+    assert city == LONG_CITY[:len(city)]
+    assert len(city) == 0xFFFF // 2
@@ -0,0 +1,179 @@
+#! python3
+
+# test_Parse.py - A script that handles testing 'Parse.py'
+
+import collections
+import random
+import Parse as par
+
+# IPs up against each other, inside words, split by odd characters, and next to runs of digits too long to be IPs
+TEXT = ('1.2.3.4 10.0.0.1,192.168.1.1;8.8.8.8\n'
+        'host=172.16.254.1:443 [2001:db8::1] 255.255.255.255.\n'
+        '1.2.3.4.5 999.1.1.1 01.02.03.04 0.0.0.0\n'
+        'abc123.45.67.89def 12345678901234567890 1.1.1 1..1.1.1\n'
+        '...4.4.4.4... 3.3.3.3\t5.5.5.5\r\n'
+        'end of file 6.6.6.6')
+
+
+
+# Writes some text to a file to be parsed
+def _writeFile(tmp_path, text):
+    path = tmp_path / 'ips.txt'
+    path.write_text(text)
+    return str(path)
+
+# Random lines of IPs and junk, so chunk edges land all over the place
+def _randomText(seed, lines=300):
+    randomizer = random.Random(seed)
+    pieces = []
+    for line in range(lines):
+        words = []
+        for word in range(randomizer.randint(0, 6)):
+            kind = randomizer.random()
+            if kind < 0.5:
+                words.append('.'.join(str(randomizer.randint(0, 300)) for octet in range(4)))
+            elif kind < 0.7:
+                words.append(str(randomizer.randint(0, 10 ** 12)))
+            elif kind < 0.8:
+                words.append('.' * randomizer.randint(1, 3))
+            else:
+                words.append(randomizer.choice(['ip', 'from', 'x', '-', ':80', 'v4']))
+        pieces.append(randomizer.choice([' ', ',', '', '\t']).join(words))
+    return '\n'.join(pieces)
+
+def test_safe_cut():
+    assert par._findSafeCut('') == -1
+    assert par._findSafeCut('1.2.3.4') == -1
+    assert par._findSafeCut('abc 1.2.3') == 3
+    assert par._findSafeCut('1.2.3.4 ') == 7
+    assert par._findSafeCut('x\n10.0.') == 1
+
+def test_chunked_matches_whole_text(tmp_path):
+    path = _writeFile(tmp_path, TEXT)
+    expected = par.ALL_IPV4_FORMAT_REGEX.findall(TEXT)
+
+    assert expected
+    assert par.getIPs(path) == expected
+
+    for chunk_size in list(range(1, 40)) + [64, 100, len(TEXT) - 1, len(TEXT), len(TEXT) + 1, par.CHUNK_SIZE]:
+        assert list(par.iterIPs(path, chunk_size=chunk_size)) == expected, chunk_size
+
+def test_chunked_matches_whole_text_on_random_files(tmp_path):
+    for seed in range(5):
+        text = _randomText(seed)
+        path = _writeFile(tmp_path, text)
+        expected = par.ALL_IPV4_FORMAT_REGEX.findall(text)
+
+        for chunk_size in [1, 2, 3, 7, 15, 16, 17, 31, 64, 257, 4096]:
+            assert list(par.iterIPs(path, chunk_size=chunk_size)) == expected, (seed, chunk_size)
+
+def test_nothing_but_digits_and_dots(tmp_path):
+    # No safe place to cut until the very end, so it all gets carried over
+    text = '1.2.3.4' + '.1.2.3.4' * 50
+    path = _writeFile(tmp_path, text)
+
+    assert list(par.iterIPs(path, chunk_size=4)) == par.ALL_IPV4_FORMAT_REGEX.findall(text)
+
+def test_missing_file(tmp_path):
+    assert list(par.iterIPs(str(tmp_path / 'nope.txt'))) == []
+
+# Lots of repeats, a few things that aren't real IPs, and some already packed
+def _sightings(seed, count=5000):
+    randomizer = random.Random(seed)
+    sightings = []
+    for sighting in range(count):
+        kind = randomizer.random()
+        if kind < 0.05:
+            sightings.append(randomizer.choice(['999.1.1.1', '1.2.3.256', 'not an ip']))
+        elif kind < 0.2:
+            sightings.append(randomizer.randint(0, 0xFFFFFFFF) if kind < 0.1 else randomizer.randint(0, 50))
+        else:
+            sightings.append('10.0.' + str(randomizer.randint(0, 3)) + '.' + str(randomizer.randint(0, 255)))
+    return sightings
+
+# What the counter should say each sighting is, as a string
+def _asString(ip):
+    return par.intToIP(ip) if isinstance(ip, int) else ip
+
+def test_counter_matches_collections_counter(monkeypatch):
+    for merge_min in (par.IPCounter.MERGE_MIN, 1, 7, 64):
+        monkeypatch.setattr(par.IPCounter, 'MERGE_MIN', merge_min)
+
+        for seed in range(3):
+            sightings = _sightings(seed)
+            expected = collections.Counter()
+            counter = par.IPCounter()
+
+            for ip in sightings:
+                first = _asString(ip) not in expected
+                expected[_asString(ip)] += 1
+                assert counter.add(ip) == first
+
+            # Same IPs, same counts, same first-seen order
+            assert len(counter) == len(expected)
+            assert list(counter.items()) == list(expected.items())
+            assert list(counter.ips()) == list(expected)
+
+            for ip in set(sightings):
+                assert counter.count(ip) == expected[_asString(ip)]
+                assert counter.count(_asString(ip)) == expected[_asString(ip)]
+
+            assert counter.count('11.0.0.1') == 0
+            assert counter.count('888.1.1.1') == 0
+
+def test_count_ips():
+    sightings = _sightings(9, count=2000)
+    counter = par.countIPs(sightings)
+
+    assert list(counter.items()) == list(collections.Counter(_asString(ip) for ip in sightings).items())
+
+# Real IPs with every kind of thing that can't be one mixed in (too many or too few octets, blank octets,
+#       octets over 255, signs and letters), so a bad one lands in the middle of a batch
+def _mixedIPs(seed, count=3000):
+    randomizer = random.Random(seed)
+    bad = ['1.2.3.4.5', '1.2.3', '1..2.3', '.1.2.3', '1.2.3.', '256.1.1.1', '1.2.3.999', '+1.2.3.4', '1.-2.3.4', '', '.', 'a.b.c.d']
+    IPs = []
+    for item in range(count):
+        if randomizer.random() < 0.1:
+            IPs.append(randomizer.choice(bad))
+        else:
+            IPs.append('.'.join(str(randomizer.randint(0, 255)) for octet in range(4)))
+    return IPs
+
+def test_pack_matches_one_at_a_time():
+    for seed in range(3):
+        IPs = _mixedIPs(seed)
+        expected = [number for number in map(par.ipToInt, IPs) if number is not None]
+
+        for batch_size in (1, 2, 3, 5, 64, 1000, par.PACK_BATCH):
+            packed, rejected = par.packIPs(IPs, batch_size=batch_size)
+            assert list(packed) == expected, (seed, batch_size)
+            assert rejected == len(IPs) - len(expected)
+
+        assert list(par.unpackIPs(expected)) == [par.intToIP(number) for number in expected]
+
+def test_stream_matches_pack():
+    IPs = _mixedIPs(7)
+    packed, rejected = par.packIPs(IPs)
+
+    for batch_size in (1, 4, 100, par.PACK_BATCH):
+        stream = par.IPStream(iter(IPs), batch_size=batch_size)
+        assert list(stream.packed()) == list(packed)
+        assert stream.rejected == rejected
+
+        stream = par.IPStream(iter(IPs), batch_size=batch_size)
+        assert list(stream) == list(par.unpackIPs(packed))
+        assert stream.rejected == rejected
+
+def test_stream_only_reads_a_batch_ahead():
+    pulled = []
+
+    def source():
+        for ip in _mixedIPs(8, count=1000):
+            pulled.append(ip)
+            yield ip
+
+    stream = iter(par.IPStream(source(), batch_size=50))
+    next(stream)
+
+    assert len(pulled) == 50
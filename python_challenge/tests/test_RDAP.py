@@ -0,0 +1,85 @@
+#! python3
+
+# test_RDAP.py - A script that handles testing the update entry functions in 'RDAP.py'
+
+import RDAP as rdap
+
+# Hundreds of update entries, all on one of three days (lots of ties)
+COUNT = 300
+DAYS = ['2015-03-01T00:00:00Z', '2019-11-20T08:30:00Z', '2012-06-15T12:00:00Z']
+
+
+
+# An RDAP answer with the update entries under the first entity, plus a newer registrant that isn't one of them
+def _answer():
+    entries = []
+    for number in range(COUNT):
+        entries.append({'handle': 'ENTRY-' + str(number),
+                        'events': [{'eventAction': 'last changed', 'eventDate': DAYS[number % 3]},
+                                   {'eventAction': 'registration', 'eventDate': DAYS[(number + 1) % 3]}]
+                        })
+
+    # An entry without a date always goes last
+    entries.append({'handle': 'ENTRY-NODATE', 'events': []})
+
+    return {'handle': '1.0.0.0 - 1.0.0.255',
+            'events': [{'eventAction': 'last changed', 'eventDate': '2024-01-01T00:00:00Z'}],
+            'entities': [{'handle': 'ORG-TEST',
+                          'roles': ['registrant'],
+                          'events': [{'eventAction': 'last changed', 'eventDate': '2023-01-01T00:00:00Z'}],
+                          'entities': entries
+                          }]
+            }
+
+# Stands in for a 'Session.IPLookup' so nothing visits the RDAP site
+class _Lookup():
+    def __init__(self, rdap_text):
+        self.rdap_text = rdap_text
+
+    def getRDAPText(self):
+        return self.rdap_text
+
+def test_order_keeps_every_entry_once_with_ties_in_order():
+    handles = [entry['handle'] for entry in rdap.orderEntries(_answer(), 0)]
+
+    assert len(handles) == COUNT + 1
+    assert len(set(handles)) == len(handles)
+    assert 'ORG-TEST' not in handles
+
+    # Newest day first, each day in the order the entries showed up, the undated one last
+    expected = ['ENTRY-' + str(number) for day in (1, 0, 2) for number in range(COUNT) if number % 3 == day]
+    assert handles == expected + ['ENTRY-NODATE']
+
+def test_oldest_first_and_limit():
+    oldest = [entry['handle'] for entry in rdap.orderEntries(_answer(), 1, newest_first=False)]
+    expected = ['ENTRY-' + str(number) for day in (2, 0, 1) for number in range(COUNT) if (number + 1) % 3 == day]
+    assert oldest == expected + ['ENTRY-NODATE']
+
+    # Asking for a few gives the same ones as the front of the full list
+    assert rdap.orderEntries(_answer(), 1, newest_first=False, limit=5) == rdap.orderEntries(_answer(), 1, newest_first=False)[:5]
+
+def test_pick_goes_to_the_first_of_the_ties():
+    answer = _answer()
+
+    assert rdap.pickEntry(answer, 0, newest=True)['handle'] == 'ENTRY-1'
+    assert rdap.pickEntry(answer, 0, newest=False)['handle'] == 'ENTRY-2'
+    assert rdap.pickEntry(answer, 1, newest=True)['handle'] == 'ENTRY-0'
+    assert rdap.pickEntry(answer, 1, newest=False)['handle'] == 'ENTRY-1'
+
+    assert rdap.returnMostRecentUpdateEntry(_Lookup(answer), 0)['handle'] == 'ENTRY-1'
+    assert rdap.returnOldestUpdateEntry(_Lookup(answer), 0)['handle'] == 'ENTRY-2'
+
+def test_pick_anywhere_looks_past_the_update_entries():
+    answer = _answer()
+
+    assert rdap.pickEntryAnywhere(answer, 0) is answer
+    assert rdap.pickEntryAnywhere(answer, 0, newest=False)['handle'].startswith('ENTRY-')
+
+def test_print_all_prints_each_entry_once(capsys):
+    rdap.printAllUpdateEntries(_Lookup(_answer()), 0)
+    printed = capsys.readouterr().out
+
+    for number in range(COUNT):
+        assert printed.count(' ENTRY-' + str(number) + "'") == 1
+    assert printed.count('ENTRY-NODATE') == 1
+    assert 'ORG-TEST' not in printed